@@ -1,12 +1,39 @@
-from flask import Flask, render_template, send_from_directory, request, Response, jsonify, stream_with_context
+from flask import Flask, abort, render_template, send_file, send_from_directory, request, Response, jsonify, stream_with_context, url_for
+from werkzeug.security import safe_join
 from flask_cors import CORS
 import os
 from dotenv import load_dotenv
 import dashscope
 from dashscope import Generation
 import json
+import mimetypes
+import threading
 import time
+from contextlib import closing
 from http import HTTPStatus
+from itertools import chain
+from pathlib import Path
+
+try:
+    from flask_sock import Sock
+except ImportError:  # WebSocket channel is optional (pip install flask-sock)
+    Sock = None
+
+import asr
+import audio_formats
+import degraded
+import profiling
+import static_bundle
+import tts
+from chat_socket import DuplexChannel, stream_audio
+from chat_stream import TICK, ChatStreamProcessor, ReplyBudget, sse_event
+from circuit_breaker import CircuitOpen
+from context_builder import ContextBuilder
+from model_router import ModelRouter, classify
+from preload_hints import PRELOAD_HINTS, PreloadHints
+from session_turns import SessionTurns, TurnCancelled, TurnMetrics
+from stream_replay import STREAM_RESUME, ReplayStreams
+from transition_model import TransitionModel
 
 # Load environment variables
 load_dotenv()
@@ -21,222 +48,469 @@ dashscope.api_key = os.getenv('DASHSCOPE_API_KEY')
 # In production, use Redis or database
 conversation_histories = {}
 
+# Token-budgeted history window (see context_builder.py for HISTORY_* settings)
+context_builder = ContextBuilder()
+
+# One in-flight turn per session; cancelled turns are counted as wasted work
+session_turns = SessionTurns()
+turn_metrics = TurnMetrics()
+
+# Numbered SSE events of recent chat turns, replayed on reconnect (see stream_replay.py)
+replay_streams = ReplayStreams()
+
+# Model/parameter profile per turn class with fallback (see model_router.py)
+model_router = ModelRouter()
+
+# Admin-only profiling windows; nothing is wrapped or traced until one is opened
+profiler = profiling.Profiler(app)
+
+# Opus/PCM/WAV copies of the acknowledgement clips, encoded on first request
+audio_variants = audio_formats.VariantCache('audio')
+
+# Minified, fingerprinted frontend from static_bundle.py (None: serve the source files)
+STATIC_BUNDLE = os.getenv('STATIC_BUNDLE', 'true').lower() == 'true'
+static_manifest = static_bundle.load_manifest() if STATIC_BUNDLE else None
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+# Link: rel=preload for the page's scripts, config and start set media (see preload_hints.py)
+preload_hints = PreloadHints('config/videosets.json')
+
+# Learned clip-to-clip transitions per set, for "likely next clip" prefetch hints
+transitions = TransitionModel(preload_hints.config)
+
+
+def static_urls(name):
+    """static_urls('app.js') -> the bundle URL, or one URL per source file without a build"""
+    # Debug mode edits the sources directly, so never serve a stale bundle there
+    if static_manifest is not None and not app.debug:
+        return [url_for('serve_bundle', filename=static_manifest['files'][name])]
+    return [url_for('static', filename=source) for source in static_bundle.BUNDLES[name]]
+
+
+@app.context_processor
+def static_assets():
+    return {'static_urls': static_urls}
+
+
+def send_precompressed(path, **kwargs):
+    """send_file() the .br/.gz copy of path that the client accepts (if one was built)"""
+    variant, encoding = static_bundle.precompressed_variant(path, request.accept_encodings)
+    mimetype = mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+    response = send_file(variant, mimetype=mimetype, **kwargs)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
 @app.route('/')
 def index():
-    return render_template('index.html')
+    set_id = preload_hints.resolve_set(request.args.get('set'))
+    links = []
+    if PRELOAD_HINTS:
+        links = preload_hints.links(set_id, scripts=static_urls('app.js'), styles=static_urls('style.css'))
+        # 103 Early Hints, when the server supports it (gunicorn >= 22), before the page is rendered
+        early_hints = request.environ.get('wsgi.early_hints')
+        if early_hints is not None and links:
+            try:
+                early_hints([('Link', value) for value in links])
+            except Exception as e:
+                print(f"Early hints not sent: {e}", flush=True)
+
+    response = app.make_response(render_template('index.html', initial_video=preload_hints.idle_video(set_id),
+                                                 initial_poster=preload_hints.idle_poster(set_id)))
+    for value in links:
+        response.headers.add('Link', value)
+    return response
+
+@app.route('/static/dist/<path:filename>')
+def serve_bundle(filename):
+    """Serve fingerprinted bundle files, precompressed and cached forever"""
+    path = safe_join(str(static_bundle.DIST_DIR), filename)
+    if path is None or not os.path.isfile(path) or filename.endswith(('.gz', '.br')):
+        abort(404)
+    response = send_precompressed(Path(path), max_age=IMMUTABLE_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/videos/<path:filename>')
 def serve_video(filename):
     """Serve video files"""
+    if any(part.startswith('.') for part in filename.split('/')):
+        # Build state (.preview_manifest.json, .fingerprints.json, .build/) is not served
+        abort(404)
     return send_from_directory('videos', filename)
 
 @app.route('/audio/<path:filename>')
 def serve_audio(filename):
-    """Serve audio files for voice acknowledgement"""
-    return send_from_directory('audio', filename)
+    """Serve audio files for voice acknowledgement (Accept or ?format= picks the encoding)"""
+    if any(part.startswith('.') for part in filename.split('/')):
+        # Build state (.variants/, manifests) is not part of the served clips
+        abort(404)
+    source_format = audio_variants.source_format(filename)
+    source = safe_join('audio', filename)
+    if source_format is None or source is None or not os.path.isfile(source):
+        return send_from_directory('audio', filename)
+
+    choice = audio_formats.negotiate(
+        request.accept_mimetypes, request.args.get('format'), request.args.get('sample_rate'),
+        default=source_format, available=audio_variants.available_formats(filename))
+
+    # Unknown or unavailable encodings get the original clip
+    if choice is None or (choice[0] == source_format and not request.args.get('sample_rate')):
+        response = send_from_directory('audio', filename)
+    else:
+        audio_format, sample_rate = choice
+        response = send_file(audio_variants.get(filename, audio_format, sample_rate),
+                             mimetype=audio_formats.content_type(audio_format, sample_rate))
+    response.vary.add('Accept')
+    return response
 
 @app.route('/config/<path:filename>')
 def serve_config(filename):
-    """Serve configuration files"""
-    return send_from_directory('config', filename)
+    """Serve configuration files (precompressed by static_bundle.py when built)
+
+    Once the transition model has hints, videosets.json carries them as
+    `likelyNext` per set and is served uncompressed.
+    """
+    path = safe_join('config', filename)
+    if path is None or not os.path.isfile(path) or filename.endswith(('.gz', '.br')):
+        abort(404)
+    if filename == 'videosets.json' and transitions.has_hints():
+        config = preload_hints.config()
+        if config is not None:
+            return Response(json.dumps(transitions.annotate(config), ensure_ascii=False),
+                            mimetype='application/json', headers={'Cache-Control': 'no-cache'})
+    return send_precompressed(Path(path))
+
+def build_system_prompt(actions):
+    """System prompt with the available actions of the current video set"""
+    system_content = '你是一个甜美、性感、撩人的女孩。你的回答要简短、俏皮、带有一点挑逗的语气。每次回答控制在1-2句话以内，让对话更自然流畅。'
+
+    if actions:
+        system_content += '\n\n你可以执行以下动作：'
+        for action in actions:
+            action_name = action.get('action', '')
+            video_id = action.get('video', '')
+            has_audio = action.get('has_audio', False)
+            keywords = action.get('keywords', [])
+
+            if has_audio:
+                system_content += f'\n- {action_name} (视频: {video_id}, 有预录音频): 当用户要求"{keywords[0]}"等相关动作时调用'
+            else:
+                system_content += f'\n- {action_name} (视频: {video_id}, 需要TTS): 当用户要求"{keywords[0]}"等相关动作时调用'
+
+        system_content += '\n\n重要规则：'
+        system_content += '\n1. 使用语义理解检测用户意图，不要只匹配关键词。例如"扭一下"、"我想看你扭"、"能扭吗"都应该触发扭动作。'
+        system_content += '\n2. 对于有预录音频的视频(has_audio=true)，调用函数时返回空文本，因为视频自带回复。'
+        system_content += '\n3. 对于需要TTS的视频(has_audio=false)，调用函数的同时返回自然的文本回复。'
+        system_content += '\n4. 灵活理解自然语言，不要死板匹配关键词。'
+
+    return system_content
+
+
+def build_tools(actions):
+    """Define function calling tools if actions are available"""
+    if not actions:
+        return None
+
+    return [{
+        "type": "function",
+        "function": {
+            "name": "play_action_video",
+            "description": "Play an action video when user requests a specific action like twist (扭), shake (抖), bounce (颠), or sing/dance (唱歌). Use semantic understanding to detect intent, not just keyword matching.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "action": {
+                        "type": "string",
+                        "description": "The action to perform"
+                    },
+                    "video_id": {
+                        "type": "string",
+                        "description": "The video file to play (e.g., '1.mp4', '2.mp4', '3.mp4', 'dance.mp4')"
+                    },
+                    "has_audio": {
+                        "type": "boolean",
+                        "description": "Whether the video has pre-recorded audio (true) or needs TTS (false)",
+                        "default": False
+                    }
+                },
+                "required": ["action", "video_id"]
+            }
+        }
+    }]
 
-@app.route('/api/chat/stream', methods=['POST'])
-def chat_stream():
-    """Stream LLM responses using DashScope with function calling"""
-    try:
-        data = request.json
-        user_message = data.get('message', '')
-        session_id = data.get('session_id', 'default')
-        actions = data.get('actions', [])  # Available actions from video set config
 
-        if not user_message:
-            return jsonify({'error': 'No message provided'}), 400
+class ChatTurn:
+    """One user message and the upstream call that answers it
+
+    A turn can be cancelled from another thread (the client disconnected or
+    sent a newer message on the same session); frames() then stops pulling
+    the upstream stream and does not write the turn to history. With
+    defer_history the finished turn is only written by commit_history(),
+    once a client actually received the whole reply.
+    """
+
+    def __init__(self, user_message, session_id='default', actions=None, turn_id=None, set_id=None):
+        self.user_message = user_message
+        self.session_id = session_id
+        self.turn_id = turn_id  # Client's id for the turn (WebSocket requests)
+        self.actions = actions or []  # Available actions from video set config
+        self.set_id = set_id  # Client's current video set (transition hints)
 
         # Get or create conversation history for this session
         if session_id not in conversation_histories:
             conversation_histories[session_id] = []
 
-        history = conversation_histories[session_id]
-
-        # Build system prompt with available actions
-        system_content = '你是一个甜美、性感、撩人的女孩。你的回答要简短、俏皮、带有一点挑逗的语气。每次回答控制在1-2句话以内，让对话更自然流畅。'
+        self.history = conversation_histories[session_id]
+        self.tools = build_tools(self.actions)
+        self.messages = None
+        self.full_response = ''
+        self.function_calls = []
+        self.route = None  # Turn class picked by model_router.classify()
+        self.tier = None   # Tier that actually answered (differs after a fallback)
+        self.defer_history = False
+        self._pending_history = None
+
+        self._cancelled = threading.Event()
+        self.cancel_reason = None
+
+    def cancel(self, reason):
+        if not self._cancelled.is_set():
+            self.cancel_reason = reason
+            self._cancelled.set()
+
+    @property
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def commit_history(self):
+        """Write a deferred finished turn to history (once)"""
+        entries, self._pending_history = self._pending_history, None
+        if entries:
+            self.history.extend(entries)
+
+    def build_messages(self):
+        """System prompt and as much recent history as fits the token budget"""
+        self.messages, context_stats = context_builder.build(
+            build_system_prompt(self.actions), self.history, self.user_message,
+            session_id=self.session_id, tools=self.tools)
+        print(f"Chat context: {context_stats}", flush=True)
+
+    def frames(self):
+        """Generator of SSE frames for streaming responses with function calling"""
+        started = time.monotonic()
+        turn_metrics.record_start()
+        outcome = 'failed'
+
+        # One turn per session: supersede the previous one, then read history
+        try:
+            session_turns.acquire(self.session_id, self)
+        except TurnCancelled as e:
+            turn_metrics.record('cancelled', time.monotonic() - started, e.reason)
+            yield sse_event({'type': 'cancelled', 'reason': e.reason})
+            return
+        except TimeoutError as e:
+            turn_metrics.record('failed', time.monotonic() - started)
+            yield sse_event({'type': 'error', 'content': str(e)})
+            return
+
+        responses = None
+        try:
+            self.build_messages()
+            # The set's sentence/character budget; the upstream stream is closed once it is met
+            video_set = (preload_hints.config() or {}).get('sets', {}).get(preload_hints.resolve_set(self.set_id))
+            stream = ChatStreamProcessor(budget=ReplyBudget.for_set(video_set))
+
+            # Call DashScope streaming API with tools; model, temperature and
+            # max_tokens come from the turn's routing profile (max_tokens capped by the budget)
+            call_params = {
+                'messages': self.messages,
+                'result_format': 'message',
+                'stream': True,
+                'incremental_output': True,
+            }
 
-        if actions:
-            system_content += '\n\n你可以执行以下动作：'
-            for action in actions:
-                action_name = action.get('action', '')
-                video_id = action.get('video', '')
-                has_audio = action.get('has_audio', False)
-                keywords = action.get('keywords', [])
+            if self.tools:
+                call_params['tools'] = self.tools
+            # Tokens past the reply budget would be dropped: don't have upstream generate them
+            max_tokens = stream.budget.max_tokens(bool(self.tools)) if stream.budget else None
+            if max_tokens:
+                call_params['max_tokens'] = max_tokens
 
-                if has_audio:
-                    system_content += f'\n- {action_name} (视频: {video_id}, 有预录音频): 当用户要求"{keywords[0]}"等相关动作时调用'
+            self.route, reason = classify(self.user_message, self.actions, self.history)
+            try:
+                self.tier, first, responses = model_router.open(Generation.call, self.route, call_params,
+                                                                self._cancelled)
+            except CircuitOpen:
+                yield from self.degraded_frames()
+                outcome = 'degraded'
+                return
+            print(f"Chat route: {self.route} ({reason}) -> {self.tier}", flush=True)
+            if responses is not None:
+                # With a coalescing window, a stalled upstream still gets held text sent on time
+                responses = stream.timed(responses)
+
+            # responses is None when the turn was cancelled while waiting for the first chunk
+            for response in chain([first] if first is not None else [], responses or []):
+                if self.is_cancelled:
+                    break
+                if response is TICK:
+                    frame = stream.tick()
+                    if frame:
+                        yield frame
+                    continue
+                if response.status_code == HTTPStatus.OK:
+                    frame = stream.process(response.output.choices[0].message)
+                    if frame:
+                        yield frame
+                    if stream.budget_exhausted and not stream.tool_call_pending():
+                        # Reply is long enough: stop paying for tokens nobody will see or hear
+                        # (a tool call that has not started yet is given up; max_tokens caps it anyway)
+                        turn_metrics.record_budget_stop()
+                        print(f"Chat reply budget met ({stream.budget.sentences} sentences, "
+                              f"{stream.budget.chars} chars), closing the upstream stream", flush=True)
+                        break
                 else:
-                    system_content += f'\n- {action_name} (视频: {video_id}, 需要TTS): 当用户要求"{keywords[0]}"等相关动作时调用'
-
-            system_content += '\n\n重要规则：'
-            system_content += '\n1. 使用语义理解检测用户意图，不要只匹配关键词。例如"扭一下"、"我想看你扭"、"能扭吗"都应该触发扭动作。'
-            system_content += '\n2. 对于有预录音频的视频(has_audio=true)，调用函数时返回空文本，因为视频自带回复。'
-            system_content += '\n3. 对于需要TTS的视频(has_audio=false)，调用函数的同时返回自然的文本回复。'
-            system_content += '\n4. 灵活理解自然语言，不要死板匹配关键词。'
-
-        # Build messages with system prompt and history
-        messages = [
-            {
-                'role': 'system',
-                'content': system_content
-            }
-        ]
-
-        # Add conversation history (keep last 10 turns for context)
-        messages.extend(history[-20:])  # Last 10 turns = 20 messages (user + assistant)
-
-        # Add current user message
-        messages.append({'role': 'user', 'content': user_message})
-
-        # Define function calling tools if actions are available
-        tools = None
-        if actions:
-            tools = [{
-                "type": "function",
-                "function": {
-                    "name": "play_action_video",
-                    "description": "Play an action video when user requests a specific action like twist (扭), shake (抖), bounce (颠), or sing/dance (唱歌). Use semantic understanding to detect intent, not just keyword matching.",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "action": {
-                                "type": "string",
-                                "description": "The action to perform"
-                            },
-                            "video_id": {
-                                "type": "string",
-                                "description": "The video file to play (e.g., '1.mp4', '2.mp4', '3.mp4', 'dance.mp4')"
-                            },
-                            "has_audio": {
-                                "type": "boolean",
-                                "description": "Whether the video has pre-recorded audio (true) or needs TTS (false)",
-                                "default": False
-                            }
-                        },
-                        "required": ["action", "video_id"]
-                    }
-                }
-            }]
+                    frame = stream.flush()
+                    if frame:
+                        yield frame
+                    error_msg = f"Error: {response.code} - {response.message}"
+                    yield sse_event({'type': 'error', 'content': error_msg})
+                    return
+
+            if self.is_cancelled:
+                # Superseded or cancelled: drop the partial reply, keep history clean
+                outcome = 'cancelled'
+                if self.cancel_reason != 'disconnect':
+                    yield sse_event({'type': 'cancelled', 'reason': self.cancel_reason})
+                return
+
+            # Send any text still held by the coalescing window
+            frame = stream.flush()
+            if frame:
+                yield frame
+
+            # After streaming completes, parse accumulated function calls
+            self.function_calls = stream.function_calls()
+            for function_call_data in self.function_calls:
+                # Send function call to frontend
+                yield sse_event({'type': 'function_call', 'function': function_call_data})
+                arguments = function_call_data.get('arguments')
+                if isinstance(arguments, dict):
+                    transitions.observe(self.session_id, self.set_id, arguments.get('video_id'))
+
+            # Build assistant response for history
+            self.full_response = stream.full_response
+            assistant_message = {'role': 'assistant', 'content': self.full_response}
+            if self.function_calls:
+                assistant_message['tool_calls'] = self.function_calls
+
+            # Save to conversation history
+            self._pending_history = [{'role': 'user', 'content': self.user_message}, assistant_message]
+            if not self.defer_history:
+                self.commit_history()
+            outcome = 'completed'
+
+            # Send completion signal, with the clips the client will likely want next
+            done = {'type': 'done', 'content': self.full_response}
+            likely_next = transitions.likely_next(self.set_id, self.session_id)
+            if likely_next:
+                done['next'] = likely_next
+            yield sse_event(done)
+
+        except GeneratorExit:
+            # The response was closed mid-stream: the client disconnected
+            if outcome != 'completed':
+                self.cancel('disconnect')
+                outcome = 'cancelled'
+            raise
 
-        def generate():
-            """Generator function for streaming responses with function calling"""
-            try:
-                full_response = ''
-                function_calls = []
-
-                # Track accumulated function call (streaming comes in chunks)
-                # Use index as key since call_id can be empty in subsequent chunks
-                accumulated_tool_calls = {}
-
-                # Call DashScope streaming API with tools
-                call_params = {
-                    'model': 'qwen-turbo',
-                    'messages': messages,
-                    'result_format': 'message',
-                    'stream': True,
-                    'incremental_output': True,
-                    'temperature': 0.8,
-                    'max_tokens': 200
-                }
-
-                if tools:
-                    call_params['tools'] = tools
-
-                responses = Generation.call(**call_params)
-
-                for response in responses:
-                    if response.status_code == HTTPStatus.OK:
-                        choice = response.output.choices[0]
-                        message = choice.message
-
-                        # Check for function calls (tool_calls are dicts, not objects)
-                        try:
-                            tool_calls = message.tool_calls
-                            if tool_calls:
-                                for tool_call in tool_calls:
-                                    # tool_call is a dict, not an object
-                                    if isinstance(tool_call, dict):
-                                        # Use index as key (more reliable than id which can be empty)
-                                        call_index = tool_call.get('index', 0)
-                                        func_data = tool_call.get('function', {})
-
-                                        # Initialize accumulator for this index
-                                        if call_index not in accumulated_tool_calls:
-                                            accumulated_tool_calls[call_index] = {
-                                                'name': '',
-                                                'arguments': ''
-                                            }
-
-                                        # Accumulate function name and arguments
-                                        if 'name' in func_data and func_data['name']:
-                                            accumulated_tool_calls[call_index]['name'] = func_data['name']
-
-                                        if 'arguments' in func_data:
-                                            accumulated_tool_calls[call_index]['arguments'] += func_data['arguments']
-                        except (KeyError, AttributeError):
-                            pass
-
-                        # Check for text content
-                        try:
-                            content = message.content
-                            if content:
-                                chunk = content
-                                full_response += chunk
-
-                                # Send chunk to frontend
-                                yield f"data: {json.dumps({'type': 'text', 'content': chunk})}\n\n"
-                        except (KeyError, AttributeError):
-                            pass
-                    else:
-                        error_msg = f"Error: {response.code} - {response.message}"
-                        yield f"data: {json.dumps({'type': 'error', 'content': error_msg})}\n\n"
-                        return
-
-                # After streaming completes, parse accumulated function calls
-                for call_index, call_data in accumulated_tool_calls.items():
-                    try:
-                        # Parse the complete JSON arguments
-                        args_string = call_data['arguments'].strip()
-                        arguments = json.loads(args_string)
-                        function_call_data = {
-                            'name': call_data['name'],
-                            'arguments': arguments
-                        }
-                        function_calls.append(function_call_data)
-
-                        # Send function call to frontend
-                        yield f"data: {json.dumps({'type': 'function_call', 'function': function_call_data})}\n\n"
-                    except json.JSONDecodeError as e:
-                        print(f"Error parsing function arguments: {e}", flush=True)
-                        print(f"Arguments string: '{call_data['arguments']}'", flush=True)
-
-                # Save to conversation history
-                history.append({'role': 'user', 'content': user_message})
-
-                # Build assistant response for history
-                assistant_message = {'role': 'assistant', 'content': full_response}
-                if function_calls:
-                    assistant_message['tool_calls'] = function_calls
-                history.append(assistant_message)
-
-                # Send completion signal
-                yield f"data: {json.dumps({'type': 'done', 'content': full_response})}\n\n"
+        except Exception as e:
+            error_msg = f"Exception: {str(e)}"
+            print(f"Error in generate(): {error_msg}")
+            import traceback
+            traceback.print_exc()
+            yield sse_event({'type': 'error', 'content': error_msg})
+
+        finally:
+            # Closing the upstream generator closes its HTTP stream
+            if responses is not None and hasattr(responses, 'close'):
+                responses.close()
+            session_turns.release(self.session_id, self)
+
+            elapsed = time.monotonic() - started
+            turn_metrics.record(outcome, elapsed, self.cancel_reason)
+            if outcome == 'cancelled':
+                print(f"Chat turn cancelled ({self.cancel_reason}) after {elapsed:.2f}s: {self.session_id}",
+                      flush=True)
+
+    def degraded_frames(self):
+        """Answer from the set's keywords and canned text while the LLM circuit is open
+
+        The canned reply is not written to history, so the model never sees it.
+        """
+        set_id = preload_hints.resolve_set(self.set_id)
+        text, function_call = degraded.chat_reply(self.user_message, preload_hints.config(), set_id,
+                                                  self.actions)
+        print(f"Chat degraded (LLM circuit open): {self.session_id} -> "
+              f"{function_call['arguments']['video_id'] if function_call else 'busy reply'}", flush=True)
+        if text:
+            yield sse_event({'type': 'text', 'content': text})
+        if function_call:
+            self.function_calls = [function_call]
+            yield sse_event({'type': 'function_call', 'function': function_call})
+            transitions.observe(self.session_id, self.set_id, function_call['arguments']['video_id'])
+        self.full_response = text
+        done = {'type': 'done', 'content': text, 'degraded': True}
+        likely_next = transitions.likely_next(self.set_id, self.session_id)
+        if likely_next:
+            done['next'] = likely_next
+        yield sse_event(done)
+
+    def needs_speech(self):
+        """True when the reply should be spoken (no pre-recorded action audio)"""
+        if any(isinstance(call['arguments'], dict) and call['arguments'].get('has_audio')
+               for call in self.function_calls):
+            return False
+        return bool(self.full_response.strip())
 
-            except Exception as e:
-                error_msg = f"Exception: {str(e)}"
-                print(f"Error in generate(): {error_msg}")
-                import traceback
-                traceback.print_exc()
-                yield f"data: {json.dumps({'type': 'error', 'content': error_msg})}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream LLM responses using DashScope with function calling
+
+    With a Last-Event-ID header the reply of an earlier request is resumed
+    from its replay buffer instead of generated again (410 once it expired).
+    """
+    try:
+        data = request.json
+        user_message = data.get('message', '')
+        session_id = data.get('session_id', 'default')
+        actions = data.get('actions', [])  # Available actions from video set config
+
+        last_event_id = request.headers.get('Last-Event-ID')
+        if last_event_id:
+            frames = replay_streams.resume(last_event_id, session_id) if STREAM_RESUME else None
+            if frames is None:
+                return jsonify({'error': 'Stream expired, nothing to resume'}), 410
+        else:
+            if not user_message:
+                return jsonify({'error': 'No message provided'}), 400
+
+            turn = ChatTurn(user_message, session_id, actions, set_id=data.get('set_id'))
+            frames = turn.frames()
+            if STREAM_RESUME:
+                # A dropped connection leaves the turn running for a reconnect to pick up;
+                # the reply only goes to history once some reader received all of it
+                turn.defer_history = True
+                frames = replay_streams.open(session_id, frames, lambda: turn.cancel('disconnect'),
+                                             turn.commit_history).read()
 
         return Response(
-            stream_with_context(generate()),
+            stream_with_context(frames),
             mimetype='text/event-stream',
             headers={
                 'Cache-Control': 'no-cache',
@@ -248,6 +522,302 @@ def chat_stream():
         print(f"Error in chat_stream: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def stream_speech_reply(channel, turn_id, text, message):
+    """Synthesize text in the format the socket request asked for (mp3 by default)
+
+    While the TTS circuit is open, a pre-recorded clip is sent instead.
+    """
+    try:
+        audio_formats.parse_sample_rate(message.get('sample_rate'))
+    except ValueError as e:
+        channel.send_event(turn_id, {'type': 'error', 'content': str(e)})
+        return
+    choice = audio_formats.negotiate(
+        requested_format=message.get('format'), requested_rate=message.get('sample_rate'),
+        default=tts.DEFAULT_FORMAT, available=speech_formats())
+    if choice is None:
+        channel.send_event(turn_id, {'type': 'error', 'content': f"Unsupported audio format: {message.get('format')}"})
+        return
+    audio_format, sample_rate = choice
+    frames = tts.stream_as(tts.clean_text(text), audio_format, sample_rate)
+    try:
+        first = next(frames, None)
+    except CircuitOpen:
+        audio, audio_format, sample_rate = local_speech(text, message.get('set_id'), audio_format, sample_rate)
+        if audio is None:
+            channel.send_event(turn_id, {'type': 'error', 'content': 'TTS unavailable', 'degraded': True})
+            return
+        first = None
+        frames = (audio[start:start + tts.STREAM_CHUNK_BYTES]
+                  for start in range(0, len(audio), tts.STREAM_CHUNK_BYTES))
+    stream_audio(channel, turn_id, chain([first] if first is not None else [], frames),
+                 audio_format, sample_rate)
+
+
+def local_speech(text, set_id, audio_format, sample_rate):
+    """(audio, format, sample_rate) of the pre-recorded clip standing in for text
+
+    Used while the TTS circuit is open. The clip is sent as recorded when it
+    cannot be encoded in the requested format (no ffmpeg); audio is None when
+    the clip cannot be read either.
+    """
+    clip = degraded.speech_clip(text, preload_hints.config(), preload_hints.resolve_set(set_id))
+    source_format = audio_variants.source_format(clip)
+    print(f"TTS degraded (circuit open): audio/{clip}", flush=True)
+    if audio_format != source_format and audio_format in audio_variants.available_formats(clip):
+        try:
+            return audio_variants.get(clip, audio_format, sample_rate).read_bytes(), audio_format, sample_rate
+        except Exception as e:
+            print(f"Audio variant of {clip} failed: {e}", flush=True)
+    try:
+        return (Path('audio') / clip).read_bytes(), source_format, None
+    except OSError as e:
+        print(f"Degraded clip audio/{clip} unreadable: {e}", flush=True)
+        return None, source_format, None
+
+
+def speech_formats():
+    """Formats TTS replies can be delivered in (Opus needs ffmpeg)"""
+    if audio_formats.ffmpeg_available():
+        return list(audio_formats.FORMATS)
+    return list(audio_formats.UPSTREAM_FORMATS)
+
+
+def handle_speech_input(channel, turn_id, session_id, message):
+    """Recognize client audio until asr_stop, reporting partial/intent/final events
+
+    Partials are matched against the set's command keywords as they arrive, so
+    an action can start before the utterance ends. A final transcript that
+    matched no command is answered as a chat turn when message['chat'] is set.
+    """
+    commands = message.get('commands') or {}
+    input_channel, chunks = channel.open_input()
+    matched = []
+
+    def on_partial(text):
+        channel.send_event(turn_id, {'type': 'partial', 'text': text})
+        if not matched:
+            command = asr.match_command(text, commands)
+            if command:
+                matched.append(command)
+                channel.send_event(turn_id, {'type': 'intent', 'command': command[0],
+                                             'video': command[1], 'text': text})
+
+    def on_final(text):
+        command = matched[0] if matched else asr.match_command(text, commands)
+        matched.clear()
+        channel.send_event(turn_id, {'type': 'final', 'text': text,
+                                     'command': command[0] if command else None})
+        if command is None and message.get('chat'):
+            chat_request = {'type': 'chat', 'id': turn_id, 'message': text, 'session_id': session_id,
+                            'actions': message.get('actions', []), 'tts': message.get('tts'),
+                            'set_id': message.get('set_id')}
+            channel.submit(handle_socket_request, chat_request)
+
+    try:
+        recognizer = asr.StreamingRecognizer(asr.create_engine(), on_partial, on_final,
+                                             audio_format=message.get('format', 'pcm'))
+    except ImportError as e:
+        channel.close_input(input_channel)
+        channel.send_event(turn_id, {'type': 'error', 'content': f'Audio format not supported: {e}'})
+        return
+
+    try:
+        channel.send_event(turn_id, {'type': 'asr_ready', 'channel': input_channel,
+                                     'sample_rate': recognizer.sample_rate, 'engine': recognizer.engine.name})
+        recognizer.run(chunks)
+    except Exception as e:
+        # e.g. the recognition service failed to start: stop accepting audio for a dead consumer
+        print(f"Speech recognition failed: {e}", flush=True)
+        if not channel.closed:
+            channel.send_event(turn_id, {'type': 'error', 'content': f'Speech recognition failed: {e}'})
+        return
+    finally:
+        channel.close_input(input_channel)
+    if not channel.closed:
+        channel.send_event(turn_id, {'type': 'asr_end'})
+
+
+def handle_socket_request(channel, message):
+    """Run one request received on the WebSocket channel"""
+    turn_id = message.get('id')
+    session_id = message.get('session_id') or channel.session_id
+    try:
+        request_type = message.get('type')
+
+        if request_type == 'chat':
+            user_message = message.get('message', '')
+            if not user_message:
+                channel.send_event(turn_id, {'type': 'error', 'content': 'No message provided'})
+                return
+
+            turn = ChatTurn(user_message, session_id, message.get('actions', []), turn_id,
+                            set_id=message.get('set_id'))
+            abort_turn = lambda: turn.cancel('disconnect')
+            channel.add_close_callback(abort_turn)
+            try:
+                with closing(turn.frames()) as frames:
+                    for frame in frames:
+                        channel.send_frame(turn_id, frame)
+            finally:
+                channel.remove_close_callback(abort_turn)
+            if turn.is_cancelled:
+                return
+
+            # Push the spoken reply on the same connection as soon as audio exists
+            if message.get('tts') and turn.needs_speech():
+                stream_speech_reply(channel, turn_id, turn.full_response, message)
+
+        elif request_type == 'tts':
+            if not tts.clean_text(message.get('text', '')):
+                channel.send_event(turn_id, {'type': 'error', 'content': 'No text provided'})
+                return
+            stream_speech_reply(channel, turn_id, message.get('text', ''), message)
+
+        elif request_type == 'asr_start':
+            handle_speech_input(channel, turn_id, session_id, message)
+
+        elif request_type == 'cancel':
+            # With "turn", only that turn: a newer message may already have replaced it
+            session_turns.cancel(session_id, 'client', message.get('turn'))
+
+        elif request_type == 'clear':
+            conversation_histories[session_id] = []
+            context_builder.forget(session_id)
+            channel.send_event(turn_id, {'type': 'cleared'})
+
+        else:
+            channel.send_event(turn_id, {'type': 'error', 'content': f'Unknown request type: {request_type}'})
+
+    except Exception as e:
+        print(f"Error in WebSocket request: {str(e)}", flush=True)
+        if not channel.closed:
+            try:
+                channel.send_event(turn_id, {'type': 'error', 'content': f"Exception: {str(e)}"})
+            except Exception:
+                pass
+
+
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route('/ws')
+    def chat_socket(ws):
+        """Duplex channel: chat requests in, chat events and TTS audio frames out"""
+        channel = DuplexChannel(ws, request.args.get('session_id', 'default'))
+        print(f"WebSocket connected: {channel.session_id}", flush=True)
+        channel.serve(handle_socket_request)
+        print(f"WebSocket closed: {channel.session_id}", flush=True)
+
+@app.route('/api/metrics')
+@profiling.require_admin
+def metrics():
+    """Server-side counters (turn outcomes, worker-seconds, model TTFT, hedging, breakers, replay buffers)"""
+    return jsonify({'turns': turn_metrics.snapshot(), 'routing': model_router.metrics.snapshot(),
+                    'breakers': {'llm': model_router.breaker.snapshot(), 'tts': tts.speech_breaker.snapshot()},
+                    'hedging': {'chat': model_router.hedging_snapshot(), 'tts': tts.speech_hedge.snapshot()},
+                    'streams': replay_streams.snapshot(), 'transitions': transitions.snapshot()})
+
+@app.route('/api/intent', methods=['POST'])
+def record_intent():
+    """A clip played on a voice command or button; returns the likely next clips"""
+    data = request.get_json(silent=True) or {}
+    session_id = data.get('session_id', 'default')
+    set_id = data.get('set_id')
+    if not transitions.observe(session_id, set_id, data.get('video')):
+        return jsonify({'error': 'Unknown set or video'}), 400
+    return jsonify({'next': transitions.likely_next(set_id, session_id)})
+
+@app.route('/admin/profile')
+@profiling.require_admin
+def profile_status():
+    """Which profiling windows are open"""
+    return jsonify(profiler.status())
+
+@app.route('/admin/profile/sampling', methods=['GET', 'POST'])
+@profiling.require_admin
+def profile_sampling():
+    """POST {seconds, interval_ms, idle} starts a sampling window; GET returns folded stacks"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            profiler.start_sampling(data.get('seconds'), data.get('interval_ms', 5),
+                                    bool(data.get('idle')))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 409
+        return jsonify(profiler.status())
+    return Response(profiler.sampler.folded(), mimetype='text/plain')
+
+@app.route('/admin/profile/requests', methods=['GET', 'POST'])
+@profiling.require_admin
+def profile_requests():
+    """POST {seconds, rate, endpoints} profiles a fraction of requests; GET returns per-endpoint stats
+
+    GET ?endpoint=chat_stream&sort=tottime&limit=40, or &format=prof for a
+    pstats file (snakeviz / flameprof render it as a flame graph).
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            profiler.start_requests(data.get('seconds'), data.get('rate', 0.1), data.get('endpoints'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(profiler.status())
+
+    endpoint = request.args.get('endpoint')
+    if request.args.get('format') == 'prof':
+        dump = profiler.request_stats_dump(endpoint)
+        if dump is None:
+            return jsonify({'error': f"No profiles for endpoint {endpoint}"}), 404
+        return Response(dump, mimetype='application/octet-stream', headers={
+            'Content-Disposition': f'attachment; filename="{endpoint}.prof"'})
+    try:
+        text = profiler.request_stats_text(endpoint, request.args.get('sort', 'cumulative'),
+                                           request.args.get('limit', 40))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return Response(text, mimetype='text/plain')
+
+@app.route('/admin/profile/stop', methods=['POST'])
+@profiling.require_admin
+def profile_stop():
+    """Close every profiling window (collected output stays available)"""
+    profiler.stop()
+    return jsonify(profiler.status())
+
+@app.route('/admin/memory', methods=['GET', 'POST'])
+@profiling.require_admin
+def memory_snapshot():
+    """POST {action: start|stop, frames} controls tracemalloc; GET takes a snapshot
+
+    The snapshot lists top allocations (and the diff to the previous GET) plus
+    the approximate size of every session's history.
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if data.get('action') == 'stop':
+            profiler.stop_memory()
+        else:
+            try:
+                profiler.start_memory(data.get('frames', 10))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+        return jsonify(profiler.status())
+
+    sessions = sorted(({'session_id': session_id, 'messages': len(history),
+                        'bytes': profiling.deep_sizeof(history)}
+                       for session_id, history in list(conversation_histories.items())),
+                      key=lambda entry: entry['bytes'], reverse=True)
+    return jsonify({
+        'sessions': len(sessions),
+        'history_bytes': sum(entry['bytes'] for entry in sessions),
+        'largest_sessions': sessions[:20],
+        'tracemalloc': profiler.memory_snapshot(request.args.get('limit', 25, type=int),
+                                                request.args.get('group', 'lineno')),
+    })
+
 @app.route('/api/chat/clear', methods=['POST'])
 def clear_history():
     """Clear conversation history for a session"""
@@ -257,6 +827,8 @@ def clear_history():
 
         if session_id in conversation_histories:
             conversation_histories[session_id] = []
+        context_builder.forget(session_id)
+        transitions.forget_session(session_id)
 
         return jsonify({'success': True})
     except Exception as e:
@@ -269,6 +841,23 @@ def tts_synthesize():
         data = request.json
         text = data.get('text', '')
 
+        try:
+            audio_formats.parse_sample_rate(data.get('sample_rate'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Body format/sample_rate win over the Accept header; mp3 when neither asks for audio
+        choice = audio_formats.negotiate(
+            request.accept_mimetypes, data.get('format'), data.get('sample_rate'),
+            default=tts.DEFAULT_FORMAT, available=speech_formats())
+        if choice is None and not data.get('format'):
+            choice = audio_formats.negotiate(requested_rate=data.get('sample_rate'),
+                                             default=tts.DEFAULT_FORMAT)
+        if choice is None:
+            return jsonify({'error': 'Unsupported audio format',
+                            'formats': speech_formats()}), 406
+        audio_format, sample_rate = choice
+
         print(f"=== TTS Request ===", flush=True)
         print(f"Text to synthesize: {text}", flush=True)
         print(f"Text length: {len(text)}", flush=True)
@@ -277,72 +866,27 @@ def tts_synthesize():
             return jsonify({'error': 'No text provided'}), 400
 
         # Remove emojis and special characters that might cause issues
-        import re
-        clean_text = re.sub(r'[^\u4e00-\u9fff\u3000-\u303fa-zA-Z0-9\s，。！？、；：""''（）《》【】…—～]', '', text)
+        clean_text = tts.clean_text(text)
         print(f"Cleaned text: {clean_text}", flush=True)
 
-        # Use DashScope CosyVoice for TTS - with callback to collect audio
-        from dashscope.audio.tts import SpeechSynthesizer, ResultCallback
-        import io
-
-        audio_buffer = io.BytesIO()
-        error_occurred = False
-
-        class AudioCallback(ResultCallback):
-            def on_open(self):
-                print("TTS: Stream opened", flush=True)
-
-            def on_complete(self):
-                print("TTS: Stream completed", flush=True)
-
-            def on_error(self, message: str):
-                nonlocal error_occurred
-                error_occurred = True
-                print(f"TTS error: {message}", flush=True)
-
-            def on_close(self):
-                print("TTS: Stream closed", flush=True)
-
-            def on_event(self, result):
-                if result.get_audio_frame():
-                    audio_data = result.get_audio_frame()
-                    audio_buffer.write(audio_data)
-                    print(f"TTS: Received audio chunk of {len(audio_data)} bytes, total: {audio_buffer.tell()}", flush=True)
-
-        callback = AudioCallback()
-
-        print("TTS: Calling SpeechSynthesizer.call() with streaming callback...", flush=True)
-
-        # Call with callback - use sambert model which works correctly
+        headers = {'Cache-Control': 'no-cache', 'Vary': 'Accept'}
         try:
-            result = SpeechSynthesizer.call(
-                model='sambert-zhimiao-emo-v1',  # Sweet female voice with emotion
-                text=clean_text,
-                format='mp3',
-                sample_rate=22050,
-                callback=callback
-            )
-            print(f"TTS: Call completed successfully", flush=True)
-        except KeyError as e:
-            # Expected bug in dashscope library - audio is already in buffer
-            print(f"TTS: Caught expected KeyError: {e} (audio already collected)", flush=True)
-        except Exception as e:
-            print(f"TTS: Unexpected error: {e}", flush=True)
-            import traceback
-            traceback.print_exc()
-
-        # Get the complete audio from buffer
-        full_audio = audio_buffer.getvalue()
-        print(f"TTS synthesis complete: {len(full_audio)} bytes total", flush=True)
-
-        if len(full_audio) > 0 and not error_occurred:
+            full_audio = tts.synthesize_as(clean_text, audio_format, sample_rate)
+        except CircuitOpen:
+            # Answer at once with a pre-recorded clip instead of waiting on a failing upstream
+            full_audio, audio_format, sample_rate = local_speech(clean_text, data.get('set_id'),
+                                                                 audio_format, sample_rate)
+            if full_audio is None:
+                return jsonify({'error': 'TTS unavailable', 'degraded': True}), 503
+            headers['X-Degraded'] = 'tts'
+
+        if full_audio:
+            mimetype = audio_formats.content_type(audio_format, sample_rate)
+            headers['Content-Type'] = mimetype
             return Response(
                 full_audio,
-                mimetype='audio/mpeg',
-                headers={
-                    'Content-Type': 'audio/mpeg',
-                    'Cache-Control': 'no-cache'
-                }
+                mimetype=mimetype,
+                headers=headers
             )
         else:
             print("TTS synthesis failed - no audio data collected or error occurred", flush=True)
@@ -0,0 +1,299 @@
+"""
+Server-side streaming speech recognition with VAD-based endpointing
+
+The client streams 16-bit mono PCM (or Opus, when opuslib is installed) over
+the WebSocket channel. EnergyVAD detects where an utterance starts and ends,
+only voiced audio (plus a short pre-roll) is sent to the ASR engine, and the
+utterance is finalized as soon as ASR_END_SILENCE_MS of silence follows it -
+so command latency is bounded by our own endpointing, not by the browser.
+
+Engines:
+- dashscope: DashScope realtime recognition (paraformer-realtime-v2)
+- local:     offline stand-in that reveals scripted transcripts as audio arrives (tests)
+"""
+import math
+import os
+import queue
+import threading
+from array import array
+from collections import deque
+
+ASR_ENGINE = os.getenv('ASR_ENGINE', 'dashscope')
+ASR_MODEL = os.getenv('ASR_MODEL', 'paraformer-realtime-v2')
+ASR_SAMPLE_RATE = 16000
+ASR_FRAME_MS = 20
+ASR_END_SILENCE_MS = int(os.getenv('ASR_END_SILENCE_MS', '500'))
+ASR_MAX_UTTERANCE_MS = int(os.getenv('ASR_MAX_UTTERANCE_MS', '8000'))
+
+
+def frame_rms(frame):
+    """Root-mean-square level of a 16-bit little-endian PCM frame"""
+    samples = array('h', frame)
+    if not samples:
+        return 0.0
+    return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+
+def match_command(text, commands):
+    """First command keyword in text, as tryProcessCommand() does in static/app.js
+
+    commands maps keyword -> video file. Returns (keyword, video) or None.
+    """
+    lower_text = text.lower()
+    matches = []
+    for keyword, video in commands.items():
+        position = lower_text.find(keyword.lower())
+        if position != -1:
+            matches.append((position, keyword, video))
+    if not matches:
+        return None
+    _, keyword, video = min(matches, key=lambda match: match[0])
+    return keyword, video
+
+
+class EnergyVAD:
+    """Energy-based voice activity detector with an adaptive noise floor
+
+    process() takes one fixed-size frame and returns 'start' when speech begins,
+    'end' when the utterance is over (trailing silence or max length), else None.
+    """
+
+    def __init__(self, sample_rate=ASR_SAMPLE_RATE, frame_ms=ASR_FRAME_MS, start_frames=3,
+                 end_silence_ms=ASR_END_SILENCE_MS, max_utterance_ms=ASR_MAX_UTTERANCE_MS,
+                 threshold_ratio=3.0, min_level=300.0):
+        self.frame_bytes = sample_rate * frame_ms // 1000 * 2
+        self.frame_ms = frame_ms
+        self.start_frames = start_frames
+        self.end_frames = max(1, end_silence_ms // frame_ms)
+        self.max_frames = max(1, max_utterance_ms // frame_ms)
+        self.threshold_ratio = threshold_ratio
+        self.min_level = min_level
+
+        self.noise_level = min_level / threshold_ratio
+        self.in_speech = False
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._utterance_frames = 0
+
+    def is_voiced(self, frame):
+        level = frame_rms(frame)
+        voiced = level > max(self.min_level, self.noise_level * self.threshold_ratio)
+        if not voiced:
+            # Track background noise so the threshold follows the room
+            self.noise_level = 0.95 * self.noise_level + 0.05 * level
+        return voiced
+
+    def process(self, frame):
+        voiced = self.is_voiced(frame)
+
+        if not self.in_speech:
+            self._voiced_run = self._voiced_run + 1 if voiced else 0
+            if self._voiced_run >= self.start_frames:
+                self.in_speech = True
+                self._silent_run = 0
+                self._utterance_frames = self._voiced_run
+                return 'start'
+            return None
+
+        self._utterance_frames += 1
+        self._silent_run = 0 if voiced else self._silent_run + 1
+        if self._silent_run >= self.end_frames or self._utterance_frames >= self.max_frames:
+            self.in_speech = False
+            self._voiced_run = 0
+            return 'end'
+        return None
+
+
+class LocalASREngine:
+    """Offline stand-in: reveals scripted transcripts as utterance audio arrives"""
+
+    name = 'local'
+
+    def __init__(self, transcripts=None, chars_per_second=4.0):
+        self.transcripts = deque(transcripts or ['扭一下'])
+        self.chars_per_second = chars_per_second
+
+    def start_utterance(self, sample_rate=ASR_SAMPLE_RATE):
+        text = self.transcripts[0]
+        self.transcripts.rotate(-1)
+        return LocalUtterance(text, sample_rate, self.chars_per_second)
+
+
+class LocalUtterance:
+    def __init__(self, text, sample_rate, chars_per_second):
+        self.text = text
+        self.bytes_per_char = int(sample_rate * 2 / chars_per_second)
+        self.received = 0
+        self.revealed = 0
+
+    def feed(self, pcm):
+        """Returns a new partial transcript, or None"""
+        self.received += len(pcm)
+        revealed = min(len(self.text), self.received // self.bytes_per_char)
+        if revealed > self.revealed:
+            self.revealed = revealed
+            return self.text[:revealed]
+        return None
+
+    def finish(self):
+        return self.text
+
+
+class DashScopeASREngine:
+    """DashScope realtime recognition, one streaming task per utterance"""
+
+    name = 'dashscope'
+
+    def __init__(self, model=ASR_MODEL):
+        self.model = model
+
+    def start_utterance(self, sample_rate=ASR_SAMPLE_RATE):
+        return DashScopeUtterance(self.model, sample_rate)
+
+
+class DashScopeUtterance:
+    def __init__(self, model, sample_rate):
+        from dashscope.audio.asr import Recognition, RecognitionCallback, RecognitionResult
+
+        utterance = self
+        self._lock = threading.Lock()
+        self._sentences = []
+        self._current = ''
+        self._reported = ''
+        self.error = None
+
+        class Callback(RecognitionCallback):
+            def on_error(self, result):
+                utterance.error = result.message
+                print(f"ASR error: {result.message}", flush=True)
+
+            def on_event(self, result):
+                sentence = result.get_sentence()
+                if not sentence or 'text' not in sentence:
+                    return
+                with utterance._lock:
+                    if RecognitionResult.is_sentence_end(sentence):
+                        utterance._sentences.append(sentence['text'])
+                        utterance._current = ''
+                    else:
+                        utterance._current = sentence['text']
+
+        self.recognition = Recognition(model=model, callback=Callback(), format='pcm',
+                                       sample_rate=sample_rate)
+        self.recognition.start()
+
+    def _text(self):
+        with self._lock:
+            return ''.join(self._sentences) + self._current
+
+    def feed(self, pcm):
+        """Returns a new partial transcript, or None"""
+        self.recognition.send_audio_frame(pcm)
+        text = self._text()
+        if text and text != self._reported:
+            self._reported = text
+            return text
+        return None
+
+    def finish(self):
+        # stop() blocks until the final result has been delivered
+        self.recognition.stop()
+        return self._text()
+
+
+ENGINES = {
+    'dashscope': DashScopeASREngine,
+    'local': LocalASREngine,
+}
+
+
+def create_engine(name=ASR_ENGINE):
+    return ENGINES[name]()
+
+
+class OpusDecoder:
+    """Decode Opus packets to PCM (needs the optional opuslib package)"""
+
+    def __init__(self, sample_rate=ASR_SAMPLE_RATE):
+        import opuslib
+
+        self.decoder = opuslib.Decoder(sample_rate, 1)
+        self.frame_size = sample_rate * 60 // 1000  # Max Opus frame: 60ms
+
+    def decode(self, packet):
+        return self.decoder.decode(packet, self.frame_size)
+
+
+class StreamingRecognizer:
+    """Runs VAD + ASR over a stream of audio chunks and reports transcripts
+
+    on_partial(text) is called while the user is still speaking,
+    on_final(text) once per utterance when the VAD detects its end.
+    """
+
+    def __init__(self, engine, on_partial, on_final, sample_rate=ASR_SAMPLE_RATE,
+                 audio_format='pcm', vad=None, preroll_frames=10):
+        self.engine = engine
+        self.on_partial = on_partial
+        self.on_final = on_final
+        self.sample_rate = sample_rate
+        self.vad = vad or EnergyVAD(sample_rate=sample_rate)
+        self.decoder = OpusDecoder(sample_rate) if audio_format == 'opus' else None
+        self.preroll = deque(maxlen=preroll_frames)
+
+        self._buffer = b''
+        self._utterance = None
+
+    def feed(self, chunk):
+        """Feed an arbitrary-size chunk of client audio"""
+        if self.decoder is not None:
+            chunk = self.decoder.decode(chunk)
+        self._buffer += chunk
+
+        frame_bytes = self.vad.frame_bytes
+        while len(self._buffer) >= frame_bytes:
+            frame = self._buffer[:frame_bytes]
+            self._buffer = self._buffer[frame_bytes:]
+            self._process_frame(frame)
+
+    def _process_frame(self, frame):
+        event = self.vad.process(frame)
+
+        if self._utterance is None:
+            self.preroll.append(frame)
+            if event == 'start':
+                # Include the audio just before speech was detected
+                self._utterance = self.engine.start_utterance(self.sample_rate)
+                self._send(b''.join(self.preroll))
+                self.preroll.clear()
+            return
+
+        self._send(frame)
+        if event == 'end':
+            self._finish()
+
+    def _send(self, pcm):
+        partial = self._utterance.feed(pcm)
+        if partial:
+            self.on_partial(partial)
+
+    def _finish(self):
+        utterance, self._utterance = self._utterance, None
+        text = utterance.finish()
+        if text:
+            self.on_final(text)
+
+    def close(self):
+        """End of stream: finalize an utterance that is still open"""
+        if self._utterance is not None:
+            self._finish()
+
+    def run(self, chunks):
+        """Consume a queue.Queue (None terminates) or an iterable of chunks"""
+        if isinstance(chunks, queue.Queue):
+            chunks = iter(chunks.get, None)
+        try:
+            for chunk in chunks:
+                self.feed(chunk)
+        finally:
+            self.close()
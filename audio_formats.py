@@ -0,0 +1,237 @@
+"""
+Audio format negotiation and cached transcodes
+
+Clients pick the audio encoding with an Accept header (or an explicit
+format / sample_rate parameter). DashScope synthesizes mp3, wav and pcm
+directly; Opus is produced from pcm with ffmpeg. Transcoded variants are
+cached - acknowledgement clips on disk next to the audio root, TTS replies in
+a small in-memory LRU - so each variant is encoded once.
+"""
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+AUDIO_CACHE_ENTRIES = int(os.getenv('AUDIO_CACHE_ENTRIES', '128'))
+OPUS_BITRATE = os.getenv('OPUS_BITRATE', '24k')
+
+# Sample rates the DashScope sambert voices accept
+UPSTREAM_SAMPLE_RATES = (8000, 16000, 22050, 24000, 44100, 48000)
+UPSTREAM_FORMATS = ('mp3', 'wav', 'pcm')
+
+# name -> mimetype, sample rates, default rate, file extension, ffmpeg output args
+FORMATS = {
+    'mp3': {
+        'mimetype': 'audio/mpeg',
+        'sample_rates': UPSTREAM_SAMPLE_RATES,
+        'default_rate': 22050,
+        'extension': 'mp3',
+        'ffmpeg': ['-c:a', 'libmp3lame', '-b:a', '64k', '-f', 'mp3'],
+    },
+    'opus': {
+        'mimetype': 'audio/ogg',
+        'sample_rates': (8000, 16000, 24000, 48000),
+        'default_rate': 24000,
+        'extension': 'opus',
+        'ffmpeg': ['-c:a', 'libopus', '-b:a', OPUS_BITRATE, '-application', 'voip', '-f', 'ogg'],
+    },
+    'wav': {
+        'mimetype': 'audio/wav',
+        'sample_rates': UPSTREAM_SAMPLE_RATES,
+        'default_rate': 16000,
+        'extension': 'wav',
+        'ffmpeg': ['-c:a', 'pcm_s16le', '-f', 'wav'],
+    },
+    'pcm': {
+        'mimetype': 'audio/L16',
+        'sample_rates': UPSTREAM_SAMPLE_RATES,
+        'default_rate': 16000,
+        'extension': 'pcm',
+        'ffmpeg': ['-c:a', 'pcm_s16le', '-f', 's16le'],
+    },
+}
+
+MIMETYPE_FORMATS = {spec['mimetype']: name for name, spec in FORMATS.items()}
+MIMETYPE_FORMATS['audio/opus'] = 'opus'
+MIMETYPE_FORMATS['audio/mp3'] = 'mp3'
+MIMETYPE_FORMATS['audio/x-wav'] = 'wav'
+
+
+def ffmpeg_available():
+    return shutil.which('ffmpeg') is not None
+
+
+def content_type(audio_format, sample_rate):
+    """Content-Type header value (raw PCM needs its rate and channel count)"""
+    mimetype = FORMATS[audio_format]['mimetype']
+    if audio_format == 'pcm':
+        return f'{mimetype}; rate={sample_rate}; channels=1'
+    if audio_format == 'opus':
+        return f'{mimetype}; codecs=opus'
+    return mimetype
+
+
+def parse_sample_rate(value):
+    """A requested sample rate as a positive int, None when not given (raises ValueError)"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"invalid sample_rate: {value!r}")
+    try:
+        rate = int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"invalid sample_rate: {value!r}") from None
+    if rate <= 0:
+        raise ValueError(f"invalid sample_rate: {value!r}")
+    return rate
+
+
+def choose_sample_rate(audio_format, requested=None):
+    """Closest supported rate to the requested one (default rate when not given)"""
+    spec = FORMATS[audio_format]
+    requested = parse_sample_rate(requested)
+    if not requested:
+        return spec['default_rate']
+    return min(spec['sample_rates'], key=lambda rate: abs(rate - requested))
+
+
+def negotiate(accept_mimetypes=None, requested_format=None, requested_rate=None,
+              default='mp3', available=None):
+    """Pick (format, sample_rate) from an explicit format or the Accept header
+
+    `available` limits the choice (e.g. to the source format when ffmpeg is
+    missing); the default format wins ties and wildcard Accept headers.
+    Returns None when nothing acceptable can be produced, including a
+    requested_rate that is not a number (see parse_sample_rate).
+    """
+    try:
+        parse_sample_rate(requested_rate)
+    except ValueError:
+        return None
+    available = [name for name in (available or FORMATS) if name in FORMATS]
+    if default in available:
+        available.remove(default)
+        available.insert(0, default)
+
+    if requested_format:
+        audio_format = MIMETYPE_FORMATS.get(requested_format, requested_format)
+        if audio_format not in available:
+            return None
+    elif accept_mimetypes:
+        best = accept_mimetypes.best_match([FORMATS[name]['mimetype'] for name in available])
+        if best is None:
+            return None
+        audio_format = MIMETYPE_FORMATS[best]
+    else:
+        audio_format = available[0]
+
+    return audio_format, choose_sample_rate(audio_format, requested_rate)
+
+
+def ffmpeg_input_args(audio_format, sample_rate=None):
+    if audio_format == 'pcm':
+        return ['-f', 's16le', '-ar', str(sample_rate), '-ac', '1']
+    return []
+
+
+def transcode(data, source_format, audio_format, sample_rate, source_rate=None):
+    """Re-encode audio bytes with ffmpeg (raises RuntimeError on failure)"""
+    command = (['ffmpeg', '-hide_banner', '-loglevel', 'error']
+               + ffmpeg_input_args(source_format, source_rate or sample_rate)
+               + ['-i', 'pipe:0', '-ac', '1', '-ar', str(sample_rate)]
+               + FORMATS[audio_format]['ffmpeg'] + ['pipe:1'])
+    result = subprocess.run(command, input=data, capture_output=True)
+    if result.returncode != 0 or not result.stdout:
+        raise RuntimeError(f"ffmpeg {source_format} -> {audio_format} failed: "
+                           f"{result.stderr.decode(errors='replace').strip()}")
+    return result.stdout
+
+
+def transcode_file(source, output, audio_format, sample_rate):
+    command = (['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-i', str(source),
+                '-ac', '1', '-ar', str(sample_rate)] + FORMATS[audio_format]['ffmpeg'] + [str(output)])
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg {source} -> {audio_format} failed: "
+                           f"{result.stderr.decode(errors='replace').strip()}")
+
+
+class VariantCache:
+    """Transcoded copies of the files under an audio root, built on first request
+
+    Variants live in <root>/.variants/ and are rebuilt when the source file is
+    newer. Concurrent requests for the same variant wait for one encode.
+    """
+
+    def __init__(self, root, cache_dir='.variants'):
+        self.root = Path(root)
+        self.cache_dir = self.root / cache_dir
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def source_format(self, relpath):
+        extension = Path(relpath).suffix.lstrip('.').lower()
+        return extension if extension in FORMATS else None
+
+    def available_formats(self, relpath):
+        source = self.source_format(relpath)
+        if not ffmpeg_available():
+            return [source] if source else []
+        return list(FORMATS)
+
+    def variant_path(self, relpath, audio_format, sample_rate):
+        stem = Path(relpath).with_suffix('')
+        return self.cache_dir / f"{stem}.{sample_rate}.{FORMATS[audio_format]['extension']}"
+
+    def _lock(self, path):
+        with self._locks_lock:
+            return self._locks.setdefault(path, threading.Lock())
+
+    def get(self, relpath, audio_format, sample_rate):
+        """Path of the variant, transcoding it if missing or stale"""
+        source = self.root / relpath
+        output = self.variant_path(relpath, audio_format, sample_rate)
+
+        with self._lock(output):
+            if output.exists() and output.stat().st_mtime >= source.stat().st_mtime:
+                return output
+
+            output.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = output.with_name(output.name + '.tmp')
+            # ffmpeg picks the muxer from -f, so the .tmp suffix is fine
+            transcode_file(source, tmp_file, audio_format, sample_rate)
+            os.replace(tmp_file, output)
+            print(f"Audio variant built: {output} ({output.stat().st_size} bytes)", flush=True)
+            return output
+
+
+class AudioCache:
+    """Small LRU of synthesized/transcoded audio keyed by text and encoding"""
+
+    def __init__(self, max_entries=AUDIO_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256('\x00'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
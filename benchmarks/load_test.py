@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Load Test for the Smootie Chat and TTS Endpoints
+================================================
+
+Drives /api/chat/stream and /api/tts/synthesize at a target request rate and
+reports latency percentiles and server memory growth as JSON, so runs can be
+compared across commits.
+
+By default the Flask app is started in-process with the DashScope APIs
+replaced by the local stand-in in mock_dashscope.py (no network, no API
+cost). Use --url to target an already running server instead.
+
+Requests are scheduled open-loop: latencies are measured from each request's
+scheduled start, so client-side queueing shows up in the numbers instead of
+silently lowering the offered load.
+
+Metrics:
+- chat: ttft (first text event), ttfc (first function_call event), total
+- tts:  ttfb (first audio byte), total
+- rss:  server RSS before/after the run and growth per session
+- server_turns: the server's /api/metrics turn counters (cancelled turns and
+  wasted worker-seconds; a message supersedes its session's in-flight turn,
+  so fewer --sessions means more supersession)
+- server_routing: per-tier model TTFT and fallbacks from /api/metrics
+  (--model-delay gives each mock model its own first-chunk delay)
+
+/api/metrics is admin-only: the in-process server gets a random ADMIN_TOKEN,
+with --url pass --admin-token (default $ADMIN_TOKEN) or the server_* fields
+are missing.
+
+Usage:
+    python benchmarks/load_test.py --rps 20 --duration 30 --output bench.json
+    python benchmarks/load_test.py --rps 50 --tts-ratio 0.5 --token-rate 80 --failure-rate 0.02
+    python benchmarks/load_test.py --url http://localhost:5001 --server-pid 12345 --rps 5 --admin-token "$ADMIN_TOKEN"
+"""
+
+import argparse
+import contextlib
+import http.client
+import json
+import math
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from urllib.parse import urlparse
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from mock_dashscope import MockUpstream  # noqa: E402
+
+DEFAULT_ACTIONS = [
+    {"action": "twist", "video": "1.mp4", "keywords": ["扭", "twist"], "has_audio": False},
+    {"action": "shake", "video": "2.mp4", "keywords": ["抖", "shake"], "has_audio": False},
+    {"action": "bounce", "video": "3.mp4", "keywords": ["颠", "bounce"], "has_audio": False},
+    {"action": "sing", "video": "dance.mp4", "keywords": ["唱歌", "跳舞", "sing", "dance"], "has_audio": True},
+]
+
+DEFAULT_MESSAGES = ["你好", "扭一下", "我想看你扭", "唱个歌", "今天心情怎么样？"]
+DEFAULT_TTS_TEXT = "好呀，我这就扭给你看，喜欢吗？"
+
+
+def read_rss_kb(pid=None):
+    """Resident set size of a process in KB (Linux /proc, falls back to peak RSS)"""
+    status_path = f"/proc/{pid or 'self'}/status"
+    try:
+        with open(status_path) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if pid is None:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return None
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    # Nearest-rank percentile
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    """Latency summary in milliseconds"""
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values) * 1000, 2),
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p90_ms': round(percentile(values, 90) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'max_ms': round(max(values) * 1000, 2),
+    }
+
+
+def git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+class LoadClient:
+    """Issues chat/TTS requests over plain HTTP and records per-request timings"""
+
+    def __init__(self, base_url, actions=None, messages=None, tts_text=DEFAULT_TTS_TEXT, timeout=30,
+                 admin_token=None):
+        parsed = urlparse(base_url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.actions = actions if actions is not None else DEFAULT_ACTIONS
+        self.messages = messages or DEFAULT_MESSAGES
+        self.tts_text = tts_text
+        self.timeout = timeout
+        self.admin_token = admin_token
+
+        self._lock = threading.Lock()
+        self.results = {'chat': [], 'tts': []}
+
+    def _post(self, path, payload):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        connection.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+        return connection, connection.getresponse()
+
+    def _record(self, kind, result):
+        with self._lock:
+            self.results[kind].append(result)
+
+    def chat(self, index, session_id, scheduled_at):
+        result = {'ttft': None, 'ttfc': None, 'total': None, 'error': None, 'cancelled': None}
+        message = self.messages[index % len(self.messages)]
+        try:
+            connection, response = self._post('/api/chat/stream', {
+                'message': message,
+                'session_id': session_id,
+                'actions': self.actions,
+            })
+            try:
+                if response.status != 200:
+                    result['error'] = f"HTTP {response.status}"
+                    return
+                while True:
+                    line = response.readline()
+                    if not line:
+                        break
+                    if not line.startswith(b'data: '):
+                        continue
+                    event = json.loads(line[6:])
+                    elapsed = time.perf_counter() - scheduled_at
+                    if event['type'] == 'text' and result['ttft'] is None:
+                        result['ttft'] = elapsed
+                    elif event['type'] == 'function_call' and result['ttfc'] is None:
+                        result['ttfc'] = elapsed
+                    elif event['type'] == 'error':
+                        result['error'] = event.get('content', 'error event')
+                    elif event['type'] == 'cancelled':
+                        result['cancelled'] = event.get('reason')
+                        break
+                    elif event['type'] == 'done':
+                        break
+                result['total'] = time.perf_counter() - scheduled_at
+            finally:
+                connection.close()
+        except Exception as e:
+            result['error'] = f"{type(e).__name__}: {e}"
+        finally:
+            self._record('chat', result)
+
+    def server_metrics(self):
+        """The server's /api/metrics counters (None if unavailable or without admin_token)"""
+        if not self.admin_token:
+            return None
+        try:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                connection.request('GET', '/api/metrics',
+                                   headers={'Authorization': f'Bearer {self.admin_token}'})
+                response = connection.getresponse()
+                return json.loads(response.read()) if response.status == 200 else None
+            finally:
+                connection.close()
+        except (OSError, ValueError):
+            return None
+
+    def tts(self, index, session_id, scheduled_at):
+        result = {'ttfb': None, 'total': None, 'bytes': 0, 'error': None}
+        try:
+            connection, response = self._post('/api/tts/synthesize', {'text': self.tts_text})
+            try:
+                if response.status != 200:
+                    result['error'] = f"HTTP {response.status}"
+                    response.read()
+                    return
+                first = response.read(1)
+                if first:
+                    result['ttfb'] = time.perf_counter() - scheduled_at
+                result['bytes'] = len(first) + len(response.read())
+                result['total'] = time.perf_counter() - scheduled_at
+            finally:
+                connection.close()
+        except Exception as e:
+            result['error'] = f"{type(e).__name__}: {e}"
+        finally:
+            self._record('tts', result)
+
+
+def run_load(client, rps, duration, tts_ratio=0.0, sessions=10, concurrency=64):
+    """Schedule requests open-loop at `rps` for `duration` seconds"""
+    total_requests = max(1, int(rps * duration))
+    tts_every = int(round(1 / tts_ratio)) if tts_ratio > 0 else 0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i in range(total_requests):
+            scheduled_at = start + i / rps
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            session_id = f"load_session_{i % sessions}"
+            if tts_every and i % tts_every == 0:
+                executor.submit(client.tts, i, session_id, scheduled_at)
+            else:
+                executor.submit(client.chat, i, session_id, scheduled_at)
+    elapsed = time.perf_counter() - start
+
+    return total_requests, elapsed
+
+
+def build_report(client, total_requests, elapsed, rss_before, rss_after, sessions, args, upstream=None,
+                 server_metrics=None):
+    chat = client.results['chat']
+    tts = client.results['tts']
+
+    def errors(results):
+        return [r['error'] for r in results if r['error']]
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'target': args.url or 'in-process (mock upstream)',
+            'rps_target': args.rps,
+            'duration_s': args.duration,
+            'tts_ratio': args.tts_ratio,
+            'sessions': sessions,
+            'concurrency': args.concurrency,
+        },
+        'throughput': {
+            'requests': total_requests,
+            'elapsed_s': round(elapsed, 3),
+            'achieved_rps': round(total_requests / elapsed, 2) if elapsed else None,
+        },
+        'chat': {
+            'requests': len(chat),
+            'errors': len(errors(chat)),
+            'cancelled': sum(1 for r in chat if r['cancelled']),
+            'ttft': summarize([r['ttft'] for r in chat if r['ttft'] is not None]),
+            'ttfc': summarize([r['ttfc'] for r in chat if r['ttfc'] is not None]),
+            'total': summarize([r['total'] for r in chat
+                                if r['total'] is not None and not r['error'] and not r['cancelled']]),
+        },
+        'tts': {
+            'requests': len(tts),
+            'errors': len(errors(tts)),
+            'ttfb': summarize([r['ttfb'] for r in tts if r['ttfb'] is not None]),
+            'total': summarize([r['total'] for r in tts if r['total'] is not None and not r['error']]),
+        },
+        'rss': {
+            'before_kb': rss_before,
+            'after_kb': rss_after,
+            'growth_kb': rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+            'growth_per_session_kb': (round((rss_after - rss_before) / sessions, 2)
+                                      if rss_before is not None and rss_after is not None else None),
+        },
+    }
+
+    sample_errors = sorted(set(errors(chat) + errors(tts)))[:5]
+    if sample_errors:
+        report['sample_errors'] = sample_errors
+    if upstream is not None:
+        report['upstream'] = dict(upstream.stats)
+    if server_metrics is not None:
+        report['server_turns'] = server_metrics.get('turns')
+        report['server_routing'] = server_metrics.get('routing')
+    return report
+
+
+def start_server(port=0):
+    """Run the Flask app on a background thread, returns (server, base_url, admin_token)"""
+    import logging
+    from werkzeug.serving import make_server
+    import app
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    admin_token = app.profiling.ADMIN_TOKEN = app.profiling.ADMIN_TOKEN or secrets.token_hex(16)
+    server = make_server('127.0.0.1', port, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}", admin_token
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test /api/chat/stream and /api/tts/synthesize",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--url", type=str,
+                       help="Target a running server instead of the in-process mock setup")
+    parser.add_argument("--server-pid", type=int,
+                       help="PID of the --url server for RSS measurement")
+    parser.add_argument("--admin-token", type=str, default=os.getenv('ADMIN_TOKEN'),
+                       help="The --url server's ADMIN_TOKEN, needed for its /api/metrics (default: $ADMIN_TOKEN)")
+    parser.add_argument("--rps", type=float, default=10.0,
+                       help="Target requests per second (default: 10)")
+    parser.add_argument("--duration", type=float, default=10.0,
+                       help="Test duration in seconds (default: 10)")
+    parser.add_argument("--tts-ratio", type=float, default=0.25,
+                       help="Fraction of requests sent to TTS (default: 0.25)")
+    parser.add_argument("--sessions", type=int, default=20,
+                       help="Distinct session ids to rotate through; a new message supersedes "
+                            "its session's in-flight turn (default: 20)")
+    parser.add_argument("--concurrency", type=int, default=64,
+                       help="Max in-flight requests (default: 64)")
+    parser.add_argument("--output", type=str,
+                       help="Write the JSON report to this file (default: stdout)")
+    parser.add_argument("--verbose-server", action="store_true",
+                       help="Keep the in-process server's console output")
+
+    mock = parser.add_argument_group("mock upstream (in-process mode only)")
+    mock.add_argument("--token-rate", type=float, default=50.0,
+                     help="Generated tokens per second (default: 50)")
+    mock.add_argument("--first-token-delay", type=float, default=0.3,
+                     help="Seconds before the first chunk (default: 0.3)")
+    mock.add_argument("--tool-call-rate", type=float, default=0.5,
+                     help="Fraction of turns with a function call (default: 0.5)")
+    mock.add_argument("--tool-fragments", type=int, default=3,
+                     help="Chunks the tool-call arguments are split into (default: 3)")
+    mock.add_argument("--failure-rate", type=float, default=0.0,
+                     help="Fraction of chat turns answered with an upstream error")
+    mock.add_argument("--exception-rate", type=float, default=0.0,
+                     help="Fraction of chat calls that raise a connection error")
+    mock.add_argument("--tts-delay", type=float, default=0.2,
+                     help="Seconds before the first TTS frame (default: 0.2)")
+    mock.add_argument("--tts-failure-rate", type=float, default=0.0,
+                     help="Fraction of TTS calls that report an error")
+    mock.add_argument("--model-delay", action="append", default=[], metavar="MODEL=SECONDS",
+                     help="First-chunk delay for one model, e.g. qwen-plus=0.8 (repeatable)")
+    mock.add_argument("--seed", type=int, default=1,
+                     help="Random seed for failure/tool-call injection (default: 1)")
+
+    args = parser.parse_args()
+
+    upstream = None
+    server = None
+    quiet = contextlib.nullcontext()
+
+    if args.url:
+        base_url = args.url
+        admin_token = args.admin_token
+        rss_pid = args.server_pid
+    else:
+        upstream = MockUpstream(
+            tokens_per_second=args.token_rate,
+            first_token_delay=args.first_token_delay,
+            tool_call_rate=args.tool_call_rate,
+            tool_call_fragments=args.tool_fragments,
+            failure_rate=args.failure_rate,
+            exception_rate=args.exception_rate,
+            tts_first_frame_delay=args.tts_delay,
+            tts_failure_rate=args.tts_failure_rate,
+            model_first_token_delay={model: float(delay) for model, delay in
+                                     (item.split('=', 1) for item in args.model_delay)},
+            seed=args.seed,
+        )
+        server, base_url, admin_token = start_server()
+        upstream.install()
+        rss_pid = None
+        if not args.verbose_server:
+            quiet = contextlib.redirect_stdout(open(os.devnull, 'w'))
+
+    client = LoadClient(base_url, admin_token=admin_token)
+
+    with quiet:
+        rss_before = read_rss_kb(rss_pid) if (rss_pid or not args.url) else None
+        total_requests, elapsed = run_load(client, args.rps, args.duration, args.tts_ratio,
+                                           args.sessions, args.concurrency)
+        rss_after = read_rss_kb(rss_pid) if (rss_pid or not args.url) else None
+        server_metrics = client.server_metrics()
+
+    if server is not None:
+        server.shutdown()
+
+    report = build_report(client, total_requests, elapsed, rss_before, rss_after,
+                          args.sessions, args, upstream, server_metrics)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        print(f"Report written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
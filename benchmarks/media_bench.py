@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Throughput Benchmark for the Media-Processing Skill
+===================================================
+
+Generates deterministic synthetic source videos with ffmpeg (`testsrc`
+pattern + `sine` tone, bit-exact x264/aac encode, several lengths and
+resolutions) and runs the media paths of skills/search_videos.py on them at
+different parallelism levels:
+
+- split_source: split_source_video() - the serial --split path, cutting the
+                whole source into --clip-seconds clips (one run per source,
+                parallelism 1 only)
+- split:        split_clip() - the --build cut step, clips on a thread pool
+- transcode:    transcode_clip() with BUILD_ENCODE_DEFAULTS - the --build
+                delivery encode of the split clips, on a thread pool
+- probe:        batch_download.probe_duration() - download_source_video()'s
+                ffprobe step, --probes calls on a thread pool
+
+Each case runs in a fresh child process, so its ffmpeg/ffprobe children are
+the only ones counted. Reported per case:
+- clips_per_s:        clips (probe: files probed) per wall-clock second
+- cpu_s_per_output_s: user+sys CPU of the process and its children, divided
+                      by the seconds of media produced (probe: media probed)
+- peak_child_rss_mb:  largest single ffmpeg/ffprobe process (ru_maxrss)
+- peak_tree_rss_mb:   largest sampled sum of the process tree's RSS (/proc),
+                      i.e. what the parallel workers hold together
+
+Sources are cached in --workdir and regenerated only when missing; every case
+writes to a fresh build cache, so nothing is served from cache.
+
+Usage:
+    python benchmarks/media_bench.py
+    python benchmarks/media_bench.py --lengths 10,60 --resolutions 640x360,1920x1080 --workers 1,2,4,8
+    python benchmarks/media_bench.py --stage transcode --cores 2 --output media.json
+    python benchmarks/media_bench.py --baseline media.json --max-regression 0.10
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "skills"))
+
+from load_test import git_commit, read_rss_kb  # noqa: E402
+
+STAGES = ["split_source", "split", "transcode", "probe"]
+DEFAULT_WORKDIR = Path(tempfile.gettempdir()) / "smootie-media-bench"
+FRAME_RATE = 30
+RSS_SAMPLE_INTERVAL = 0.05
+
+
+def parse_list(value, cast=str):
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def source_name(resolution, length):
+    return f"{resolution}_{length:g}s"
+
+
+def generate_source(path, resolution, length):
+    """Deterministic test pattern + tone, identical bytes for identical ffmpeg builds"""
+    if path.exists():
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.stem}.tmp{path.suffix}")
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y",
+           "-f", "lavfi", "-i", f"testsrc=size={resolution}:rate={FRAME_RATE}:duration={length}",
+           "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=44100:duration={length}",
+           "-c:v", "libx264", "-preset", "veryfast", "-g", str(2 * FRAME_RATE), "-pix_fmt", "yuv420p",
+           "-threads", "1", "-c:a", "aac", "-b:a", "96k", "-shortest",
+           "-fflags", "+bitexact", "-flags:v", "+bitexact", "-flags:a", "+bitexact",
+           str(tmp_path)]
+    subprocess.run(cmd, check=True)
+    os.replace(tmp_path, path)
+
+
+def source_clips(length, clip_seconds, max_clips):
+    """Back-to-back clips covering the source, as build-manifest clip entries"""
+    clips = []
+    start = 0.0
+    while start + clip_seconds <= length + 1e-6 and len(clips) < max_clips:
+        clips.append({'action': f"clip{len(clips) + 1:02d}", 'start': start, 'end': start + clip_seconds})
+        start += clip_seconds
+    return clips
+
+
+def prepare_splits(workdir, name, source, clips):
+    """Split clips of a source (input of the transcode stage), cached in workdir"""
+    import search_videos
+
+    cache = search_videos.BuildCache(workdir / "prep" / name)
+    source_info = {'path': source, 'sha256': cache.content_hash(source)}
+    with contextlib.redirect_stdout(sys.stderr):
+        splits = [search_videos.split_clip(cache, clip, source_info) for clip in clips]
+    cache.save()
+    return [str(split['path']) for split in splits]
+
+
+class TreeRssSampler:
+    """Samples the summed RSS of this process and all its descendants"""
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _descendants(self):
+        parents = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # The command name may contain spaces: fields start after ')'
+                    fields = f.read().rpartition(')')[2].split()
+            except OSError:
+                continue
+            parents.setdefault(int(fields[1]), []).append(int(entry))
+        found, queue = [], [os.getpid()]
+        while queue:
+            pid = queue.pop()
+            found.append(pid)
+            queue.extend(parents.get(pid, []))
+        return found
+
+    def _run(self):
+        while True:
+            total = sum(read_rss_kb(pid) or 0 for pid in self._descendants())
+            self.peak_kb = max(self.peak_kb, total)
+            if self._stop.wait(self.interval):
+                return
+
+
+def run_stage(spec):
+    """Run one case's work, returns (items, output media seconds)"""
+    import batch_download
+    import search_videos
+
+    stage, workers = spec['stage'], spec['workers']
+    scratch = Path(spec['scratch'])
+
+    if stage == 'split_source':
+        timestamps = ",".join(f"{clip['start']:g}-{clip['end']:g}={clip['action']}" for clip in spec['clips'])
+        if not search_videos.split_source_video(spec['source'], timestamps, output_dir=scratch, dedup=False):
+            raise RuntimeError("split_source_video failed")
+        return len(spec['clips']), sum(clip['end'] - clip['start'] for clip in spec['clips'])
+
+    if stage == 'probe':
+        paths = [spec['source']] * spec['probes']
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            durations = list(executor.map(batch_download.probe_duration, paths))
+        if any(duration is None for duration in durations):
+            raise RuntimeError("ffprobe failed")
+        return len(durations), sum(durations)
+
+    cache = search_videos.BuildCache(scratch / "build")
+    if stage == 'split':
+        source_info = {'path': Path(spec['source']), 'sha256': spec['name']}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            artifacts = list(executor.map(lambda clip: search_videos.split_clip(cache, clip, source_info),
+                                          spec['clips']))
+    else:
+        encode = dict(search_videos.BUILD_ENCODE_DEFAULTS)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            artifacts = list(executor.map(
+                lambda path: search_videos.transcode_clip(cache, {'path': Path(path)}, encode), spec['splits']))
+    if any(artifact['cached'] for artifact in artifacts):
+        raise RuntimeError("build cache was not empty")
+    return len(artifacts), sum(clip['end'] - clip['start'] for clip in spec['clips'])
+
+
+def run_case(spec):
+    """Measure one case in this (fresh) process, returns its result dict"""
+    if spec.get('cores'):
+        os.sched_setaffinity(0, set(sorted(os.sched_getaffinity(0))[:spec['cores']]))
+
+    scratch = Path(tempfile.mkdtemp(prefix="media-bench-"))
+    spec = {**spec, 'scratch': str(scratch)}
+    try:
+        before_self = resource.getrusage(resource.RUSAGE_SELF)
+        started = time.perf_counter()
+        with TreeRssSampler() as sampler, contextlib.redirect_stdout(sys.stderr):
+            items, output_seconds = run_stage(spec)
+        wall = time.perf_counter() - started
+        after_self = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    cpu = (after_self.ru_utime - before_self.ru_utime + after_self.ru_stime - before_self.ru_stime
+           + children.ru_utime + children.ru_stime)
+    return {
+        'wall_s': round(wall, 3),
+        'clips': items,
+        'output_seconds': round(output_seconds, 3),
+        'clips_per_s': round(items / wall, 3),
+        'cpu_s': round(cpu, 3),
+        'cpu_s_per_output_s': round(cpu / output_seconds, 4) if output_seconds else None,
+        # ru_maxrss is in KB on Linux
+        'peak_child_rss_mb': round(children.ru_maxrss / 1024, 1),
+        'peak_tree_rss_mb': round(sampler.peak_kb / 1024, 1),
+    }
+
+
+def measure(spec, repeat):
+    """Run a case `repeat` times in child processes, keep the median-wall run"""
+    runs = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, __file__, "--run-case", json.dumps(spec)],
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"case failed: {result.stderr.strip()[-500:]}")
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    runs.sort(key=lambda run: run['wall_s'])
+    chosen = runs[len(runs) // 2]
+    if repeat > 1:
+        chosen['wall_s_runs'] = [run['wall_s'] for run in runs]
+        chosen['wall_s_stdev'] = round(statistics.stdev(chosen['wall_s_runs']), 3)
+    return chosen
+
+
+def ffmpeg_version():
+    try:
+        result = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True)
+        return result.stdout.splitlines()[0] if result.stdout else None
+    except FileNotFoundError:
+        return None
+
+
+def run_benchmarks(args):
+    stages = args.stage or STAGES
+    results = {}
+    for resolution in parse_list(args.resolutions):
+        for length in parse_list(args.lengths, float):
+            name = source_name(resolution, length)
+            source = args.workdir / "sources" / f"{name}.mp4"
+            generate_source(source, resolution, length)
+            clips = source_clips(length, args.clip_seconds, args.max_clips)
+            if not clips:
+                print(f"  {name}: shorter than --clip-seconds, skipped", file=sys.stderr)
+                continue
+            base = {'name': name, 'source': str(source), 'clips': clips,
+                    'probes': args.probes, 'cores': args.cores}
+            if 'transcode' in stages:
+                base['splits'] = prepare_splits(args.workdir, name, source, clips)
+
+            for stage in stages:
+                for workers in ([1] if stage == 'split_source' else args.workers):
+                    case = f"{stage}/{name}/w{workers}"
+                    result = {'stage': stage, 'source': name, 'resolution': resolution,
+                              'source_seconds': length, 'workers': workers,
+                              **measure({**base, 'stage': stage, 'workers': workers}, args.repeat)}
+                    results[case] = result
+                    print(f"  {case:32s} {result['clips_per_s']:8.2f} clips/s  "
+                          f"{result['cpu_s_per_output_s'] or 0:7.3f} cpu-s/out-s  "
+                          f"{result['peak_tree_rss_mb']:7.1f} MB tree peak", file=sys.stderr)
+    return results
+
+
+def check_regressions(results, baseline, max_regression):
+    """Return descriptions of cases with lower clips/s or higher CPU per output second than baseline"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        slowdown = previous['clips_per_s'] / result['clips_per_s'] - 1
+        if slowdown > max_regression:
+            regressions.append(f"{name}: {previous['clips_per_s']} -> {result['clips_per_s']} clips/s "
+                               f"(-{slowdown:.0%} throughput, limit {max_regression:.0%})")
+        if previous.get('cpu_s_per_output_s') and result.get('cpu_s_per_output_s'):
+            ratio = result['cpu_s_per_output_s'] / previous['cpu_s_per_output_s'] - 1
+            if ratio > max_regression:
+                regressions.append(f"{name}: {previous['cpu_s_per_output_s']} -> {result['cpu_s_per_output_s']} "
+                                   f"cpu-s/out-s (+{ratio:.0%}, limit +{max_regression:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark split/probe/transcode throughput on synthetic videos")
+    parser.add_argument("--lengths", type=str, default="10,30",
+                       help="Source lengths in seconds (default: 10,30)")
+    parser.add_argument("--resolutions", type=str, default="640x360,1280x720",
+                       help="Source resolutions (default: 640x360,1280x720)")
+    parser.add_argument("--workers", type=str, default="1,2,4",
+                       help="Parallelism levels (default: 1,2,4)")
+    parser.add_argument("--stage", action="append", choices=STAGES,
+                       help="Only run this stage (repeatable)")
+    parser.add_argument("--clip-seconds", type=float, default=3.0,
+                       help="Length of each clip cut from a source (default: 3)")
+    parser.add_argument("--max-clips", type=int, default=12,
+                       help="Clips per source at most (default: 12)")
+    parser.add_argument("--probes", type=int, default=20,
+                       help="ffprobe calls per probe case (default: 20)")
+    parser.add_argument("--cores", type=int,
+                       help="Pin each case to this many CPUs (default: all available)")
+    parser.add_argument("--repeat", type=int, default=1,
+                       help="Runs per case, the median-wall run is reported (default: 1)")
+    parser.add_argument("--workdir", type=Path, default=DEFAULT_WORKDIR,
+                       help=f"Synthetic sources and split clips (default: {DEFAULT_WORKDIR})")
+    parser.add_argument("--output", type=str,
+                       help="Write the JSON report to this file (default: stdout)")
+    parser.add_argument("--baseline", type=str,
+                       help="Previous JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10,
+                       help="Allowed clips/s or CPU-per-output-second regression vs --baseline (default: 0.10)")
+    parser.add_argument("--run-case", type=str, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(json.loads(args.run_case))))
+        return
+
+    if not shutil.which("ffmpeg") or not shutil.which("ffprobe"):
+        print("Error: ffmpeg and ffprobe are required")
+        sys.exit(1)
+    args.workers = parse_list(args.workers, int)
+    args.workdir = args.workdir.resolve()
+
+    print("=== Media processing throughput ===", file=sys.stderr)
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'cores': args.cores or len(os.sched_getaffinity(0)),
+            'ffmpeg': ffmpeg_version(),
+            'clip_seconds': args.clip_seconds,
+        },
+        'results': run_benchmarks(args),
+    }
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = check_regressions(report['results'], baseline, args.max_regression)
+        if regressions:
+            print("\nRegressions:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  ✗ {regression}", file=sys.stderr)
+            sys.exit(1)
+        print("\n✓ No regressions against baseline", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Local stand-in for the DashScope APIs used by app.py and tts.py
+
+MockUpstream implements streaming `Generation.call` (incremental message
+chunks, optionally with tool calls split across several chunks) and
+callback-based `SpeechSynthesizer.call` (on_open / on_event frames /
+on_complete / on_close). Token rate, first-chunk delay (also per model),
+tool-call chunking and failure injection (also per model) are configurable so
+the server can be load-tested without network access or API cost.
+
+Usage:
+    from mock_dashscope import MockUpstream
+    upstream = MockUpstream(tokens_per_second=40, failure_rate=0.01)
+    restore = upstream.install()
+    ...
+    restore()
+"""
+import json
+import random
+import threading
+import time
+from http import HTTPStatus
+
+DEFAULT_REPLY = '好呀，我这就扭给你看，喜欢吗？'
+DEFAULT_TOOL_ARGUMENTS = {'action': 'twist', 'video_id': '1.mp4', 'has_audio': False}
+
+
+class DictMixin(dict):
+    """Attribute access over dict keys, like DashScope's DictMixin"""
+
+    def __getattr__(self, attr):
+        try:
+            return self[attr]
+        except KeyError:
+            raise AttributeError(attr) from None
+
+
+class MockUpstream:
+    """Configurable fake for DashScope Generation and SpeechSynthesizer"""
+
+    def __init__(self, tokens_per_second=50.0, first_token_delay=0.3, reply_text=DEFAULT_REPLY,
+                 chars_per_token=1, tool_call_rate=0.5, tool_call_fragments=3,
+                 tool_arguments=None, failure_rate=0.0, exception_rate=0.0,
+                 tts_first_frame_delay=0.2, tts_frame_interval=0.02, tts_frames=10,
+                 tts_frame_bytes=1024, tts_failure_rate=0.0, model_first_token_delay=None,
+                 failing_models=(), seed=None):
+        self.tokens_per_second = tokens_per_second
+        self.first_token_delay = first_token_delay
+        self.reply_text = reply_text
+        self.chars_per_token = chars_per_token
+        self.tool_call_rate = tool_call_rate
+        self.tool_call_fragments = tool_call_fragments
+        self.tool_arguments = tool_arguments or DEFAULT_TOOL_ARGUMENTS
+        self.failure_rate = failure_rate
+        self.exception_rate = exception_rate
+        self.tts_first_frame_delay = tts_first_frame_delay
+        self.tts_frame_interval = tts_frame_interval
+        self.tts_frames = tts_frames
+        self.tts_frame_bytes = tts_frame_bytes
+        self.tts_failure_rate = tts_failure_rate
+        self.model_first_token_delay = model_first_token_delay or {}
+        self.failing_models = set(failing_models)
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'generation_calls': 0, 'generation_chunks': 0, 'tts_calls': 0, 'tts_frames': 0}
+
+    def _roll(self, rate):
+        with self._lock:
+            return self._random.random() < rate
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    # ---- Generation ------------------------------------------------------
+
+    def _response(self, content='', tool_calls=None):
+        message = DictMixin(role='assistant', content=content)
+        if tool_calls is not None:
+            message['tool_calls'] = tool_calls
+        choice = DictMixin(message=message, finish_reason='null')
+        return DictMixin(status_code=HTTPStatus.OK, code='', message='',
+                         output=DictMixin(choices=[choice]))
+
+    def _error_response(self):
+        return DictMixin(status_code=HTTPStatus.TOO_MANY_REQUESTS, code='Throttling',
+                         message='Mock upstream injected failure', output=None)
+
+    def _tool_call_chunks(self):
+        arguments = json.dumps(self.tool_arguments, ensure_ascii=False)
+        count = max(1, self.tool_call_fragments)
+        size = -(-len(arguments) // count)
+        chunks = []
+        for i in range(count):
+            function = {'arguments': arguments[i * size:(i + 1) * size]}
+            if i == 0:
+                function['name'] = 'play_action_video'
+            chunks.append([{'index': 0, 'id': 'call_mock' if i == 0 else '', 'type': 'function',
+                            'function': function}])
+        return chunks
+
+    def generation_call(self, **kwargs):
+        """Drop-in for Generation.call(stream=True, incremental_output=True)"""
+        self._count('generation_calls')
+        if self._roll(self.exception_rate):
+            raise ConnectionError('Mock upstream injected connection error')
+        model = kwargs.get('model')
+        return self._generate(bool(kwargs.get('tools')),
+                              self.model_first_token_delay.get(model, self.first_token_delay),
+                              model in self.failing_models)
+
+    def _generate(self, has_tools, first_token_delay, fail=False):
+        time.sleep(first_token_delay)
+
+        if fail or self._roll(self.failure_rate):
+            yield self._error_response()
+            return
+
+        interval = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0
+        text = self.reply_text
+        step = max(1, self.chars_per_token)
+        for i in range(0, len(text), step):
+            if i:
+                time.sleep(interval)
+            self._count('generation_chunks')
+            yield self._response(content=text[i:i + step])
+
+        if has_tools and self._roll(self.tool_call_rate):
+            for tool_calls in self._tool_call_chunks():
+                time.sleep(interval)
+                self._count('generation_chunks')
+                yield self._response(tool_calls=tool_calls)
+
+    # ---- SpeechSynthesizer -------------------------------------------------
+
+    def speech_synthesizer_call(self, model, text, callback=None, **kwargs):
+        """Drop-in for SpeechSynthesizer.call(..., callback=...)"""
+        self._count('tts_calls')
+        if callback is not None:
+            callback.on_open()
+
+        time.sleep(self.tts_first_frame_delay)
+
+        if self._roll(self.tts_failure_rate):
+            if callback is not None:
+                callback.on_error('Mock upstream injected TTS failure')
+                callback.on_close()
+            return None
+
+        frame = bytes(self.tts_frame_bytes)
+        for i in range(self.tts_frames):
+            if i:
+                time.sleep(self.tts_frame_interval)
+            self._count('tts_frames')
+            if callback is not None:
+                callback.on_event(MockSpeechResult(frame))
+
+        if callback is not None:
+            callback.on_complete()
+            callback.on_close()
+        return None
+
+    # ---- Installation ------------------------------------------------------
+
+    def install(self):
+        """Patch app.py / tts.py to use this upstream; returns a function that restores them"""
+        import app
+        import dashscope.audio.tts as dashscope_tts
+
+        upstream = self
+
+        class MockGeneration:
+            @staticmethod
+            def call(**kwargs):
+                return upstream.generation_call(**kwargs)
+
+        class MockSpeechSynthesizer:
+            @staticmethod
+            def call(model, text, callback=None, **kwargs):
+                return upstream.speech_synthesizer_call(model, text, callback=callback, **kwargs)
+
+        original_generation = app.Generation
+        original_synthesizer = dashscope_tts.SpeechSynthesizer
+        app.Generation = MockGeneration
+        dashscope_tts.SpeechSynthesizer = MockSpeechSynthesizer
+
+        def restore():
+            app.Generation = original_generation
+            dashscope_tts.SpeechSynthesizer = original_synthesizer
+
+        return restore
+
+
+class MockSpeechResult:
+    """Minimal SpeechSynthesisResult carrying one audio frame"""
+
+    def __init__(self, frame):
+        self._frame = frame
+
+    def get_audio_frame(self):
+        return self._frame
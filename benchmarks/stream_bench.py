@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Micro-Benchmark for the Chat Stream Hot Loop
+============================================
+
+Replays upstream chunk sequences (benchmarks/fixtures/chat_chunks.json)
+through ChatStreamProcessor and sse_event from chat_stream.py - the same
+per-chunk work generate() in app.py does for every token: tool_calls /
+content attribute access, argument fragment accumulation, JSON encoding and
+SSE framing, plus the function_call and done frames at the end of a turn.
+
+Reported per sequence:
+- ns_per_chunk:               median (and best) wall time over several rounds
+- peak_alloc_bytes_per_chunk: tracemalloc peak above baseline during one replay,
+                              divided by the chunk count (transient allocation)
+- retained_bytes_per_chunk:   memory still held after the replay (should be ~0)
+
+Usage:
+    python benchmarks/stream_bench.py
+    python benchmarks/stream_bench.py --output stream.json
+    python benchmarks/stream_bench.py --baseline stream.json --max-regression 0.10
+
+    # Record a real chunk sequence through /api/chat/stream (needs DASHSCOPE_API_KEY)
+    python benchmarks/stream_bench.py --record "扭一下" --name twist_live
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from chat_stream import ChatStreamProcessor, sse_event  # noqa: E402
+from load_test import DEFAULT_ACTIONS, git_commit  # noqa: E402
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures' / 'chat_chunks.json'
+
+
+def load_sequences(path=FIXTURES):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['sequences']
+
+
+def to_messages(chunks):
+    """Wrap recorded chunk dicts in DashScope's Message type (or an equivalent)"""
+    try:
+        from dashscope.api_entities.dashscope_response import Message
+    except ImportError:
+        from mock_dashscope import DictMixin
+
+        def Message(**fields):
+            return DictMixin(**fields)
+
+    return [Message(**chunk) for chunk in chunks]
+
+
+def replay(messages):
+    """One chat turn of per-chunk work, as in generate()"""
+    frames = 0
+    stream = ChatStreamProcessor()
+    for message in messages:
+        frame = stream.process(message)
+        if frame:
+            frames += 1
+    if stream.flush():
+        frames += 1
+    for function_call_data in stream.function_calls():
+        sse_event({'type': 'function_call', 'function': function_call_data})
+        frames += 1
+    sse_event({'type': 'done', 'content': stream.full_response})
+    return frames + 1
+
+
+def time_sequence(messages, rounds=7, min_round_time=0.2):
+    """Median and best ns/chunk over `rounds` rounds of auto-sized iteration counts"""
+    iterations = 1
+    while True:
+        start = time.perf_counter_ns()
+        for _ in range(iterations):
+            replay(messages)
+        if (time.perf_counter_ns() - start) / 1e9 >= min_round_time / 4:
+            break
+        iterations *= 2
+    iterations *= 4
+
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter_ns()
+        for _ in range(iterations):
+            replay(messages)
+        elapsed = time.perf_counter_ns() - start
+        samples.append(elapsed / (iterations * len(messages)))
+
+    return statistics.median(samples), min(samples), iterations
+
+
+def measure_allocations(messages):
+    """Transient peak and retained bytes per chunk for one replay"""
+    replay(messages)  # warm caches (json encoder, interned strings)
+
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        replay(messages)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return (peak - baseline) / len(messages), max(0, current - baseline) / len(messages)
+
+
+def run_benchmarks(sequences, rounds=7):
+    results = {}
+    for name, chunks in sequences.items():
+        messages = to_messages(chunks)
+        median_ns, best_ns, iterations = time_sequence(messages, rounds=rounds)
+        peak_bytes, retained_bytes = measure_allocations(messages)
+        results[name] = {
+            'chunks': len(messages),
+            'frames': replay(messages),
+            'iterations_per_round': iterations,
+            'ns_per_chunk': round(median_ns, 1),
+            'best_ns_per_chunk': round(best_ns, 1),
+            'peak_alloc_bytes_per_chunk': round(peak_bytes, 1),
+            'retained_bytes_per_chunk': round(retained_bytes, 1),
+        }
+        print(f"  {name:24s} {median_ns:10.1f} ns/chunk  "
+              f"{peak_bytes:8.1f} B/chunk peak  ({len(messages)} chunks)", file=sys.stderr)
+    return results
+
+
+def check_regressions(results, baseline, max_regression):
+    """Return descriptions of sequences slower than baseline by more than max_regression"""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous:
+            continue
+        ratio = result['ns_per_chunk'] / previous['ns_per_chunk'] - 1
+        if ratio > max_regression:
+            regressions.append(f"{name}: {previous['ns_per_chunk']} -> {result['ns_per_chunk']} ns/chunk "
+                               f"(+{ratio:.0%}, limit +{max_regression:.0%})")
+    return regressions
+
+
+def record_sequence(message, name, path=FIXTURES):
+    """Send one real turn through /api/chat/stream and save the upstream chunks"""
+    import app
+
+    recorded = []
+    original_generation = app.Generation
+
+    class RecordingGeneration:
+        @staticmethod
+        def call(**kwargs):
+            for response in original_generation.call(**kwargs):
+                if response.status_code == 200:
+                    message_data = response.output.choices[0].message
+                    recorded.append({key: message_data[key] for key in message_data
+                                     if key in ('role', 'content', 'tool_calls')})
+                yield response
+
+    app.Generation = RecordingGeneration
+    try:
+        client = app.app.test_client()
+        response = client.post('/api/chat/stream', json={
+            'message': message, 'session_id': f'record_{name}', 'actions': DEFAULT_ACTIONS})
+        response.get_data()
+    finally:
+        app.Generation = original_generation
+
+    with open(path, encoding='utf-8') as f:
+        fixtures = json.load(f)
+    fixtures['sequences'][name] = recorded
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(fixtures, f, ensure_ascii=False, indent=1)
+    print(f"Recorded {len(recorded)} chunks as '{name}' in {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark the chat stream hot loop")
+    parser.add_argument("--fixtures", type=str, default=str(FIXTURES),
+                       help="Chunk sequence fixtures (default: benchmarks/fixtures/chat_chunks.json)")
+    parser.add_argument("--sequence", action="append",
+                       help="Only run this sequence (repeatable)")
+    parser.add_argument("--rounds", type=int, default=7,
+                       help="Timing rounds per sequence (default: 7)")
+    parser.add_argument("--output", type=str,
+                       help="Write the JSON report to this file (default: stdout)")
+    parser.add_argument("--baseline", type=str,
+                       help="Previous JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10,
+                       help="Allowed ns/chunk slowdown vs --baseline (default: 0.10)")
+    parser.add_argument("--record", type=str, metavar="MESSAGE",
+                       help="Record a live upstream chunk sequence for MESSAGE")
+    parser.add_argument("--name", type=str,
+                       help="Fixture name for --record")
+
+    args = parser.parse_args()
+
+    if args.record:
+        if not args.name:
+            print("Error: --name is required for --record")
+            sys.exit(1)
+        record_sequence(args.record, args.name, args.fixtures)
+        return
+
+    sequences = load_sequences(args.fixtures)
+    if args.sequence:
+        sequences = {name: sequences[name] for name in args.sequence}
+
+    print("=== Chat stream hot loop ===", file=sys.stderr)
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': sys.version.split()[0],
+        },
+        'results': run_benchmarks(sequences, rounds=args.rounds),
+    }
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = check_regressions(report['results'], baseline, args.max_regression)
+        if regressions:
+            print("\nRegressions:", file=sys.stderr)
+            for regression in regressions:
+                print(f"  ✗ {regression}", file=sys.stderr)
+            sys.exit(1)
+        print("\n✓ No regressions against baseline", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+WebSocket duplex channel for chat turns and TTS audio
+
+One connection per session carries everything a voice turn needs:
+
+Client -> server (JSON text messages):
+    {"type": "chat", "id": "t1", "message": "...", "actions": [...], "tts": true, "format": "opus"}
+    {"type": "tts", "id": "t2", "text": "...", "format": "pcm", "sample_rate": 16000}
+    {"type": "ack", "channel": 3, "frames": 8}      # flow control credit
+    {"type": "cancel", "turn": "t1"}                # drop the in-flight turn (superseded anyway by a new chat)
+    {"type": "clear"}
+    {"type": "asr_start", "id": "t3", "format": "pcm", "commands": {...}}
+    {"type": "asr_stop", "channel": 4}
+    binary frames  4-byte big-endian channel number + microphone audio (after asr_ready)
+
+Server -> client:
+    text messages  {"id": "t1", "event": {"type": "text" | "function_call" | "done" | "error", ...}}
+                   {"id": "t1", "event": {"type": "audio_start", "channel": 3, "format": "mp3", "sample_rate": 22050}}
+                   {"id": "t1", "event": {"type": "audio_end", "channel": 3, "bytes": 12345}}
+                   {"id": "t3", "event": {"type": "asr_ready" | "partial" | "intent" | "final", ...}}
+    binary frames  4-byte big-endian channel number + audio payload
+
+Requests run on worker threads, at most WS_MAX_REQUESTS at once per
+connection; a request beyond that is answered with an error event instead of
+starting another upstream call. "cancel" runs on the reading thread, so it is
+never refused.
+
+Flow control is per audio message: the server sends at most
+WS_AUDIO_WINDOW unacknowledged frames on a channel and waits for "ack"
+credit before sending more, so a slow client cannot make the server buffer
+a whole reply in the socket. Input channels (speech recognition) are not
+flow controlled: the client sends audio in real time and the server queues it.
+"""
+import json
+import os
+import queue
+import struct
+import threading
+
+from chat_stream import sse_payload
+
+WS_AUDIO_WINDOW = int(os.getenv('WS_AUDIO_WINDOW', '32'))
+WS_CREDIT_TIMEOUT = float(os.getenv('WS_CREDIT_TIMEOUT', '10'))
+# Concurrent requests (chat, tts, asr_start) per connection
+WS_MAX_REQUESTS = int(os.getenv('WS_MAX_REQUESTS', '4'))
+# Cheap requests handled on the reading thread, outside the limit
+INLINE_REQUESTS = ('cancel',)
+
+CHANNEL_HEADER = struct.Struct('>I')
+
+
+class FlowControlTimeout(Exception):
+    """The client stopped granting credit for an audio channel"""
+
+
+class DuplexChannel:
+    """Serializes sends and tracks per-channel audio credit for one WebSocket"""
+
+    def __init__(self, ws, session_id='default', window=WS_AUDIO_WINDOW, credit_timeout=WS_CREDIT_TIMEOUT,
+                 max_requests=WS_MAX_REQUESTS):
+        self.ws = ws
+        self.session_id = session_id
+        self.window = window
+        self.credit_timeout = credit_timeout
+        self.closed = False
+
+        self._send_lock = threading.Lock()
+        self._credit = threading.Condition()
+        self._credits = {}
+        self._inputs = {}
+        self._close_callbacks = set()
+        self._next_channel = 1
+        self._requests = threading.BoundedSemaphore(max(1, max_requests))
+
+    def _send(self, data):
+        with self._send_lock:
+            self.ws.send(data)
+
+    def send_event(self, turn_id, payload):
+        self._send(json.dumps({'id': turn_id, 'event': payload}))
+
+    def send_frame(self, turn_id, frame):
+        """Forward the event of an SSE frame built by chat_stream"""
+        self.send_event(turn_id, sse_payload(frame))
+
+    def open_audio(self, turn_id, audio_format, sample_rate=None):
+        with self._credit:
+            channel = self._next_channel
+            self._next_channel += 1
+            self._credits[channel] = self.window
+        event = {'type': 'audio_start', 'channel': channel, 'format': audio_format}
+        if sample_rate:
+            event['sample_rate'] = sample_rate
+        self.send_event(turn_id, event)
+        return channel
+
+    def send_audio(self, channel, data):
+        """Send one audio frame, waiting for credit when the window is used up"""
+        with self._credit:
+            if not self._credit.wait_for(lambda: self.closed or self._credits.get(channel, 0) > 0,
+                                         timeout=self.credit_timeout):
+                raise FlowControlTimeout(f"No credit for audio channel {channel}")
+            if self.closed:
+                raise ConnectionError("WebSocket closed")
+            self._credits[channel] -= 1
+        self._send(CHANNEL_HEADER.pack(channel) + data)
+
+    def close_audio(self, turn_id, channel, total_bytes):
+        with self._credit:
+            self._credits.pop(channel, None)
+        if not self.closed:
+            self.send_event(turn_id, {'type': 'audio_end', 'channel': channel, 'bytes': total_bytes})
+
+    def open_input(self):
+        """Allocate a channel for client audio, returns (channel, queue of chunks)
+
+        The queue receives None when the client sends asr_stop or disconnects.
+        """
+        frames = queue.Queue()
+        with self._credit:
+            channel = self._next_channel
+            self._next_channel += 1
+            self._inputs[channel] = frames
+        return channel, frames
+
+    def close_input(self, channel):
+        with self._credit:
+            frames = self._inputs.pop(channel, None)
+        if frames is not None:
+            frames.put(None)
+
+    def receive_audio(self, data):
+        if len(data) < CHANNEL_HEADER.size:
+            return
+        (channel,) = CHANNEL_HEADER.unpack_from(data)
+        frames = self._inputs.get(channel)
+        if frames is not None:
+            frames.put(data[CHANNEL_HEADER.size:])
+
+    def grant(self, channel, frames):
+        with self._credit:
+            if channel in self._credits:
+                self._credits[channel] += frames
+                self._credit.notify_all()
+
+    def add_close_callback(self, callback):
+        """Call callback() when the socket closes (e.g. to cancel a running turn)"""
+        with self._credit:
+            if not self.closed:
+                self._close_callbacks.add(callback)
+                return
+        callback()
+
+    def remove_close_callback(self, callback):
+        with self._credit:
+            self._close_callbacks.discard(callback)
+
+    def submit(self, handle_request, message):
+        """Run handle_request(self, message) on its own thread, unless WS_MAX_REQUESTS are running
+
+        Returns False (after telling the client) when the request was refused.
+        """
+        if not self._requests.acquire(blocking=False):
+            self.send_event(message.get('id'), {'type': 'error', 'content': 'Too many requests in flight'})
+            return False
+
+        def run():
+            try:
+                handle_request(self, message)
+            finally:
+                self._requests.release()
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def shutdown(self):
+        with self._credit:
+            self.closed = True
+            self._credit.notify_all()
+            inputs = list(self._inputs)
+            callbacks, self._close_callbacks = self._close_callbacks, set()
+        for channel in inputs:
+            self.close_input(channel)
+        for callback in callbacks:
+            callback()
+
+    def serve(self, handle_request):
+        """Read messages until the socket closes; requests run on their own threads (see submit)"""
+        try:
+            while True:
+                raw = self.ws.receive()
+                if raw is None:
+                    break
+                if isinstance(raw, bytes):
+                    self.receive_audio(raw)
+                    continue
+
+                try:
+                    message = json.loads(raw)
+                except json.JSONDecodeError:
+                    self.send_event(None, {'type': 'error', 'content': 'Invalid JSON message'})
+                    continue
+                # A bad message is answered with an error; it must not end the socket's other turns
+                if not isinstance(message, dict):
+                    self.send_event(None, {'type': 'error', 'content': 'Message must be a JSON object'})
+                    continue
+
+                if message.get('type') in ('ack', 'asr_stop'):
+                    channel = message.get('channel')
+                    if not isinstance(channel, int):
+                        self.send_event(None, {'type': 'error', 'content': f"Invalid channel: {channel!r}"})
+                        continue
+                    if message['type'] == 'asr_stop':
+                        self.close_input(channel)
+                        continue
+                    try:
+                        frames = int(message.get('frames', 1))
+                    except (TypeError, ValueError):
+                        frames = 0
+                    if frames < 1:
+                        self.send_event(None, {'type': 'error',
+                                               'content': f"Invalid ack frames: {message.get('frames')!r}"})
+                        continue
+                    self.grant(channel, frames)
+                    continue
+
+                if message.get('type') in INLINE_REQUESTS:
+                    handle_request(self, message)
+                else:
+                    self.submit(handle_request, message)
+        finally:
+            self.shutdown()
+
+
+def stream_audio(channel_io, turn_id, frames, audio_format, sample_rate=None):
+    """Push audio frames to the client as they are produced, returns bytes sent"""
+    channel = channel_io.open_audio(turn_id, audio_format, sample_rate)
+    total_bytes = 0
+    try:
+        for frame in frames:
+            channel_io.send_audio(channel, frame)
+            total_bytes += len(frame)
+    finally:
+        channel_io.close_audio(turn_id, channel, total_bytes)
+    return total_bytes
@@ -0,0 +1,341 @@
+"""
+Per-chunk processing for streamed chat responses
+
+Shared by generate() in app.py and the micro-benchmarks in benchmarks/, so
+the hot loop that runs for every upstream token is measured as it ships.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from json.encoder import encode_basestring_ascii
+
+# Merge consecutive text chunks into one SSE event: flush once the oldest
+# buffered chunk is SSE_COALESCE_MS old or SSE_COALESCE_BYTES are buffered.
+# Both 0 (default) sends one event per upstream chunk.
+SSE_COALESCE_MS = float(os.getenv('SSE_COALESCE_MS', '0'))
+SSE_COALESCE_BYTES = int(os.getenv('SSE_COALESCE_BYTES', '0'))
+
+# Reply budget: a reply stops after REPLY_MAX_SENTENCES sentences or
+# REPLY_MAX_CHARS characters (0: no limit); a set's "reply" entry in
+# videosets.json ({"maxSentences": 1, "maxChars": 60}) overrides both
+REPLY_BUDGET = os.getenv('REPLY_BUDGET', 'true').lower() == 'true'
+REPLY_MAX_SENTENCES = int(os.getenv('REPLY_MAX_SENTENCES', '2'))
+REPLY_MAX_CHARS = int(os.getenv('REPLY_MAX_CHARS', '100'))
+# The character limit also caps the call's max_tokens (at most one token per
+# character, plus REPLY_TOOL_TOKENS for a tool call's name and arguments), so
+# upstream stops generating where the reply would be cut anyway
+REPLY_TOKENS_PER_CHAR = float(os.getenv('REPLY_TOKENS_PER_CHAR', '1.0'))
+REPLY_TOOL_TOKENS = int(os.getenv('REPLY_TOOL_TOKENS', '60'))
+
+SENTENCE_ENDS = frozenset('。！？!?…')
+# Closing quotes/brackets still belong to the sentence they follow
+SENTENCE_CLOSERS = frozenset('"\'”’）)》】」』～~')
+# Where a reply cut by the character limit should preferably end
+PAUSES = frozenset('，,、；;：:')
+
+SSE_PREFIX = 'data: '
+SSE_SUFFIX = '\n\n'
+# Same bytes json.dumps({'type': 'text', 'content': ...}) produces, without building a dict
+TEXT_EVENT_PREFIX = 'data: {"type": "text", "content": '
+TEXT_EVENT_SUFFIX = '}\n\n'
+
+
+def sse_event(payload):
+    """Frame a payload as a Server-Sent Events data line"""
+    return SSE_PREFIX + json.dumps(payload) + SSE_SUFFIX
+
+
+def sse_payload(frame):
+    """The payload of a frame built by sse_event() / text_event() (ValueError without a data line)"""
+    for line in frame.split('\n'):
+        if line.startswith(SSE_PREFIX):
+            return json.loads(line[len(SSE_PREFIX):])
+    raise ValueError(f"Not an SSE data frame: {frame[:40]!r}")
+
+
+def text_event(content):
+    """Frame a text chunk (hot path: one C-level string escape, no dict/encoder setup)"""
+    return TEXT_EVENT_PREFIX + encode_basestring_ascii(content) + TEXT_EVENT_SUFFIX
+
+
+class TextCoalescer:
+    """Merges consecutive text chunks into fewer SSE events
+
+    The first chunk of a turn is always sent immediately so time-to-first-token
+    is unaffected. Pending text is released by the next chunk once the window
+    has passed, or by a TICK from TimedChunks when upstream stalls; callers
+    flush() before function_call/done/error events.
+    """
+
+    def __init__(self, window_ms=SSE_COALESCE_MS, max_bytes=SSE_COALESCE_BYTES, clock=time.monotonic):
+        self.window = window_ms / 1000.0
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.enabled = window_ms > 0 or max_bytes > 0
+        self._parts = []
+        self._size = 0
+        self._started_at = 0.0
+        self._sent_first = False
+
+    def add(self, content):
+        """Buffer a text chunk, returns a frame when the window or size limit is reached"""
+        if not self.enabled or not self._sent_first:
+            self._sent_first = True
+            return text_event(content)
+
+        if not self._parts:
+            self._started_at = self.clock()
+        self._parts.append(content)
+        self._size += len(content.encode('utf-8'))
+
+        if ((self.max_bytes and self._size >= self.max_bytes) or
+                (self.window and self.clock() - self._started_at >= self.window)):
+            return self.flush()
+        return None
+
+    def due(self):
+        """True when buffered text has been held for the whole window"""
+        return bool(self._parts) and bool(self.window) and self.clock() - self._started_at >= self.window
+
+    def flush(self):
+        """Return a frame for all buffered text (or None)"""
+        if not self._parts:
+            return None
+        content = ''.join(self._parts)
+        self._parts = []
+        self._size = 0
+        return text_event(content)
+
+
+class ReplyBudget:
+    """Counts sentences and characters of a streamed reply and trims what exceeds them
+
+    A sentence ends at a run of 。！？!?… (or '.' followed by whitespace, unless
+    it follows a digit as in "1. " or "3.5"); it counts once the next sentence
+    starts, so trailing quotes stay attached.
+    """
+
+    def __init__(self, max_sentences=REPLY_MAX_SENTENCES, max_chars=REPLY_MAX_CHARS):
+        self.max_sentences = max_sentences
+        self.max_chars = max_chars
+        self.sentences = 0
+        self.chars = 0
+        self.exhausted = False
+        self._ended = False  # Last character closed a sentence
+        self._dot = False    # Last character was '.', a sentence end if whitespace follows
+        self._digit = False  # Last character was a digit: a '.' after it is a list number / decimal
+
+    @classmethod
+    def for_set(cls, video_set):
+        """Budget of a videosets.json set (None when budgets are off or unlimited)"""
+        reply = (video_set or {}).get('reply') or {}
+        budget = cls(int(reply.get('maxSentences', REPLY_MAX_SENTENCES)),
+                     int(reply.get('maxChars', REPLY_MAX_CHARS)))
+        if not REPLY_BUDGET or not (budget.max_sentences or budget.max_chars):
+            return None
+        return budget
+
+    def max_tokens(self, tools=False):
+        """Upper bound for the call's max_tokens (None without a character limit)"""
+        if not self.max_chars:
+            return None
+        return int(self.max_chars * REPLY_TOKENS_PER_CHAR) + (REPLY_TOOL_TOKENS if tools else 0)
+
+    def take(self, content):
+        """The part of content within the budget ('' once it is exhausted)"""
+        if self.exhausted:
+            return ''
+        last_break = -1  # Best place in this chunk to end a reply cut by length
+        for i, char in enumerate(content):
+            if char in SENTENCE_ENDS or (self._dot and char.isspace()):
+                if not self._ended:
+                    self.sentences += 1
+                    self._ended = True
+                self._dot = False
+                last_break = i + 1
+            elif char == '.' and not self._digit:
+                self._dot = True
+            elif self._ended and (char in SENTENCE_CLOSERS or char.isspace()):
+                last_break = i + 1
+            else:
+                self._dot = False
+                if self._ended and self.max_sentences and self.sentences >= self.max_sentences:
+                    return self._cut(content, i)
+                self._ended = False
+                if char in PAUSES:
+                    last_break = i + 1
+            self._digit = char.isdigit()
+
+            self.chars += 1
+            if self.max_chars and self.chars > self.max_chars:
+                return self._cut(content, last_break if last_break > 0 else i)
+        return content
+
+    def _cut(self, content, end):
+        self.exhausted = True
+        return content[:end]
+
+
+# Yielded by TimedChunks when no chunk arrived for its interval
+TICK = object()
+_END = object()
+
+
+class TimedChunks:
+    """Iterates upstream responses on a helper thread, yielding TICK while they stall
+
+    Lets a coalescing caller send buffered text on time even when the next
+    chunk is late. A generator cannot be closed from another thread while it
+    runs, so close() only asks the helper to stop; the helper closes the
+    responses after its current read.
+    """
+
+    def __init__(self, responses, interval):
+        self.responses = responses
+        self.interval = interval
+        self._queue = queue.Queue()
+        self._closed = threading.Event()
+        threading.Thread(target=self._pump, daemon=True, name='upstream-reader').start()
+
+    def _pump(self):
+        try:
+            for response in self.responses:
+                if self._closed.is_set():
+                    break
+                self._queue.put((response, None))
+            self._queue.put((_END, None))
+        except Exception as e:
+            self._queue.put((_END, e))
+        finally:
+            if hasattr(self.responses, 'close'):
+                self.responses.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            response, error = self._queue.get(timeout=self.interval)
+        except queue.Empty:
+            return TICK
+        if error is not None:
+            raise error
+        if response is _END:
+            raise StopIteration
+        return response
+
+    def close(self):
+        self._closed.set()
+
+
+class ChatStreamProcessor:
+    """Accumulates text and tool-call fragments from incremental Generation chunks
+
+    With a ReplyBudget, text past the budget is dropped; the caller closes
+    the upstream stream once budget_exhausted and no tool call is pending.
+    """
+
+    def __init__(self, coalescer=None, budget=None):
+        self.full_response = ''
+        # Track accumulated function call (streaming comes in chunks)
+        # Use index as key since call_id can be empty in subsequent chunks
+        self.accumulated_tool_calls = {}
+        self.coalescer = coalescer if coalescer is not None else TextCoalescer()
+        self.budget = budget
+
+    @property
+    def budget_exhausted(self):
+        return self.budget is not None and self.budget.exhausted
+
+    def tool_call_pending(self):
+        """True while a tool call has started but its arguments are not complete JSON"""
+        for call_data in self.accumulated_tool_calls.values():
+            try:
+                json.loads(call_data['arguments'])
+            except ValueError:
+                return True
+        return False
+
+    def process(self, message):
+        """Consume one chunk's message, returns an SSE frame to send (or None)"""
+        # DashScope messages are dicts; .get() avoids raising AttributeError per chunk
+        if isinstance(message, dict):
+            tool_calls = message.get('tool_calls')
+            content = message.get('content')
+        else:
+            tool_calls = getattr(message, 'tool_calls', None)
+            content = getattr(message, 'content', None)
+
+        # Check for function calls (tool_calls are dicts, not objects)
+        if tool_calls:
+            accumulated = self.accumulated_tool_calls
+            for tool_call in tool_calls:
+                # tool_call is a dict, not an object
+                if isinstance(tool_call, dict):
+                    # Use index as key (more reliable than id which can be empty)
+                    call_index = tool_call.get('index', 0)
+                    func_data = tool_call.get('function') or {}
+
+                    # Initialize accumulator for this index
+                    call_data = accumulated.get(call_index)
+                    if call_data is None:
+                        call_data = accumulated[call_index] = {'name': '', 'arguments': ''}
+
+                    # Accumulate function name and arguments
+                    name = func_data.get('name')
+                    if name:
+                        call_data['name'] = name
+
+                    arguments = func_data.get('arguments')
+                    if arguments:
+                        call_data['arguments'] += arguments
+
+        if content and self.budget is not None:
+            content = self.budget.take(content)
+
+        # Check for text content
+        if content:
+            self.full_response += content
+
+            # Send chunk to frontend
+            return self.coalescer.add(content)
+
+        # Release text whose window expired while tool-call chunks were arriving
+        if self.coalescer.due():
+            return self.coalescer.flush()
+        return None
+
+    def flush(self):
+        """Frame for text still buffered by the coalescer (call before other events)"""
+        return self.coalescer.flush()
+
+    def tick(self):
+        """Frame for buffered text whose window expired while no chunk arrived (or None)"""
+        if self.coalescer.due():
+            return self.coalescer.flush()
+        return None
+
+    def timed(self, responses):
+        """responses, wrapped in TimedChunks when the coalescer holds text for a time window"""
+        if not self.coalescer.enabled or not self.coalescer.window:
+            return responses
+        return TimedChunks(responses, self.coalescer.window / 2)
+
+    def function_calls(self):
+        """Parse the accumulated arguments into complete function calls"""
+        function_calls = []
+        for call_index, call_data in self.accumulated_tool_calls.items():
+            try:
+                # Parse the complete JSON arguments
+                args_string = call_data['arguments'].strip()
+                arguments = json.loads(args_string)
+                function_calls.append({
+                    'name': call_data['name'],
+                    'arguments': arguments
+                })
+            except json.JSONDecodeError as e:
+                print(f"Error parsing function arguments: {e}", flush=True)
+                print(f"Arguments string: '{call_data['arguments']}'", flush=True)
+        return function_calls
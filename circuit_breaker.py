@@ -0,0 +1,169 @@
+"""
+Circuit breakers for the DashScope upstreams (LLM, TTS)
+
+When DashScope degrades, every chat turn and TTS request would wait on it
+until it fails, piling up worker threads and starving healthy traffic. A
+breaker watches a rolling window of calls to its upstream:
+
+- closed:    calls go through; once the window holds BREAKER_MIN_CALLS, it
+             opens when BREAKER_ERROR_RATE of them failed or the p90 latency
+             (time to first chunk / audio frame) reaches the upstream's limit
+- open:      allow() is False for BREAKER_OPEN_SECONDS, callers answer from
+             local resources instead (see degraded.py)
+- half-open: one live request at a time is let through as a probe; after
+             BREAKER_CLOSE_PROBES fast successes the breaker closes, a failed
+             or slow probe opens it again
+
+BREAKER=false turns the breakers off (allow() is always True).
+"""
+import os
+import threading
+import time
+from collections import deque
+
+BREAKER = os.getenv('BREAKER', 'true').lower() == 'true'
+BREAKER_WINDOW_SECONDS = float(os.getenv('BREAKER_WINDOW_SECONDS', '30'))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '10'))
+BREAKER_ERROR_RATE = float(os.getenv('BREAKER_ERROR_RATE', '0.5'))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', '20'))
+BREAKER_CLOSE_PROBES = int(os.getenv('BREAKER_CLOSE_PROBES', '2'))
+# p90 first-chunk / first-frame latency that opens the breaker
+LLM_BREAKER_LATENCY = float(os.getenv('LLM_BREAKER_LATENCY_MS', '5000')) / 1000
+TTS_BREAKER_LATENCY = float(os.getenv('TTS_BREAKER_LATENCY_MS', '3000')) / 1000
+
+LATENCY_PERCENTILE = 0.9
+
+
+class CircuitOpen(Exception):
+    """The upstream's breaker is open: answer locally instead of calling it"""
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker over a rolling window (thread-safe)"""
+
+    def __init__(self, name, latency_limit, enabled=BREAKER, window=BREAKER_WINDOW_SECONDS,
+                 min_calls=BREAKER_MIN_CALLS, error_rate=BREAKER_ERROR_RATE,
+                 open_seconds=BREAKER_OPEN_SECONDS, close_probes=BREAKER_CLOSE_PROBES):
+        self.name = name
+        self.latency_limit = latency_limit
+        self.enabled = enabled
+        self.window = window
+        self.min_calls = max(1, min_calls)
+        self.error_rate = error_rate
+        self.open_seconds = open_seconds
+        self.close_probes = max(1, close_probes)
+
+        self._lock = threading.Lock()
+        self.state = 'closed'
+        self.calls = deque()  # (time, ok, latency) of closed-state calls
+        self.opened_at = None
+        self.reason = None
+        self.probe_started = None
+        self.probe_successes = 0
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self):
+        """True if a call may go upstream (in half-open state: as the probe)"""
+        if not self.enabled:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                if now - self.opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self.state = 'half_open'
+                self.probe_started = None
+                self.probe_successes = 0
+            # A probe that never reported back (cancelled turn) frees its slot after open_seconds
+            if self.probe_started is not None and now - self.probe_started < self.open_seconds:
+                self.rejected += 1
+                return False
+            self.probe_started = now
+            return True
+
+    def release(self):
+        """The allowed call ended without an outcome (cancelled)"""
+        with self._lock:
+            self.probe_started = None
+
+    def record_success(self, latency):
+        """latency: seconds to the first chunk / audio frame"""
+        if not self.enabled:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'half_open':
+                self.probe_started = None
+                if latency >= self.latency_limit:
+                    self._trip(now, f"slow probe ({latency * 1000:.0f} ms)")
+                    return
+                self.probe_successes += 1
+                if self.probe_successes >= self.close_probes:
+                    self.state = 'closed'
+                    self.calls.clear()
+                    print(f"Circuit {self.name} closed: upstream recovered", flush=True)
+            elif self.state == 'closed':
+                self.calls.append((now, True, latency))
+                self._check(now)
+
+    def record_failure(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'half_open':
+                self.probe_started = None
+                self._trip(now, 'probe failed')
+            elif self.state == 'closed':
+                self.calls.append((now, False, None))
+                self._check(now)
+
+    def _prune(self, now):
+        while self.calls and now - self.calls[0][0] > self.window:
+            self.calls.popleft()
+
+    def _check(self, now):
+        self._prune(now)
+        if len(self.calls) < self.min_calls:
+            return
+        failures = sum(1 for _, ok, _ in self.calls if not ok)
+        if failures / len(self.calls) >= self.error_rate:
+            self._trip(now, f"{failures}/{len(self.calls)} calls failed")
+            return
+        p90 = self._latency_p90()
+        if p90 is not None and p90 >= self.latency_limit:
+            self._trip(now, f"p90 latency {p90 * 1000:.0f} ms")
+
+    def _latency_p90(self):
+        latencies = sorted(latency for _, ok, latency in self.calls if ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * LATENCY_PERCENTILE))]
+
+    def _trip(self, now, reason):
+        self.state = 'open'
+        self.opened_at = now
+        self.reason = reason
+        self.trips += 1
+        self.calls.clear()
+        print(f"Circuit {self.name} open for {self.open_seconds:.0f}s: {reason}", flush=True)
+
+    def snapshot(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            p90 = self._latency_p90()
+            return {
+                'enabled': self.enabled,
+                'state': self.state,
+                'reason': self.reason if self.state != 'closed' else None,
+                'window_calls': len(self.calls),
+                'window_failures': sum(1 for _, ok, _ in self.calls if not ok),
+                'window_p90_ms': round(p90 * 1000, 1) if p90 is not None else None,
+                'latency_limit_ms': round(self.latency_limit * 1000, 1),
+                'trips': self.trips,
+                'rejected': self.rejected,
+            }
@@ -0,0 +1,167 @@
+"""
+Token-budgeted prompt construction for chat turns
+
+Instead of a fixed history[-N:] slice, history is added from newest to oldest
+until the prompt token budget is spent. Turns that no longer fit can be folded
+into a per-session rolling summary which is cached and extended incrementally.
+"""
+import json
+import os
+import re
+import threading
+
+# Total prompt budget: system prompt + tools + summary + history + user message
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '1200'))
+# Fold turns that fall out of the window into a rolling summary
+HISTORY_SUMMARY_ENABLED = os.getenv('HISTORY_SUMMARY_ENABLED', 'false').lower() == 'true'
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv('HISTORY_SUMMARY_MAX_TOKENS', '200'))
+
+# Per-message framing overhead (role markers, separators) in the chat template
+MESSAGE_OVERHEAD_TOKENS = 4
+
+CJK_CHARS = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+_tokenizer = None
+_tokenizer_loaded = False
+
+
+def _get_tokenizer():
+    """Use DashScope's local Qwen tokenizer when available (needs tiktoken)"""
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        _tokenizer_loaded = True
+        try:
+            from dashscope import get_tokenizer
+            _tokenizer = get_tokenizer('qwen-turbo')
+        except Exception:
+            _tokenizer = None
+    return _tokenizer
+
+
+def count_tokens(text):
+    """Count tokens in text (exact with the Qwen tokenizer, estimated otherwise)"""
+    if not text:
+        return 0
+
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text))
+
+    # Estimate: Qwen encodes most CJK characters as ~1 token, other text ~4 chars/token
+    cjk_count = len(CJK_CHARS.findall(text))
+    return cjk_count + (len(text) - cjk_count + 3) // 4
+
+
+def _call_action(call):
+    """The action a stored tool call played (its name if the arguments did not parse)"""
+    arguments = call.get('arguments')
+    if isinstance(arguments, dict) and arguments.get('action'):
+        return arguments['action']
+    return call.get('name', '')
+
+
+def prompt_message(message):
+    """Reduce a history entry to what the model needs (drops stored tool_calls)"""
+    content = message.get('content', '')
+    if message.get('role') == 'assistant' and not content and message.get('tool_calls'):
+        actions = [_call_action(call) for call in message['tool_calls']]
+        content = f"（动作：{'、'.join(a for a in actions if a)}）"
+    return {'role': message['role'], 'content': content}
+
+
+def message_tokens(message):
+    return count_tokens(message.get('content', '')) + MESSAGE_OVERHEAD_TOKENS
+
+
+def extractive_summary(previous_summary, messages, max_tokens):
+    """Append dropped turns to the summary, trimming the oldest lines to fit"""
+    lines = previous_summary.split('\n') if previous_summary else []
+    for message in messages:
+        speaker = '用户' if message['role'] == 'user' else '你'
+        if message['content']:
+            lines.append(f"{speaker}：{message['content']}")
+
+    while lines and count_tokens('\n'.join(lines)) > max_tokens:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+
+class ContextBuilder:
+    """Builds the message list for a chat turn within a fixed token budget"""
+
+    def __init__(self, budget=HISTORY_TOKEN_BUDGET, summarize=HISTORY_SUMMARY_ENABLED,
+                 summary_max_tokens=HISTORY_SUMMARY_MAX_TOKENS, summarizer=extractive_summary):
+        self.budget = budget
+        self.summarize = summarize
+        self.summary_max_tokens = summary_max_tokens
+        self.summarizer = summarizer
+        # session_id -> (number of history messages folded, summary text)
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def forget(self, session_id):
+        """Drop the cached summary for a session (history was cleared)"""
+        with self._lock:
+            self._summaries.pop(session_id, None)
+
+    def _rolling_summary(self, session_id, history, window_start):
+        """Fold history[:window_start] into the cached summary (incrementally)"""
+        with self._lock:
+            folded, summary = self._summaries.get(session_id, (0, ''))
+            if folded > len(history):
+                # History was replaced or cleared - start over
+                folded, summary = 0, ''
+            if window_start > folded:
+                new_messages = [prompt_message(m) for m in history[folded:window_start]]
+                summary = self.summarizer(summary, new_messages, self.summary_max_tokens)
+                folded = window_start
+                self._summaries[session_id] = (folded, summary)
+            return folded, summary
+
+    def build(self, system_content, history, user_message, session_id='default', tools=None):
+        """Return (messages, stats) for system prompt + budgeted history + user message"""
+        tools_tokens = count_tokens(json.dumps(tools, ensure_ascii=False)) if tools else 0
+        system_tokens = count_tokens(system_content) + MESSAGE_OVERHEAD_TOKENS + tools_tokens
+        user_tokens = count_tokens(user_message) + MESSAGE_OVERHEAD_TOKENS
+
+        remaining = self.budget - system_tokens - user_tokens
+        if self.summarize:
+            remaining -= self.summary_max_tokens
+
+        # Fill from newest to oldest, keeping user/assistant pairs together
+        window = []
+        window_start = len(history)
+        index = len(history)
+        while index > 0:
+            pair_start = index - 2 if index >= 2 and history[index - 2].get('role') == 'user' else index - 1
+            pair = [prompt_message(m) for m in history[pair_start:index]]
+            cost = sum(message_tokens(m) for m in pair)
+            if cost > remaining:
+                break
+            remaining -= cost
+            window[:0] = pair
+            window_start = pair_start
+            index = pair_start
+
+        summary = ''
+        if self.summarize and window_start > 0:
+            folded, summary = self._rolling_summary(session_id, history, window_start)
+            # The cached summary may already cover turns that fit in the window again
+            if folded > window_start:
+                window = window[folded - window_start:]
+                window_start = folded
+
+        if summary:
+            system_content = f"{system_content}\n\n之前的对话摘要：\n{summary}"
+
+        messages = [{'role': 'system', 'content': system_content}]
+        messages.extend(window)
+        messages.append({'role': 'user', 'content': user_message})
+
+        stats = {
+            'prompt_tokens': sum(message_tokens(m) for m in messages) + tools_tokens,
+            'history_messages': len(window),
+            'dropped_messages': window_start,
+            'summary_tokens': count_tokens(summary),
+        }
+        return messages, stats
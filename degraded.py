@@ -0,0 +1,104 @@
+"""
+Degraded-mode answers from local resources
+
+While a DashScope circuit breaker is open (see circuit_breaker.py), chat turns
+and TTS requests are answered immediately without calling upstream:
+
+- chat: the message is matched against the set's keywords in
+  config/videosets.json (conversation actions, then voice commands, then the
+  actions the client sent). A match plays that clip with a short canned
+  acknowledgement; anything else gets a canned "busy" reply.
+- TTS: the set's pre-recorded acknowledgement clips (`audioAck` in
+  videosets.json, under audio/tiktok/*), or the generic ones in audio/common.
+"""
+from pathlib import Path
+
+from asr import match_command
+
+FUNCTION_NAME = 'play_action_video'
+
+# Canned replies; spoken with the pre-recorded clips below
+ACK_TEXT = '好的～'
+BUSY_TEXT = '我现在有点忙，等一下再和你聊好吗？'
+
+AUDIO_DIR = 'audio'
+
+# Clips used when a set has no (existing) audioAck clip (paths relative to audio/)
+DEFAULT_ACK_CLIP = 'common/acknowledged_zh.mp3'
+DEFAULT_BUSY_CLIP = 'common/error_zh.mp3'
+
+
+def _video_set(config, set_id):
+    return (config or {}).get('sets', {}).get(set_id) or {}
+
+
+def set_commands(config, set_id, actions=None):
+    """[{'action', 'video_id', 'has_audio', 'keywords'}] a degraded turn can trigger"""
+    video_set = _video_set(config, set_id)
+    commands = []
+    for action in (video_set.get('conversation') or {}).get('actions', []):
+        commands.append({'action': action.get('action'), 'video_id': action.get('video'),
+                         'has_audio': bool(action.get('has_audio')), 'keywords': action.get('keywords', [])})
+    for name, command in (video_set.get('commands') or {}).items():
+        commands.append({'action': name, 'video_id': command.get('video'), 'has_audio': False,
+                         'keywords': command.get('keywords', [])})
+    for action in actions or []:
+        commands.append({'action': action.get('action'), 'video_id': action.get('video'),
+                         'has_audio': bool(action.get('has_audio')), 'keywords': action.get('keywords', [])})
+    return [command for command in commands if command['video_id']]
+
+
+def match(message, config, set_id, actions=None):
+    """(keyword, command) for the first keyword in message, or None"""
+    commands = set_commands(config, set_id, actions)
+    keywords = {}
+    for index, command in enumerate(commands):
+        for keyword in command['keywords']:
+            # Earlier sources win when a keyword is listed twice
+            if keyword and keyword not in keywords:
+                keywords[keyword] = index
+    found = match_command(message, keywords)
+    if found is None:
+        return None
+    keyword, index = found
+    return keyword, commands[index]
+
+
+def chat_reply(message, config, set_id, actions=None):
+    """(text, function_call or None) answering message without the LLM"""
+    found = match(message, config, set_id, actions)
+    if found is None:
+        return BUSY_TEXT, None
+    _, command = found
+    arguments = {'action': command['action'], 'video_id': command['video_id'], 'has_audio': command['has_audio']}
+    # Clips with their own audio are answered by the video, as the prompt asks of the LLM
+    text = '' if command['has_audio'] else ACK_TEXT
+    return text, {'name': FUNCTION_NAME, 'arguments': arguments}
+
+
+def _audio_relpath(url, audio_dir=AUDIO_DIR):
+    """Path relative to audio/ of an /audio/... URL whose file exists, else None"""
+    url = url or ''
+    if not url.startswith('/audio/'):
+        return None
+    path = url[len('/audio/'):]
+    # videosets.json may list clips that were never generated
+    return path if (Path(audio_dir) / path).is_file() else None
+
+
+def speech_clip(text, config, set_id, audio_dir=AUDIO_DIR):
+    """Path (relative to audio/) of the pre-recorded clip standing in for text
+
+    Only clips present under audio_dir are returned; the defaults are used
+    when none of the set's clips exist.
+    """
+    ack = _video_set(config, set_id).get('audioAck') or {}
+    if text == BUSY_TEXT:
+        return _audio_relpath(ack.get('error'), audio_dir) or DEFAULT_BUSY_CLIP
+
+    specific = {keyword: _audio_relpath(url, audio_dir) for keyword, url in (ack.get('specific') or {}).items()}
+    found = match_command(text, {keyword: path for keyword, path in specific.items() if path})
+    if found is not None:
+        return found[1]
+    generic = [_audio_relpath(url, audio_dir) for url in ack.get('generic') or []]
+    return next((path for path in generic if path), DEFAULT_ACK_CLIP)
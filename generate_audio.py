@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Acknowledgement Audio Generator for Smootie
+===========================================
+
+Regenerates the voice acknowledgement clips referenced by the `audioAck`
+section of every video set in config/videosets.json.
+
+- `specific` entries are synthesized from their keyword ("停" -> stop_zh.mp3)
+- `generic` and `error` entries use COMMON_PHRASES (by file name), unless the
+  set overrides the text with `audioAck.phrases` ({"/audio/...mp3": "text"})
+
+Each clip is hashed from (text, voice, params). Hashes are recorded in a
+manifest next to the audio directory (.audio_manifest.json for audio/, so it
+is not served under /audio/) and a clip is only synthesized again when it is
+missing or its hash changed, so adding a set only synthesizes the new clips.
+Clips that exist but are not in the manifest (e.g. made by generate_audio.sh
+with macOS `say`) are regenerated, since nothing says which voice made them.
+
+--variants pre-encodes the compact copies /audio/ serves on request
+(e.g. Opus for browsers that send Accept: audio/ogg) into audio/.variants/,
+so the first client asking for them does not wait for ffmpeg.
+
+Engines:
+- dashscope: the same DashScope path used by /api/tts/synthesize (needs DASHSCOPE_API_KEY)
+- local:     deterministic offline stand-in that writes a short tone (tests, CI),
+             encoded as mp3 with ffmpeg like the clips it stands in for; it
+             refuses to write into the served audio/ directory, so pass
+             --audio-dir
+
+Usage:
+    python generate_audio.py
+    python generate_audio.py --set tiktok/set3 --workers 8
+    python generate_audio.py --engine local --audio-dir /tmp/audio
+    python generate_audio.py --dry-run
+    python generate_audio.py --force
+    python generate_audio.py --variants opus,pcm
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import math
+import os
+import sys
+import wave
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import audio_formats
+import tts
+
+# Manifest of an audio directory: .<dir name>_manifest.json beside it
+MANIFEST_SUFFIX = '_manifest.json'
+# Where older versions kept it (inside the served directory)
+LEGACY_MANIFEST_NAME = '.audio_manifest.json'
+
+# Texts for clips that are not tied to a command keyword (see audio/README.md)
+COMMON_PHRASES = {
+    'acknowledged_zh': '好的',
+    'received_zh': '收到',
+    'understood_zh': '明白',
+    'ok_zh': '嗯',
+    'error_zh': '没听清',
+    'acknowledged_en': 'OK',
+    'received_en': 'Got it',
+}
+
+
+class DashScopeEngine:
+    """Synthesize clips through DashScope (same voice as the chat TTS endpoint)"""
+
+    name = 'dashscope'
+
+    def __init__(self, voice=tts.DEFAULT_VOICE, audio_format='mp3', sample_rate=tts.DEFAULT_SAMPLE_RATE):
+        import dashscope
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        dashscope.api_key = os.getenv('DASHSCOPE_API_KEY')
+
+        self.voice = voice
+        self.params = {'format': audio_format, 'sample_rate': sample_rate}
+
+    def synthesize(self, text):
+        return tts.synthesize_speech(text, voice=self.voice,
+                                     audio_format=self.params['format'],
+                                     sample_rate=self.params['sample_rate'])
+
+
+class LocalEngine:
+    """Offline stand-in: a deterministic sine tone whose length follows the text
+
+    The tone is encoded in audio_format (mp3 by default, as the config's clip
+    names say) with ffmpeg; only 'wav' works without it.
+    """
+
+    name = 'local'
+
+    def __init__(self, voice='local-tone', audio_format='mp3', sample_rate=16000):
+        self.voice = voice
+        self.params = {'format': audio_format, 'sample_rate': sample_rate}
+
+    def synthesize(self, text):
+        wav = self.tone(text)
+        if self.params['format'] == 'wav':
+            return wav
+        if not audio_formats.ffmpeg_available():
+            raise RuntimeError(f"the local engine needs ffmpeg to write {self.params['format']} clips")
+        return audio_formats.transcode(wav, 'wav', self.params['format'], self.params['sample_rate'])
+
+    def tone(self, text):
+        sample_rate = self.params['sample_rate']
+        frequency = 220 + (sum(ord(c) for c in text) % 440)
+        frame_count = int(sample_rate * min(0.2 + 0.15 * len(text), 2.0))
+
+        frames = bytearray()
+        for i in range(frame_count):
+            sample = int(8000 * math.sin(2 * math.pi * frequency * i / sample_rate))
+            frames += sample.to_bytes(2, 'little', signed=True)
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(bytes(frames))
+        return buffer.getvalue()
+
+
+ENGINES = {
+    'dashscope': DashScopeEngine,
+    'local': LocalEngine,
+}
+
+# Served under /audio/; only real voice clips belong here
+DEFAULT_AUDIO_DIR = 'audio'
+
+
+def is_served_audio_dir(audio_dir):
+    """True if audio_dir is the app's audio/ directory (relative to here or to the script)"""
+    resolved = Path(audio_dir).resolve()
+    return resolved in (Path(DEFAULT_AUDIO_DIR).resolve(), (Path(__file__).parent / DEFAULT_AUDIO_DIR).resolve())
+
+
+def clip_hash(text, voice, params):
+    """Content hash of everything that affects the synthesized audio"""
+    key = json.dumps({'text': text, 'voice': voice, 'params': params},
+                     sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def url_to_relpath(url):
+    """Map a config URL ('/audio/common/ok_zh.mp3') to a path under audio/"""
+    relpath = url.lstrip('/')
+    if relpath.startswith('audio/'):
+        relpath = relpath[len('audio/'):]
+    return relpath
+
+
+def collect_clips(config, set_filter=None):
+    """Collect {relpath: text} for every audioAck clip in the config"""
+    clips = {}
+
+    for set_id, video_set in config.get('sets', {}).items():
+        if set_filter and set_id not in set_filter:
+            continue
+
+        audio_ack = video_set.get('audioAck') or {}
+        phrases = audio_ack.get('phrases', {})
+
+        urls = list(audio_ack.get('generic', []))
+        if audio_ack.get('error'):
+            urls.append(audio_ack['error'])
+
+        for url in urls:
+            text = phrases.get(url) or COMMON_PHRASES.get(Path(url).stem)
+            if not text:
+                print(f"Warning: [{set_id}] no text known for {url}, add it to audioAck.phrases")
+                continue
+            clips.setdefault(url_to_relpath(url), text)
+
+        for keyword, url in audio_ack.get('specific', {}).items():
+            clips.setdefault(url_to_relpath(url), phrases.get(url) or keyword)
+
+    return clips
+
+
+def manifest_path(audio_dir):
+    """audio/ -> .audio_manifest.json in the directory that contains audio/"""
+    audio_dir = Path(audio_dir).resolve()
+    return audio_dir.parent / f".{audio_dir.name}{MANIFEST_SUFFIX}"
+
+
+def load_manifest(audio_dir):
+    for path in (manifest_path(audio_dir), Path(audio_dir) / LEGACY_MANIFEST_NAME):
+        if path.exists():
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+    return {}
+
+
+def save_manifest(audio_dir, manifest):
+    path = manifest_path(audio_dir)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+    legacy = Path(audio_dir) / LEGACY_MANIFEST_NAME
+    if legacy.exists():
+        legacy.unlink()
+
+
+def plan_clips(clips, audio_dir, engine, manifest, force=False):
+    """Split clips into (to_generate, up_to_date) lists of (relpath, text, hash)
+
+    A clip is up to date only if it exists and the manifest records this
+    engine's hash for it; clips of unknown origin are regenerated.
+    """
+    to_generate, up_to_date = [], []
+
+    for relpath, text in sorted(clips.items()):
+        digest = clip_hash(text, engine.voice, engine.params)
+        entry = (relpath, text, digest)
+        exists = (Path(audio_dir) / relpath).exists()
+        recorded = manifest.get(relpath, {}).get('hash')
+
+        if force or not exists or recorded != digest:
+            to_generate.append(entry)
+        else:
+            up_to_date.append(entry)
+
+    return to_generate, up_to_date
+
+
+def write_clip(audio_dir, relpath, audio):
+    """Write atomically so an interrupted run never leaves a truncated clip"""
+    output_file = Path(audio_dir) / relpath
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = output_file.with_name(output_file.name + '.tmp')
+    tmp_file.write_bytes(audio)
+    os.replace(tmp_file, output_file)
+
+
+def generate_clips(clips, audio_dir, engine, workers=4, force=False, dry_run=False):
+    """Synthesize missing/stale clips with a worker pool and update the manifest"""
+    manifest = load_manifest(audio_dir)
+    to_generate, up_to_date = plan_clips(clips, audio_dir, engine, manifest, force)
+
+    print(f"\n=== Acknowledgement Audio ({engine.name}, voice={engine.voice}) ===")
+    print(f"Clips: {len(clips)} | up to date: {len(up_to_date)} | to generate: {len(to_generate)}")
+
+    if dry_run:
+        for relpath, text, _ in to_generate:
+            unrecorded = relpath not in manifest and (Path(audio_dir) / relpath).exists()
+            print(f"  would generate: {relpath} ({text}){' - not in the manifest' if unrecorded else ''}")
+        return {'generated': [], 'failed': [], 'up_to_date': up_to_date}
+
+    generated, failed = [], []
+
+    if to_generate:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {
+                executor.submit(engine.synthesize, text): (relpath, text, digest)
+                for relpath, text, digest in to_generate
+            }
+
+            for future in as_completed(futures):
+                relpath, text, digest = futures[future]
+                try:
+                    audio = future.result()
+                except Exception as e:
+                    audio = None
+                    print(f"  ✗ {relpath} - Error: {e}")
+
+                if not audio:
+                    failed.append(relpath)
+                    print(f"  ✗ {relpath} ({text})")
+                    continue
+
+                write_clip(audio_dir, relpath, audio)
+                manifest[relpath] = {'hash': digest, 'text': text, 'voice': engine.voice}
+                generated.append(relpath)
+                print(f"  ✓ {relpath} ({text}, {len(audio)} bytes)")
+
+    if generated:
+        save_manifest(audio_dir, manifest)
+
+    print(f"\nGenerated {len(generated)}/{len(to_generate)} clips")
+    if failed:
+        print(f"Failed: {', '.join(sorted(failed))}")
+
+    return {'generated': generated, 'failed': failed, 'up_to_date': up_to_date}
+
+
+def build_variants(clips, audio_dir, formats, workers=4):
+    """Encode each existing clip in the given formats (default rates), skipping fresh ones"""
+    cache = audio_formats.VariantCache(audio_dir)
+    jobs = [(relpath, audio_format) for relpath in sorted(clips) for audio_format in formats
+            if (Path(audio_dir) / relpath).exists() and audio_format != cache.source_format(relpath)]
+
+    print(f"\n=== Variants ({', '.join(formats)}) ===")
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {
+            executor.submit(cache.get, relpath, audio_format,
+                            audio_formats.FORMATS[audio_format]['default_rate']): (relpath, audio_format)
+            for relpath, audio_format in jobs
+        }
+        for future in as_completed(futures):
+            relpath, audio_format = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failed.append(f"{relpath} ({audio_format})")
+                print(f"  ✗ {relpath} -> {audio_format} - Error: {e}")
+
+    print(f"Variants ready: {len(jobs) - len(failed)}/{len(jobs)}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate voice acknowledgement clips from config/videosets.json")
+    parser.add_argument("--config", type=str, default="config/videosets.json",
+                       help="Video set configuration (default: config/videosets.json)")
+    parser.add_argument("--audio-dir", type=str, default=DEFAULT_AUDIO_DIR,
+                       help=f"Audio root served under /audio/ (default: {DEFAULT_AUDIO_DIR}; "
+                            f"--engine local needs another directory)")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="dashscope",
+                       help="TTS engine (default: dashscope)")
+    parser.add_argument("--voice", type=str,
+                       help="Voice/model name passed to the engine")
+    parser.add_argument("--set", action="append", dest="sets",
+                       help="Only process this set (repeatable, default: all sets)")
+    parser.add_argument("--workers", type=int, default=4,
+                       help="Concurrent synthesis requests (default: 4)")
+    parser.add_argument("--force", action="store_true",
+                       help="Regenerate every clip even if it is up to date")
+    parser.add_argument("--dry-run", action="store_true",
+                       help="Only show which clips would be generated")
+    parser.add_argument("--variants", type=str,
+                       help=f"Also encode clips as these formats, comma separated "
+                            f"({', '.join(audio_formats.FORMATS)}; needs ffmpeg)")
+
+    args = parser.parse_args()
+
+    if args.engine == 'local' and is_served_audio_dir(args.audio_dir):
+        # Test tones would replace the real clips and their manifest hashes
+        print(f"Error: --engine local does not write into {args.audio_dir}/, "
+              f"pass --audio-dir (e.g. --audio-dir /tmp/audio)")
+        sys.exit(1)
+
+    with open(args.config, encoding='utf-8') as f:
+        config = json.load(f)
+
+    clips = collect_clips(config, set_filter=args.sets)
+    if not clips:
+        print("No audioAck clips found")
+        return
+
+    engine_cls = ENGINES[args.engine]
+    engine = engine_cls(voice=args.voice) if args.voice else engine_cls()
+
+    result = generate_clips(clips, args.audio_dir, engine, workers=args.workers,
+                            force=args.force, dry_run=args.dry_run)
+
+    failed_variants = []
+    if args.variants and not args.dry_run:
+        formats = [name.strip() for name in args.variants.split(',') if name.strip()]
+        unknown = [name for name in formats if name not in audio_formats.FORMATS]
+        if unknown:
+            print(f"Error: unknown variant format(s): {', '.join(unknown)}")
+            sys.exit(1)
+        if not audio_formats.ffmpeg_available():
+            print("Error: --variants needs ffmpeg")
+            sys.exit(1)
+        failed_variants = build_variants(clips, args.audio_dir, formats, workers=args.workers)
+
+    if result['failed'] or failed_variants:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
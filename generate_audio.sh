@@ -2,6 +2,7 @@
 
 # Script to generate audio files for voice acknowledgement
 # Uses macOS 'say' command with correct Chinese voice name
+# On Linux (or for incremental rebuilds) use: python generate_audio.py
 
 echo "Regenerating Chinese audio files with correct voice..."
 
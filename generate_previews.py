@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Poster Frame and Preview Generator for Smootie
+==============================================
+
+The player only feels ready once every full-resolution clip of a set has
+loaded, and a clip that was not preloaded in time starts as a blank frame.
+For every video in config/videosets.json this step writes, next to the clips:
+
+- videos/<set>/posters/<name>.jpg    the first frame (what the clip opens on)
+- videos/<set>/previews/<name>.mp4   a tiny low-bitrate copy (240p, 15 fps)
+
+and records them as `poster` / `preview` on the video's config entry. The
+player paints the poster immediately, plays the preview while the full clip
+is still loading and switches to the full clip once it has arrived.
+
+Each output is hashed from (source size, source mtime, encoding params) and
+recorded in videos/.preview_manifest.json, so only new or changed clips are
+processed again. Clips are processed in parallel.
+
+Requirements:
+- ffmpeg
+
+Usage:
+    python generate_previews.py
+    python generate_previews.py --set tiktok/set3 --workers 8
+    python generate_previews.py --dry-run
+    python generate_previews.py --force
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+MANIFEST_NAME = '.preview_manifest.json'
+POSTER_DIR = 'posters'
+PREVIEW_DIR = 'previews'
+
+POSTER_PARAMS = {'max_height': 720, 'quality': 4}
+PREVIEW_PARAMS = {'max_height': 240, 'fps': 15, 'crf': 34, 'preset': 'veryfast', 'audio_bitrate': '32k'}
+
+
+def poster_args(params):
+    return ['-frames:v', '1', '-vf', f"scale=-2:'min(ih,{params['max_height']})'",
+            '-q:v', str(params['quality'])]
+
+
+def preview_args(params):
+    return [
+        '-vf', f"scale=-2:'min(ih,{params['max_height']})',fps={params['fps']}",
+        '-c:v', 'libx264', '-preset', params['preset'], '-crf', str(params['crf']),
+        '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
+        '-c:a', 'aac', '-b:a', params['audio_bitrate'], '-ac', '1',
+    ]
+
+
+OUTPUTS = {
+    'poster': (POSTER_DIR, '.jpg', POSTER_PARAMS, poster_args),
+    'preview': (PREVIEW_DIR, '.mp4', PREVIEW_PARAMS, preview_args),
+}
+
+
+def output_hash(source, params):
+    """Hash of the source file's identity and the encoding params"""
+    stat = source.stat()
+    key = json.dumps({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'params': params},
+                     sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def collect_videos(config, videos_dir, set_filter=None):
+    """[(set_id, video entry, source path)] for every video file that exists"""
+    videos = []
+    for set_id, video_set in config.get('sets', {}).items():
+        if set_filter and set_id not in set_filter:
+            continue
+        for video in video_set.get('videos', []):
+            url = video.get('path') or f"/videos/{set_id}/{video['id']}"
+            relpath = url.lstrip('/')
+            if relpath.startswith('videos/'):
+                relpath = relpath[len('videos/'):]
+            source = Path(videos_dir) / relpath
+            if not source.exists():
+                print(f"Warning: [{set_id}] {source} does not exist, skipping")
+                continue
+            videos.append((set_id, video, source))
+    return videos
+
+
+def output_path(source, kind):
+    directory, suffix, _, _ = OUTPUTS[kind]
+    return source.parent / directory / (source.stem + suffix)
+
+
+def output_url(output, videos_dir):
+    return '/videos/' + output.relative_to(videos_dir).as_posix()
+
+
+def load_manifest(videos_dir):
+    manifest_path = Path(videos_dir) / MANIFEST_NAME
+    if manifest_path.exists():
+        with open(manifest_path, encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def save_manifest(videos_dir, manifest):
+    manifest_path = Path(videos_dir) / MANIFEST_NAME
+    tmp_path = manifest_path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def render(source, output, kind):
+    """Run ffmpeg into a temp file, then move it into place"""
+    _, suffix, params, build_args = OUTPUTS[kind]
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = output.with_name(output.stem + '.tmp' + suffix)
+    cmd = (['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-i', str(source)]
+           + build_args(params) + [str(tmp_file)])
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        tmp_file.unlink(missing_ok=True)
+        raise RuntimeError(result.stderr.strip()[-300:] or f"ffmpeg exited with {result.returncode}")
+    os.replace(tmp_file, output)
+    return output.stat().st_size
+
+
+def plan_outputs(videos, videos_dir, manifest, force=False):
+    """[(output relpath, source, kind, hash)] of posters/previews that are missing or stale"""
+    jobs = []
+    for _, _, source in videos:
+        for kind, (_, _, params, _) in OUTPUTS.items():
+            output = output_path(source, kind)
+            relpath = output.relative_to(videos_dir).as_posix()
+            digest = output_hash(source, params)
+            if force or not output.exists() or manifest.get(relpath, {}).get('hash') != digest:
+                jobs.append((relpath, source, kind, digest))
+    return jobs
+
+
+def update_config(config_path, config, videos, videos_dir):
+    """Record poster/preview URLs of the outputs that exist, returns True if the file changed"""
+    changed = False
+    for _, video, source in videos:
+        for kind in OUTPUTS:
+            output = output_path(source, kind)
+            if output.exists() and video.get(kind) != output_url(output, videos_dir):
+                video[kind] = output_url(output, videos_dir)
+                changed = True
+    if changed:
+        config_path = Path(config_path)
+        tmp_path = config_path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        os.replace(tmp_path, config_path)
+    return changed
+
+
+def generate_outputs(videos, videos_dir, workers=4, force=False, dry_run=False):
+    """Render missing/stale posters and previews with a worker pool and update the manifest"""
+    videos_dir = Path(videos_dir)
+    manifest = load_manifest(videos_dir)
+    jobs = plan_outputs(videos, videos_dir, manifest, force)
+
+    print("\n=== Posters and Previews ===")
+    print(f"Clips: {len(videos)} | outputs: {len(videos) * len(OUTPUTS)} | to render: {len(jobs)}")
+
+    if dry_run:
+        for relpath, source, kind, _ in jobs:
+            print(f"  would render: {relpath} ({kind} of {source})")
+        return {'rendered': [], 'failed': []}
+
+    rendered, failed = [], []
+    if jobs:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {
+                executor.submit(render, source, videos_dir / relpath, kind): (relpath, source, kind, digest)
+                for relpath, source, kind, digest in jobs
+            }
+            for future in as_completed(futures):
+                relpath, source, kind, digest = futures[future]
+                try:
+                    size = future.result()
+                except Exception as e:
+                    failed.append(relpath)
+                    print(f"  ✗ {relpath} - Error: {e}")
+                    continue
+                manifest[relpath] = {'hash': digest, 'source': source.relative_to(videos_dir).as_posix()}
+                rendered.append(relpath)
+                print(f"  ✓ {relpath} ({size / 1024:.0f} KB)")
+
+    if rendered:
+        save_manifest(videos_dir, manifest)
+
+    print(f"\nRendered {len(rendered)}/{len(jobs)} outputs")
+    if failed:
+        print(f"Failed: {', '.join(sorted(failed))}")
+    return {'rendered': rendered, 'failed': failed}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate poster frames and low-resolution previews for config/videosets.json")
+    parser.add_argument("--config", type=str, default="config/videosets.json",
+                       help="Video set configuration (default: config/videosets.json)")
+    parser.add_argument("--videos-dir", type=str, default="videos",
+                       help="Video root served under /videos/ (default: videos)")
+    parser.add_argument("--set", action="append", dest="sets",
+                       help="Only process this set (repeatable, default: all sets)")
+    parser.add_argument("--workers", type=int, default=4,
+                       help="Concurrent ffmpeg processes (default: 4)")
+    parser.add_argument("--force", action="store_true",
+                       help="Re-render every poster and preview even if it is up to date")
+    parser.add_argument("--dry-run", action="store_true",
+                       help="Only show which outputs would be rendered")
+
+    args = parser.parse_args()
+
+    if shutil.which('ffmpeg') is None:
+        print("Error: ffmpeg is required (see https://ffmpeg.org/download.html)")
+        sys.exit(1)
+
+    with open(args.config, encoding='utf-8') as f:
+        config = json.load(f)
+
+    videos = collect_videos(config, args.videos_dir, set_filter=args.sets)
+    if not videos:
+        print("No videos found")
+        return
+
+    result = generate_outputs(videos, args.videos_dir, workers=args.workers,
+                              force=args.force, dry_run=args.dry_run)
+
+    if not args.dry_run and update_config(args.config, config, videos, Path(args.videos_dir)):
+        print(f"Updated {args.config}")
+
+    if result['failed']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
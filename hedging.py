@@ -0,0 +1,201 @@
+"""
+Hedged upstream requests: cut the tail of time-to-first-chunk
+
+An occasional slow start of Generation.call / SpeechSynthesizer.call becomes
+the user's latency when a turn waits on a single stream. With hedging on, if
+the first chunk has not arrived after the hedge delay, a second identical
+request is started; whichever produces its first chunk first is kept and the
+other is closed (a TTS call cannot be aborted through the SDK, its late audio
+is just dropped).
+
+- delay:  HEDGE_DELAY seconds, or 'p90' (any 'pNN'): that percentile of the
+          first-chunk latencies observed for the same upstream, once
+          HEDGE_MIN_SAMPLES were seen (HEDGE_INITIAL_DELAY before that)
+- budget: extra requests are capped at HEDGE_BUDGET of all requests (token
+          bucket: every request adds HEDGE_BUDGET tokens, up to HEDGE_BURST,
+          a hedge costs one), so a slow upstream is never hit with 2x load
+
+Hedging is off unless HEDGING=true (TTS_HEDGING for speech, default: HEDGING).
+"""
+import os
+import threading
+import time
+from collections import deque
+
+HEDGING = os.getenv('HEDGING', 'false').lower() == 'true'
+TTS_HEDGING = os.getenv('TTS_HEDGING', str(HEDGING)).lower() == 'true'
+HEDGE_DELAY = os.getenv('HEDGE_DELAY', 'p90')
+HEDGE_INITIAL_DELAY = float(os.getenv('HEDGE_INITIAL_DELAY', '1.0'))
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', '0.1'))
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+HEDGE_BUDGET = float(os.getenv('HEDGE_BUDGET', '0.05'))
+HEDGE_BURST = float(os.getenv('HEDGE_BURST', '2'))
+
+LATENCY_SAMPLES = 500
+
+
+class HedgeBudget:
+    """Token bucket capping hedges to a fraction of requests (thread-safe)"""
+
+    def __init__(self, ratio=HEDGE_BUDGET, burst=HEDGE_BURST):
+        self.ratio = ratio
+        self.burst = max(1.0, burst)
+        self._lock = threading.Lock()
+        self.tokens = 1.0
+
+    def record_request(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_acquire(self):
+        with self._lock:
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return True
+            return False
+
+
+class HedgePolicy:
+    """When to hedge one upstream, and what hedging did for it"""
+
+    def __init__(self, enabled=HEDGING, delay=HEDGE_DELAY, budget=None):
+        self.enabled = enabled
+        self.delay_setting = str(delay)
+        self.budget = budget or HedgeBudget()
+        self._lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.denied = 0
+
+    def delay(self):
+        """Seconds to wait for the first chunk before hedging"""
+        setting = self.delay_setting.strip().lower()
+        if not setting.startswith('p'):
+            return max(HEDGE_MIN_DELAY, float(setting))
+        with self._lock:
+            samples = sorted(self.latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_INITIAL_DELAY
+        percentile = float(setting[1:]) / 100
+        return max(HEDGE_MIN_DELAY, samples[min(len(samples) - 1, int(len(samples) * percentile))])
+
+    def record_request(self):
+        self.budget.record_request()
+        with self._lock:
+            self.requests += 1
+
+    def try_hedge(self):
+        allowed = self.budget.try_acquire()
+        with self._lock:
+            if allowed:
+                self.hedged += 1
+            else:
+                self.denied += 1
+        return allowed
+
+    def record_latency(self, seconds):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def record_win(self, attempt):
+        if attempt > 0:
+            with self._lock:
+                self.hedge_wins += 1
+
+    def snapshot(self):
+        with self._lock:
+            requests, hedged, wins, denied = self.requests, self.hedged, self.hedge_wins, self.denied
+        return {
+            'enabled': self.enabled,
+            'delay_ms': round(self.delay() * 1000, 1),
+            'requests': requests,
+            'hedged': hedged,
+            'hedge_wins': wins,
+            'budget_denied': denied,
+            'extra_load': round(hedged / requests, 4) if requests else 0.0,
+        }
+
+
+class RaceTimeout(Exception):
+    """No attempt produced a first chunk before the deadline"""
+
+
+def race(start, close, policy=None, timeout=None, cancelled=None, name='upstream'):
+    """Start an upstream request and hedge it when the policy says so
+
+    start() blocks until a request's first chunk and returns (first, handle);
+    it runs on helper threads so the caller can time it out. The first
+    attempt to return wins; close(handle) is called for every other attempt
+    as soon as it returns. Returns (first, handle), or (None, None) when the
+    `cancelled` event was set. Raises RaceTimeout after `timeout` seconds,
+    and the last error when every attempt failed.
+    """
+    hedging = policy is not None and policy.enabled
+    lock = threading.Lock()
+    state = {'winner': None, 'result': None, 'errors': [], 'running': 0, 'abandoned': False}
+    finished = threading.Event()
+
+    def attempt(index):
+        started = time.monotonic()
+        try:
+            first, handle = start()
+        except Exception as e:
+            with lock:
+                state['errors'].append(e)
+                state['running'] -= 1
+                if state['running'] == 0 and state['winner'] is None:
+                    finished.set()
+            return
+        if policy is not None:
+            policy.record_latency(time.monotonic() - started)
+        with lock:
+            state['running'] -= 1
+            won = state['winner'] is None and not state['abandoned']
+            if won:
+                state['winner'] = index
+                state['result'] = (first, handle)
+                finished.set()
+        if not won:
+            close(handle)
+
+    def launch(index):
+        with lock:
+            state['running'] += 1
+        threading.Thread(target=attempt, args=(index,), daemon=True, name=f"{name}-{index}").start()
+
+    if policy is not None:
+        policy.record_request()
+    began = time.monotonic()
+    launch(0)
+    hedge_at = began + policy.delay() if hedging else None
+    attempts = 1
+
+    while not finished.wait(0.02):
+        now = time.monotonic()
+        expired = timeout is not None and now - began >= timeout
+        if expired or (cancelled is not None and cancelled.is_set()):
+            with lock:
+                state['abandoned'] = True
+                result = state['result']
+            if result is not None:
+                # Won while we were giving up: still release it
+                close(result[1])
+            if expired:
+                raise RaceTimeout(f"no first chunk from {name} in {timeout}s")
+            return None, None
+        if hedge_at is not None and now >= hedge_at:
+            hedge_at = None
+            if policy.try_hedge():
+                print(f"Hedging {name}: no first chunk after {now - began:.2f}s", flush=True)
+                launch(attempts)
+                attempts += 1
+
+    with lock:
+        winner, result, errors = state['winner'], state['result'], state['errors']
+    if winner is None:
+        raise errors[-1]
+    if policy is not None:
+        policy.record_win(winner)
+    return result
@@ -0,0 +1,259 @@
+"""
+Latency-tiered model routing for chat turns
+
+Every turn is classified cheaply - message length, action-keyword presence and
+whether the session's previous turn played an action - and sent to that
+class's model profile: one-word commands get a tight token cap. By default
+every tier uses qwen-turbo within the prompt's 1-2 sentence reply length, so
+out of the box routing only varies sampling, max_tokens and first-chunk
+timeouts (command vs. the rest; 'open' equals 'chat'), and a fallback is a
+retry on the same model. The model split is opt-in through
+MODEL_PROFILES_FILE: a richer model for open-ended messages is slower and
+costlier on every long message, which this app's short spoken replies do not
+need by default. If a tier returns an error or its
+first chunk does not arrive within first_chunk_timeout, the turn falls back to
+the next tier (only before anything was streamed to the client). Per-tier
+time-to-first-token is reported in /api/metrics. With HEDGING=true a slow
+first chunk is hedged within a tier (see hedging.py), before any fallback.
+Turns are refused with CircuitOpen while the LLM circuit breaker is open
+(see circuit_breaker.py).
+
+Profiles can be overridden with a JSON file (MODEL_PROFILES_FILE), merged over
+DEFAULT_PROFILES per tier:
+    {"command": {"max_tokens": 60}, "open": {"model": "qwen-plus", "max_tokens": 300, "first_chunk_timeout": 8.0}}
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from http import HTTPStatus
+
+from circuit_breaker import LLM_BREAKER_LATENCY, CircuitBreaker, CircuitOpen
+from hedging import HEDGING, HedgeBudget, HedgePolicy, RaceTimeout, race
+
+# false: every turn uses the 'chat' profile (the pre-routing behaviour)
+MODEL_ROUTING = os.getenv('MODEL_ROUTING', 'true').lower() == 'true'
+MODEL_PROFILES_FILE = os.getenv('MODEL_PROFILES_FILE', '')
+# Tiers tried per turn, including the first one
+MODEL_MAX_ATTEMPTS = int(os.getenv('MODEL_MAX_ATTEMPTS', '2'))
+
+# Classification thresholds, in characters of the user message
+ROUTE_COMMAND_MAX_CHARS = int(os.getenv('ROUTE_COMMAND_MAX_CHARS', '12'))
+ROUTE_OPEN_MIN_CHARS = int(os.getenv('ROUTE_OPEN_MIN_CHARS', '40'))
+
+# Fastest first; a failing tier falls back to the next one (the last one to the previous)
+TIERS = ('command', 'chat', 'open')
+
+DEFAULT_PROFILES = {
+    'command': {'model': 'qwen-turbo', 'temperature': 0.3, 'max_tokens': 80, 'first_chunk_timeout': 3.0},
+    'chat': {'model': 'qwen-turbo', 'temperature': 0.8, 'max_tokens': 200, 'first_chunk_timeout': 5.0},
+    'open': {'model': 'qwen-turbo', 'temperature': 0.8, 'max_tokens': 200, 'first_chunk_timeout': 5.0},
+}
+
+# Profile keys that are routing settings, not Generation.call parameters
+ROUTING_KEYS = ('first_chunk_timeout',)
+
+TTFT_SAMPLES = 1000
+
+
+def load_profiles(path=MODEL_PROFILES_FILE):
+    profiles = {tier: dict(profile) for tier, profile in DEFAULT_PROFILES.items()}
+    if path:
+        with open(path, encoding='utf-8') as f:
+            overrides = json.load(f)
+        for tier, profile in overrides.items():
+            if tier not in profiles:
+                raise ValueError(f"Unknown model tier in {path}: {tier} (expected one of {', '.join(TIERS)})")
+            profiles[tier].update(profile)
+    return profiles
+
+
+def classify(message, actions=None, history=None):
+    """(tier, reason) for a user message"""
+    if not MODEL_ROUTING:
+        return 'chat', 'routing off'
+
+    text = message.strip().lower()
+    if len(text) <= ROUTE_COMMAND_MAX_CHARS:
+        for action in actions or []:
+            for keyword in action.get('keywords', []):
+                if keyword and keyword.lower() in text:
+                    return 'command', f"keyword {keyword}"
+        # "again" / "再来" right after an action is another command
+        if history and history[-1].get('role') == 'assistant' and history[-1].get('tool_calls'):
+            return 'command', 'follows an action'
+
+    if len(text) >= ROUTE_OPEN_MIN_CHARS:
+        return 'open', f"{len(text)} chars"
+    return 'chat', 'default'
+
+
+def fallback_chain(tier, max_attempts=MODEL_MAX_ATTEMPTS):
+    """tier, then the tiers after it, then the ones before it (nearest first)"""
+    index = TIERS.index(tier)
+    chain = list(TIERS[index:]) + list(reversed(TIERS[:index]))
+    return chain[:max(1, max_attempts)]
+
+
+def close_stream(responses):
+    if responses is not None and hasattr(responses, 'close'):
+        responses.close()
+
+
+class FirstChunkTimeout(Exception):
+    """The upstream did not produce its first chunk in time"""
+
+
+def open_stream(call, params, timeout=None, cancelled=None, hedge=None):
+    """Start a streaming call and wait for its first chunk
+
+    Returns (first_response, responses). The call runs on a helper thread so a
+    stuck connection cannot hold the turn past `timeout` (FirstChunkTimeout);
+    an abandoned stream is closed once it gets going. Returns (None, None) when
+    the `cancelled` event is set while waiting. With a HedgePolicy, a slow
+    first chunk starts a second identical call and the faster one is kept.
+    """
+    def start():
+        responses = call(**params)
+        return next(iter(responses), None), responses
+
+    try:
+        return race(start, close_stream, hedge, timeout, cancelled, name=params.get('model', 'upstream'))
+    except RaceTimeout:
+        raise FirstChunkTimeout(f"no first chunk from {params.get('model')} in {timeout}s") from None
+
+
+def _latency_summary(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return {
+        'p50': round(ordered[len(ordered) // 2] * 1000, 1),
+        'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+        'mean': round(sum(ordered) / len(ordered) * 1000, 1),
+    }
+
+
+class RoutingMetrics:
+    """Per-tier serving counters and TTFT, per-class turn counts (thread-safe)
+
+    Tier TTFT is measured from the call on that tier; class TTFT from the
+    first attempt, so it includes any time lost to fallbacks.
+    """
+
+    def __init__(self, profiles):
+        self._lock = threading.Lock()
+        self.tiers = {tier: {'model': profiles[tier]['model'], 'served': 0, 'timeouts': 0, 'errors': 0,
+                             'ttft': deque(maxlen=TTFT_SAMPLES)} for tier in TIERS}
+        self.classes = {tier: {'turns': 0, 'fallbacks': 0, 'ttft': deque(maxlen=TTFT_SAMPLES)}
+                        for tier in TIERS}
+
+    def record_failure(self, tier, kind):
+        """kind: 'timeouts' or 'errors'"""
+        with self._lock:
+            self.tiers[tier][kind] += 1
+
+    def record_served(self, route, tier, tier_ttft, turn_ttft):
+        with self._lock:
+            self.tiers[tier]['served'] += 1
+            self.tiers[tier]['ttft'].append(tier_ttft)
+            self.classes[route]['turns'] += 1
+            self.classes[route]['ttft'].append(turn_ttft)
+            if tier != route:
+                self.classes[route]['fallbacks'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'enabled': MODEL_ROUTING,
+                'tiers': {tier: {**{k: v for k, v in stats.items() if k != 'ttft'},
+                                 'ttft_ms': _latency_summary(stats['ttft'])}
+                          for tier, stats in self.tiers.items()},
+                'classes': {route: {**{k: v for k, v in stats.items() if k != 'ttft'},
+                                    'ttft_ms': _latency_summary(stats['ttft'])}
+                            for route, stats in self.classes.items()},
+            }
+
+
+class ModelRouter:
+    """Picks the profile for a turn and opens its upstream stream with fallback"""
+
+    def __init__(self, profiles=None, max_attempts=MODEL_MAX_ATTEMPTS):
+        self.profiles = profiles or load_profiles()
+        self.max_attempts = max_attempts
+        self.metrics = RoutingMetrics(self.profiles)
+        # One hedge budget for all tiers, the hedge delay follows each tier's own TTFT
+        budget = HedgeBudget()
+        self.hedges = {tier: HedgePolicy(HEDGING, budget=budget) for tier in TIERS}
+        # One outcome per turn: a turn a fallback tier answered is a success
+        self.breaker = CircuitBreaker('llm', LLM_BREAKER_LATENCY)
+
+    def hedging_snapshot(self):
+        return {tier: policy.snapshot() for tier, policy in self.hedges.items()}
+
+    def call_params(self, tier, base_params):
+        """base_params with the tier's profile applied; a max_tokens in both takes the lower"""
+        profile = {k: v for k, v in self.profiles[tier].items() if k not in ROUTING_KEYS}
+        params = {**base_params, **profile}
+        if base_params.get('max_tokens') and profile.get('max_tokens'):
+            params['max_tokens'] = min(base_params['max_tokens'], profile['max_tokens'])
+        return params
+
+    def open(self, call, route, base_params, cancelled=None):
+        """Open the stream for a turn classified as route
+
+        Returns (tier, first_response, responses) for the tier that answered.
+        The last tier's error response is returned (and its exception raised)
+        as-is for the caller to report; (tier, None, None) means cancelled.
+        Raises CircuitOpen without calling upstream while the breaker is open.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpen('llm')
+        turn_started = time.monotonic()
+        try:
+            tier, first, responses = self._open(call, route, base_params, cancelled, turn_started)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        if responses is None:
+            self.breaker.release()
+        elif first is not None and (first.status_code >= 500 or first.status_code == HTTPStatus.TOO_MANY_REQUESTS):
+            self.breaker.record_failure()
+        else:
+            # 4xx answers (e.g. content inspection) still mean the upstream is healthy
+            self.breaker.record_success(time.monotonic() - turn_started)
+        return tier, first, responses
+
+    def _open(self, call, route, base_params, cancelled, turn_started):
+        chain = fallback_chain(route, self.max_attempts)
+
+        for attempt, tier in enumerate(chain):
+            is_last = attempt == len(chain) - 1
+            started = time.monotonic()
+            params = self.call_params(tier, base_params)
+            try:
+                first, responses = open_stream(call, params, self.profiles[tier].get('first_chunk_timeout'),
+                                               cancelled, self.hedges[tier])
+            except Exception as e:
+                self.metrics.record_failure(tier, 'timeouts' if isinstance(e, FirstChunkTimeout) else 'errors')
+                if is_last:
+                    raise
+                print(f"Model tier {tier} ({params['model']}) failed: {e} - falling back to {chain[attempt + 1]}",
+                      flush=True)
+                continue
+
+            if responses is None:
+                return tier, None, None
+            if first is not None and first.status_code != HTTPStatus.OK:
+                self.metrics.record_failure(tier, 'errors')
+                if not is_last:
+                    close_stream(responses)
+                    print(f"Model tier {tier} ({params['model']}) error: {first.code} - "
+                          f"falling back to {chain[attempt + 1]}", flush=True)
+                    continue
+                return tier, first, responses
+
+            now = time.monotonic()
+            self.metrics.record_served(route, tier, now - started, now - turn_started)
+            return tier, first, responses
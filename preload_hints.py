@@ -0,0 +1,98 @@
+"""
+Preload hints for the index page
+
+The browser otherwise only learns what the page needs after config-loader.js
+and app.js have run and fetched config/videosets.json. The index route
+resolves the set up front (?set=... or defaultSet) and lists the styles,
+scripts, the config and the idle clip's poster frame as `Link: rel=preload`
+headers - sent as a 103 Early Hints response first when the WSGI server offers
+one (environ['wsgi.early_hints'], e.g. gunicorn), and on the 200 response
+either way (CDNs can turn those into Early Hints too).
+
+Only responses the page reliably reuses are hinted. Clips and
+acknowledgement audio are not: Chromium ignores as=video / as=audio preloads,
+and where they are honoured the media element's Range requests do not reuse
+them, so each clip could be downloaded twice. The initial <video> element
+starts on the idle clip directly instead.
+"""
+import json
+import os
+import threading
+
+PRELOAD_HINTS = os.getenv('PRELOAD_HINTS', 'true').lower() == 'true'
+
+
+def link(url, as_type, mimetype=None, crossorigin=False):
+    value = f'<{url}>; rel=preload; as={as_type}'
+    if mimetype:
+        value += f'; type="{mimetype}"'
+    if crossorigin:
+        value += '; crossorigin'
+    return value
+
+
+class PreloadHints:
+    """Media URLs of a video set, from videosets.json (re-read when it changes)"""
+
+    def __init__(self, config_path='config/videosets.json'):
+        self.config_path = config_path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._config = None
+
+    def config(self):
+        try:
+            mtime = os.stat(self.config_path).st_mtime
+        except OSError:
+            return None
+        with self._lock:
+            if mtime != self._mtime:
+                try:
+                    with open(self.config_path, encoding='utf-8') as f:
+                        self._config = json.load(f)
+                except (OSError, ValueError) as e:
+                    print(f"Preload hints: cannot read {self.config_path}: {e}", flush=True)
+                    self._config = None
+                self._mtime = mtime
+            return self._config
+
+    def resolve_set(self, requested=None):
+        """The requested set if it exists, else defaultSet (None without a usable config)"""
+        config = self.config()
+        if not config:
+            return None
+        sets = config.get('sets', {})
+        if requested in sets:
+            return requested
+        default = config.get('defaultSet')
+        return default if default in sets else None
+
+    def _idle_entry(self, set_id):
+        config = self.config()
+        if not config or set_id is None:
+            return None, None
+        video_set = config['sets'][set_id]
+        idle = video_set.get('idleVideo') or video_set.get('defaultVideo')
+        entry = next((video for video in video_set.get('videos', []) if video.get('id') == idle), {})
+        return idle, entry
+
+    def idle_video(self, set_id):
+        idle, _ = self._idle_entry(set_id)
+        return f"/videos/{set_id}/{idle}" if idle else None
+
+    def idle_poster(self, set_id):
+        _, entry = self._idle_entry(set_id)
+        return (entry or {}).get('poster')
+
+    def links(self, set_id, scripts=(), styles=(), config_url='/config/videosets.json'):
+        """Link header values: page assets, the config and the idle clip's poster"""
+        links = [link(url, 'style') for url in styles]
+        links += [link(url, 'script') for url in scripts]
+        # config-loader.js fetch()es the config in cors mode
+        links.append(link(config_url, 'fetch', 'application/json', crossorigin=True))
+
+        # The poster is an <img>-style fetch of the same URL the <video poster> makes
+        poster = self.idle_poster(set_id)
+        if poster:
+            links.append(link(poster, 'image'))
+        return links
@@ -0,0 +1,415 @@
+"""
+On-demand profiling of the running server (admin only)
+
+Nothing here runs until an admin turns it on: the WSGI wrapper is swapped
+into app.wsgi_app only while a profiling window is open, the sampler thread
+only exists during a sampling window and tracemalloc only traces between
+start and stop - with everything off, requests take exactly the same path.
+
+- sampling: every interval, the Python stacks of all threads are recorded as
+            folded stacks (flamegraph.pl / speedscope input), rooted at the
+            route the thread is serving (or the thread name)
+- requests: a sampled fraction of requests runs under cProfile, including the
+            iteration of streamed bodies (the SSE loop); stats are aggregated
+            per endpoint and exported as text or a .prof file
+- memory:   tracemalloc snapshots (top allocations and the diff to the
+            previous snapshot) plus the size of session histories
+
+The admin surface exists only when ADMIN_TOKEN is set; requests must send
+`Authorization: Bearer <ADMIN_TOKEN>`.
+"""
+import cProfile
+import functools
+import hmac
+import io
+import marshal
+import math
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from flask import abort, request
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+# Longest window a single start request may open
+PROFILE_MAX_SECONDS = float(os.getenv('PROFILE_MAX_SECONDS', '300'))
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Leaf frames of threads that are parked, not working (dropped unless idle=true)
+IDLE_FUNCTIONS = {'wait', 'select', 'poll', 'accept', '_wait_for_tstate_lock'}
+
+
+def require_admin(view):
+    """404 when ADMIN_TOKEN is unset, 401 without the right bearer token"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            abort(404)
+        header = request.headers.get('Authorization', '')
+        token = header[len('Bearer '):] if header.startswith('Bearer ') else ''
+        if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            abort(401)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+# Keys accepted by pstats.Stats.sort_stats
+SORT_KEYS = frozenset(pstats.Stats.sort_arg_dict_default)
+
+
+def parse_number(value, name):
+    """A finite number from a JSON/query value; ValueError names the parameter otherwise"""
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"{name} must be a number")
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number") from None
+    if not math.isfinite(number):
+        raise ValueError(f"{name} must be a number")
+    return number
+
+
+def window_seconds(value, default=30.0):
+    seconds = parse_number(value, 'seconds') if value is not None else default
+    return max(0.1, min(seconds, PROFILE_MAX_SECONDS))
+
+
+def frame_label(code):
+    filename = code.co_filename
+    if filename.startswith(ROOT):
+        filename = os.path.relpath(filename, ROOT)
+    else:
+        filename = '/'.join(filename.replace('\\', '/').split('/')[-2:])
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Wall-clock stack sampler over sys._current_frames()"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.counts = Counter()
+        self.samples = 0
+        self.interval = 0.0
+        self.include_idle = False
+        self.started_at = None
+        self.until = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds, interval, thread_routes, include_idle=False):
+        with self._lock:
+            if self.running:
+                raise RuntimeError("Sampling is already running")
+            self.counts = Counter()
+            self.samples = 0
+            self.interval = interval
+            self.include_idle = include_idle
+            self.started_at = time.time()
+            self.until = time.monotonic() + seconds
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(thread_routes,),
+                                            daemon=True, name='profiling-sampler')
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, thread_routes):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval) and time.monotonic() < self.until:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if not self.include_idle and frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame.f_code))
+                    frame = frame.f_back
+                route = thread_routes.get(ident)
+                stack.append(f"route:{route}" if route else f"thread:{names.get(ident, ident)}")
+                with self._lock:
+                    self.counts[';'.join(reversed(stack))] += 1
+            with self._lock:
+                self.samples += 1
+        self.until = time.monotonic()
+
+    def folded(self):
+        """One 'frame;frame;frame count' line per distinct stack"""
+        with self._lock:
+            return ''.join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+    def status(self):
+        with self._lock:
+            return {
+                'running': self.running,
+                'samples': self.samples,
+                'stacks': len(self.counts),
+                'interval_ms': round(self.interval * 1000, 2),
+                'started_at': self.started_at,
+                'remaining_seconds': round(max(0.0, self.until - time.monotonic()), 1) if self.running else 0,
+            }
+
+
+class ProfiledBody:
+    """Iterates a WSGI body with the request's profiler enabled around each chunk"""
+
+    def __init__(self, body, profiler, profile, endpoint):
+        self.body = body
+        self.profiler = profiler
+        self.profile = profile
+        self.endpoint = endpoint
+        self._iterator = None
+
+    def __iter__(self):
+        self._iterator = iter(self.body)
+        return self
+
+    def __next__(self):
+        ident = threading.get_ident()
+        self.profiler.thread_routes[ident] = self.endpoint
+        if self.profile is None:
+            return next(self._iterator)
+        self.profile.enable()
+        try:
+            return next(self._iterator)
+        finally:
+            self.profile.disable()
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                if self.profile is not None:
+                    # Generator cleanup (finally blocks) is part of the request
+                    self.profile.enable()
+                try:
+                    self.body.close()
+                finally:
+                    if self.profile is not None:
+                        self.profile.disable()
+        finally:
+            self.profiler.finish_request(self.profile, self.endpoint)
+
+
+class Profiler:
+    """Admin-controlled profiling windows for one Flask app"""
+
+    def __init__(self, app):
+        self.app = app
+        self._wsgi_app = app.wsgi_app
+        self._lock = threading.Lock()
+        self.sampler = StackSampler()
+        self.thread_routes = {}
+
+        # Request profiling window
+        self.rate = 0.0
+        self.endpoints = None
+        self.until = 0.0
+        self.stats = {}
+        self.requests_seen = 0
+        self.requests_profiled = 0
+        self.profiled_by_endpoint = Counter()
+
+        self.last_snapshot = None
+
+    # ---- WSGI wrapper (installed only while a window is open) ----
+
+    @property
+    def requests_active(self):
+        return time.monotonic() < self.until
+
+    def _update_wrapper(self):
+        active = self.sampler.running or self.requests_active
+        self.app.wsgi_app = self._profiled_wsgi_app if active else self._wsgi_app
+
+    def _schedule_update(self, seconds):
+        timer = threading.Timer(seconds + 0.05, self._update_wrapper)
+        timer.daemon = True
+        timer.start()
+
+    def _endpoint(self, environ):
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+            return endpoint
+        except Exception:
+            return 'unmatched'
+
+    def _profiled_wsgi_app(self, environ, start_response):
+        endpoint = self._endpoint(environ)
+        self.thread_routes[threading.get_ident()] = endpoint
+
+        profile = None
+        if self.requests_active and (self.endpoints is None or endpoint in self.endpoints):
+            with self._lock:
+                self.requests_seen += 1
+            if random.random() < self.rate:
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:  # Another profiler is active (Python 3.12+ allows one)
+                    profile = None
+
+        try:
+            body = self._wsgi_app(environ, start_response)
+        except BaseException:
+            if profile is not None:
+                profile.disable()
+            self.finish_request(profile, endpoint)
+            raise
+        if profile is not None:
+            profile.disable()
+        return ProfiledBody(body, self, profile, endpoint)
+
+    def finish_request(self, profile, endpoint):
+        self.thread_routes.pop(threading.get_ident(), None)
+        if profile is None:
+            return
+        with self._lock:
+            self.requests_profiled += 1
+            self.profiled_by_endpoint[endpoint] += 1
+            if endpoint in self.stats:
+                self.stats[endpoint].add(profile)
+            else:
+                self.stats[endpoint] = pstats.Stats(profile)
+
+    # ---- Controls ----
+
+    def start_sampling(self, seconds, interval_ms=5.0, include_idle=False):
+        """Raises ValueError for invalid parameters, RuntimeError if sampling is running"""
+        seconds = window_seconds(seconds)
+        interval = max(1.0, parse_number(interval_ms, 'interval_ms')) / 1000
+        self.sampler.start(seconds, interval, self.thread_routes, include_idle)
+        self._update_wrapper()
+        self._schedule_update(seconds)
+
+    def start_requests(self, seconds, rate=0.1, endpoints=None):
+        """Raises ValueError for invalid parameters"""
+        seconds = window_seconds(seconds, 60.0)
+        rate = max(0.0, min(parse_number(rate, 'rate'), 1.0))
+        if endpoints is not None and (not isinstance(endpoints, list)
+                                      or not all(isinstance(name, str) for name in endpoints)):
+            raise ValueError("endpoints must be a list of endpoint names")
+        with self._lock:
+            self.rate = rate
+            self.endpoints = set(endpoints) if endpoints else None
+            self.stats = {}
+            self.requests_seen = 0
+            self.requests_profiled = 0
+            self.profiled_by_endpoint = Counter()
+            self.until = time.monotonic() + seconds
+        self._update_wrapper()
+        self._schedule_update(seconds)
+
+    def stop(self):
+        self.until = 0.0
+        self.sampler.stop()
+        self._update_wrapper()
+
+    def status(self):
+        with self._lock:
+            requests = {
+                'active': self.requests_active,
+                'rate': self.rate,
+                'endpoints': sorted(self.endpoints) if self.endpoints else None,
+                'remaining_seconds': round(max(0.0, self.until - time.monotonic()), 1),
+                'seen': self.requests_seen,
+                'profiled': self.requests_profiled,
+                'profiled_by_endpoint': dict(self.profiled_by_endpoint),
+            }
+        return {
+            'wrapper_installed': self.app.wsgi_app != self._wsgi_app,
+            'sampling': self.sampler.status(),
+            'requests': requests,
+            'memory': {'tracing': tracemalloc.is_tracing()},
+        }
+
+    # ---- Request profile output ----
+
+    def request_stats_text(self, endpoint=None, sort='cumulative', limit=40):
+        """Raises ValueError for a sort key pstats does not know or a limit below 1"""
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of: {', '.join(sorted(SORT_KEYS))}")
+        limit = int(parse_number(limit, 'limit'))
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        with self._lock:
+            selected = {name: stats for name, stats in self.stats.items()
+                        if endpoint is None or name == endpoint}
+            buffer = io.StringIO()
+            for name, stats in sorted(selected.items()):
+                buffer.write(f"=== {name} ===\n")
+                stats.stream = buffer
+                stats.sort_stats(sort).print_stats(limit)
+        return buffer.getvalue()
+
+    def request_stats_dump(self, endpoint):
+        """marshal'd pstats data: load with pstats.Stats(path), snakeviz, flameprof..."""
+        with self._lock:
+            stats = self.stats.get(endpoint)
+            return None if stats is None else marshal.dumps(stats.stats)
+
+    # ---- Memory ----
+
+    def start_memory(self, frames=10):
+        """Raises ValueError for a non-numeric frames"""
+        frames = max(1, int(parse_number(frames, 'frames')))
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.last_snapshot = None
+
+    def stop_memory(self):
+        tracemalloc.stop()
+        self.last_snapshot = None
+
+    def memory_snapshot(self, limit=25, group_by='lineno'):
+        """Top allocations and the change since the previous snapshot"""
+        if not tracemalloc.is_tracing():
+            return None
+        if group_by not in ('lineno', 'filename', 'traceback'):
+            group_by = 'lineno'
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        ])
+        current, peak = tracemalloc.get_traced_memory()
+        result = {
+            'traced_bytes': current,
+            'peak_bytes': peak,
+            'top': [{'where': str(stat.traceback), 'bytes': stat.size, 'count': stat.count}
+                    for stat in snapshot.statistics(group_by)[:limit]],
+        }
+        if self.last_snapshot is not None:
+            result['diff'] = [{'where': str(stat.traceback), 'bytes': stat.size_diff, 'count': stat.count_diff}
+                              for stat in snapshot.compare_to(self.last_snapshot, group_by)[:limit]]
+        self.last_snapshot = snapshot
+        return result
+
+
+def deep_sizeof(obj, seen=None):
+    """Approximate bytes held by a structure of dicts, lists and scalars"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
@@ -0,0 +1,145 @@
+"""
+In-flight chat turn tracking: supersession, cancellation and wasted work
+
+One turn runs per session at a time. Starting a turn cancels the session's
+previous in-flight turn (the user spoke again) and waits for it to release
+the session before reading history, so history writes never interleave.
+A cancelled turn stops pulling its upstream stream at the next chunk and is
+not written to history; the worker time it had already spent is reported as
+wasted_worker_seconds.
+"""
+import os
+import threading
+
+TURN_LOCK_TIMEOUT = float(os.getenv('TURN_LOCK_TIMEOUT', '30'))
+
+CANCEL_REASONS = ('disconnect', 'superseded', 'client')
+
+
+class TurnCancelled(Exception):
+    """The turn was cancelled before or while it ran"""
+
+    def __init__(self, reason):
+        super().__init__(f"Turn cancelled: {reason}")
+        self.reason = reason
+
+
+class TurnMetrics:
+    """Counters for finished turns (thread-safe)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.degraded = 0  # Answered locally while the LLM circuit was open
+        self.budget_stops = 0  # Replies cut at their sentence budget (upstream closed early)
+        self.cancelled = {reason: 0 for reason in CANCEL_REASONS}
+        self.worker_seconds = 0.0
+        self.wasted_worker_seconds = 0.0
+
+    def record_start(self):
+        with self._lock:
+            self.started += 1
+
+    def record_budget_stop(self):
+        with self._lock:
+            self.budget_stops += 1
+
+    def record(self, outcome, elapsed, reason=None):
+        """outcome: 'completed', 'degraded', 'failed' or 'cancelled' (with a reason)"""
+        with self._lock:
+            self.worker_seconds += elapsed
+            if outcome == 'cancelled':
+                self.cancelled[reason] = self.cancelled.get(reason, 0) + 1
+                self.wasted_worker_seconds += elapsed
+            elif outcome == 'completed':
+                self.completed += 1
+            elif outcome == 'degraded':
+                self.degraded += 1
+            else:
+                self.failed += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'started': self.started,
+                'completed': self.completed,
+                'failed': self.failed,
+                'degraded': self.degraded,
+                'budget_stops': self.budget_stops,
+                'cancelled': dict(self.cancelled),
+                'in_flight': (self.started - self.completed - self.degraded - self.failed
+                              - sum(self.cancelled.values())),
+                'worker_seconds': round(self.worker_seconds, 3),
+                'wasted_worker_seconds': round(self.wasted_worker_seconds, 3),
+            }
+
+
+class SessionTurns:
+    """Per-session serialization of turns with supersession
+
+    Turns only need cancel(reason), `is_cancelled` and `cancel_reason`. A
+    session's entry exists only while it has a turn waiting or running, so
+    client-chosen session ids do not accumulate.
+    """
+
+    def __init__(self, lock_timeout=TURN_LOCK_TIMEOUT):
+        self.lock_timeout = lock_timeout
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def _leave(self, session_id, state, turn):
+        """turn no longer waits for / holds the session; drop the entry once nothing does
+
+        Callers that find the entry always set their turn on it in the same
+        locked step (acquire), so an entry without a current turn and with a
+        free lock is referenced by no one.
+        """
+        with self._lock:
+            if state['turn'] is turn:
+                state['turn'] = None
+            if (state['turn'] is None and not state['lock'].locked()
+                    and self._sessions.get(session_id) is state):
+                del self._sessions[session_id]
+
+    def acquire(self, session_id, turn):
+        """Make turn the session's current turn and wait until the previous one is gone
+
+        Raises TurnCancelled if turn itself was superseded while waiting and
+        TimeoutError if the session stays busy for lock_timeout seconds.
+        """
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                state = self._sessions[session_id] = {'lock': threading.Lock(), 'turn': None}
+            previous, state['turn'] = state['turn'], turn
+        if previous is not None and previous is not turn:
+            previous.cancel('superseded')
+
+        if not state['lock'].acquire(timeout=self.lock_timeout):
+            self._leave(session_id, state, turn)
+            raise TimeoutError(f"Session {session_id} is busy")
+        if turn.is_cancelled:
+            state['lock'].release()
+            self._leave(session_id, state, turn)
+            raise TurnCancelled(turn.cancel_reason)
+
+    def release(self, session_id, turn):
+        with self._lock:
+            state = self._sessions[session_id]
+        state['lock'].release()
+        self._leave(session_id, state, turn)
+
+    def cancel(self, session_id, reason='client', turn_id=None):
+        """Cancel the session's in-flight turn (only if it is turn_id, when given)
+
+        Returns True if a turn was cancelled.
+        """
+        with self._lock:
+            state = self._sessions.get(session_id)
+            turn = state['turn'] if state else None
+        if turn is None or (turn_id is not None and getattr(turn, 'turn_id', None) != turn_id):
+            return False
+        turn.cancel(reason)
+        return True
@@ -0,0 +1,264 @@
+"""
+Batch downloading for the video search skill
+============================================
+
+Downloads a list of (url, set, action) entries through a bounded pool of
+yt-dlp workers instead of one --url per invocation:
+
+- each yt-dlp fetches up to `fragments` fragments of a DASH/HLS video at once
+- interrupted downloads resume from their .part files (--continue), and
+  entries whose output file already exists are skipped
+- the optional pre_check (e.g. a thumbnail match against videos already
+  on disk) skips known duplicates before any bandwidth is spent
+- as soon as a download finishes, its ffprobe duration check (and the
+  optional near-duplicate check) runs on a separate post-processing pool,
+  so probing overlaps with the downloads still running
+- a consolidated report is printed at the end
+
+Batch file: a JSON list of {"url": ..., "set": ..., "action": ...} (or
+{"downloads": [...]}), or a text file with one `URL SET [ACTION]` per line
+(# starts a comment). Without an action the entry is the set's multi-action
+source video (videos/<set>/source.mp4), otherwise videos/<set>/<action>.mp4.
+
+All external commands go through `run`, called like
+subprocess.run(cmd, capture_output=True, text=True) and expected to return
+an object with returncode/stdout/stderr. Passing a fake that writes the file
+named after -o (and answers ffprobe with JSON) exercises the whole pipeline
+offline.
+"""
+
+import json
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Action name of a set's multi-action source video
+SOURCE_ACTION = "source"
+
+# Fragments each yt-dlp fetches concurrently (--concurrent-fragments)
+DEFAULT_FRAGMENTS = 4
+DEFAULT_RETRIES = 10
+
+
+def load_batch(path):
+    """[{'url', 'set', 'action'}, ...] from a JSON or text batch file"""
+    path = Path(path)
+    text = path.read_text(encoding="utf-8")
+    if path.suffix.lower() == ".json":
+        data = json.loads(text)
+        entries = data.get("downloads", []) if isinstance(data, dict) else data
+    else:
+        entries = []
+        for number, line in enumerate(text.splitlines(), 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            fields = line.split()
+            if len(fields) not in (2, 3):
+                raise ValueError(f"line {number}: expected 'URL SET [ACTION]', got {line!r}")
+            entries.append(dict(zip(("url", "set", "action"), fields)))
+
+    jobs = []
+    targets = {}
+    for number, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict) or not entry.get("url") or not entry.get("set"):
+            raise ValueError(f"entry {number}: needs 'url' and 'set'")
+        job = {"url": entry["url"], "set": entry["set"],
+               "action": entry.get("action") or SOURCE_ACTION}
+        target = (job["set"], job["action"])
+        if target in targets:
+            raise ValueError(f"entry {number}: {job['set']}/{job['action']} is already "
+                             f"downloaded by entry {targets[target]}")
+        targets[target] = number
+        jobs.append(job)
+    return jobs
+
+
+def output_file(job, output_dir="videos"):
+    return Path(output_dir) / job["set"] / f"{job['action']}.mp4"
+
+
+def partial_files(output):
+    """yt-dlp leftovers of an interrupted download of output (.part / .ytdl)"""
+    if not output.parent.exists():
+        return []
+    return [path for path in output.parent.glob(f"{output.stem}.*")
+            if path.suffix in (".part", ".ytdl")]
+
+
+def probe_duration(path, run=subprocess.run):
+    """Duration of a video in seconds (None if ffprobe cannot read it)"""
+    cmd = ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", str(path)]
+    result = run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    try:
+        return float(json.loads(result.stdout).get("format", {}).get("duration", 0))
+    except (json.JSONDecodeError, TypeError, ValueError):
+        return None
+
+
+def format_size(size):
+    return f"{size / (1 << 20):.1f} MB" if size else "-"
+
+
+class BatchDownloader:
+    """Bounded-concurrency yt-dlp downloads with pipelined post-processing
+
+    pre_check(job) -> bool runs on the download worker before yt-dlp; False
+    skips the job as a duplicate without downloading it. post_check(path) ->
+    bool runs after the probe (serialized, since it may compare the new file
+    with the other downloads); False means the file was rejected as a
+    duplicate and removed.
+    """
+
+    def __init__(self, video_format, output_dir="videos", workers=4, fragments=DEFAULT_FRAGMENTS,
+                 run=subprocess.run, post_check=None, duration_range=None, pre_check=None):
+        self.video_format = video_format
+        self.output_dir = output_dir
+        self.workers = max(1, workers)
+        self.fragments = max(1, fragments)
+        self.run = run
+        self.pre_check = pre_check
+        self.post_check = post_check
+        # (min, max) seconds expected for action clips; source videos are not checked
+        self.duration_range = duration_range
+        self._print_lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._done = 0
+        self._total = 0
+
+    def log(self, message):
+        with self._print_lock:
+            print(message, flush=True)
+
+    def download_cmd(self, url, output):
+        return [
+            "yt-dlp",
+            "-f", self.video_format,
+            "-o", str(output),
+            "--no-playlist",
+            "--continue",
+            "--concurrent-fragments", str(self.fragments),
+            "--retries", str(DEFAULT_RETRIES),
+            "--fragment-retries", str(DEFAULT_RETRIES),
+            "--no-progress",
+            url,
+        ]
+
+    def new_result(self, job, note=""):
+        """Report entry of a job, 'failed' until its download succeeds"""
+        return {**job, "output": str(output_file(job, self.output_dir)), "status": "failed", "resumed": False,
+                "size": 0, "duration": None, "seconds": 0.0, "note": note}
+
+    def download(self, job):
+        output = output_file(job, self.output_dir)
+        result = self.new_result(job)
+        if output.exists():
+            result.update(status="exists", size=output.stat().st_size)
+            return result
+        if self.pre_check is not None and not self.pre_check(job):
+            result.update(status="duplicate", note="thumbnail matches a video already downloaded")
+            return result
+
+        output.parent.mkdir(parents=True, exist_ok=True)
+        result["resumed"] = bool(partial_files(output))
+        started = time.monotonic()
+        try:
+            completed = self.run(self.download_cmd(job["url"], output), capture_output=True, text=True)
+        except OSError as e:
+            result["note"] = str(e)
+            return result
+        result["seconds"] = time.monotonic() - started
+
+        if completed.returncode != 0 or not output.exists():
+            lines = (completed.stderr or "").strip().splitlines()
+            result["note"] = lines[-1] if lines else f"yt-dlp exited with {completed.returncode}"
+            return result
+        result.update(status="downloaded", size=output.stat().st_size)
+        return result
+
+    def post_process(self, result):
+        if result["status"] not in ("downloaded", "exists"):
+            return result
+        duration = probe_duration(result["output"], self.run)
+        result["duration"] = duration
+        if duration is None:
+            result["note"] = "ffprobe could not read the file"
+        elif self.duration_range and result["action"] != SOURCE_ACTION:
+            low, high = self.duration_range
+            if not low <= duration <= high:
+                result["note"] = f"duration {duration:.1f}s outside {low}-{high}s"
+
+        if result["status"] == "downloaded" and self.post_check is not None:
+            with self._check_lock:
+                if not self.post_check(result["output"]):
+                    result.update(status="duplicate", size=0)
+        return result
+
+    def _post_process_safely(self, result):
+        """post_process() that reports an exception (e.g. from post_check) on its job only"""
+        try:
+            return self.post_process(result)
+        except Exception as e:
+            result["note"] = f"post-processing failed: {e}"
+            return result
+
+    def _report_progress(self, result):
+        with self._print_lock:
+            self._done += 1
+            mark = {"downloaded": "✓", "exists": "=", "duplicate": "⚠"}.get(result["status"], "✗")
+            detail = result["note"] or format_size(result["size"])
+            resumed = ", resumed" if result["resumed"] else ""
+            print(f"[{self._done}/{self._total}] {mark} {result['set']}/{result['action']}.mp4 "
+                  f"{result['status']}{resumed} ({detail})", flush=True)
+
+    def run_batch(self, jobs):
+        """Download every job; returns one result dict per job, in job order"""
+        self._done = 0
+        self._total = len(jobs)
+        self.log(f"\n=== Batch download: {len(jobs)} video(s), {self.workers} worker(s), "
+                 f"{self.fragments} fragment(s) each ===")
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="probe") as post_pool, \
+                ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download") as download_pool:
+
+            def pipeline(job):
+                try:
+                    result = self.download(job)
+                except Exception as e:
+                    result = self.new_result(job, str(e))
+                # Hand off to the post-processing pool; this worker moves on to the next URL
+                future = post_pool.submit(self._post_process_safely, result)
+                future.add_done_callback(lambda f: self._report_progress(f.result()))
+                return future
+
+            post_futures = list(download_pool.map(pipeline, jobs))
+            results = [future.result() for future in post_futures]
+
+        self.print_report(results, time.monotonic() - started)
+        return results
+
+    def print_report(self, results, elapsed):
+        print("\n=== Batch Report ===")
+        width = max((len(f"{r['set']}/{r['action']}.mp4") for r in results), default=0)
+        for result in results:
+            duration = f"{result['duration']:.1f}s" if result["duration"] else "-"
+            took = f"{result['seconds']:.1f}s" if result["seconds"] else "-"
+            flags = " (resumed)" if result["resumed"] else ""
+            note = f"  {result['note']}" if result["note"] else ""
+            target = f"{result['set']}/{result['action']}.mp4"
+            print(f"  {result['status']:<10} {target:<{width}}  "
+                  f"{format_size(result['size']):>9}  {duration:>7}  {took:>6}{flags}{note}")
+            if result["status"] == "failed":
+                print(f"             {result['url']}")
+
+        counts = {status: sum(1 for r in results if r["status"] == status)
+                  for status in ("downloaded", "exists", "duplicate", "failed")}
+        total_size = sum(r["size"] for r in results if r["status"] == "downloaded")
+        print(f"\nDownloaded {counts['downloaded']} ({format_size(total_size)}), "
+              f"already present {counts['exists']}, duplicates skipped {counts['duplicate']}, "
+              f"failed {counts['failed']} in {elapsed:.1f}s")
@@ -28,6 +28,12 @@ YouTube individual action searches rarely yield cohesive sets. Instead:
 
 3. FALLBACK: Record your own cohesive set
 
+Near-duplicates (see video_fingerprint.py): search results that are
+re-uploads/mirrors of a better-ranked result are dropped, and results,
+downloads and split clips that look like a video already under videos/ are
+flagged. Downloads are only skipped (or removed) with --skip-duplicates.
+--no-dedup turns all of this off.
+
 Requirements:
 - yt-dlp (pip install yt-dlp)
 - ffmpeg (for video processing)
@@ -44,14 +50,29 @@ Usage:
     python search_videos.py --split --source videos/myset/source.mp4 --timestamps "0:00-0:05=idle,0:06-0:12=walk"
 
     python search_videos.py --list-actions
+
+    # Download a list of URLs concurrently, resuming interrupted files
+    python search_videos.py --batch downloads.txt --workers 4
+
+    # Build a whole set from a manifest (cached, parallel, updates config/videosets.json)
+    python search_videos.py --build skills/build_manifest.example.json
 """
 
 import subprocess
 import sys
 import argparse
+import hashlib
 import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
+import batch_download
+import video_fingerprint
+
 # Action categories with search keywords
 ACTION_CATEGORIES = {
     # Basic static poses
@@ -250,7 +271,94 @@ def list_actions():
     print("\n" + "="*50 + "\n")
 
 
-def search_source_videos():
+def open_fingerprint_index(output_dir="videos"):
+    """Fingerprint index of the videos already on disk, or None without ffmpeg"""
+    if shutil.which("ffmpeg") is None or shutil.which("ffprobe") is None:
+        return None
+    index = video_fingerprint.FingerprintIndex(output_dir)
+    if index.refresh():
+        index.save()
+    return index
+
+
+def drop_duplicate_results(results, output_dir="videos"):
+    """Remove re-uploads/mirrors of better-ranked results (by thumbnail) and flag videos we already have"""
+    if not results:
+        return results
+    print(f"\nChecking {len(results)} results for near-duplicates...")
+    video_fingerprint.mark_duplicate_results(results, open_fingerprint_index(output_dir))
+    unique = [r for r in results if 'duplicate_of' not in r]
+    if len(unique) < len(results):
+        print(f"Skipped {len(results) - len(unique)} re-upload(s)/mirror(s) of other results")
+    return unique
+
+
+def print_local_match(video, output_dir="videos"):
+    if video.get('local_match'):
+        print(f"   ⚠ Looks like {Path(output_dir) / video['local_match']} (already downloaded)")
+
+
+def find_downloaded_duplicate(url, index):
+    """Indexed video of the same duration with a frame close to the URL's thumbnail, checked before downloading"""
+    cmd = ["yt-dlp", "--dump-json", "--no-download", "--no-playlist", url]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    try:
+        info = json.loads(result.stdout.splitlines()[0])
+    except (json.JSONDecodeError, IndexError):
+        return None
+    thumbnail = info.get('thumbnail')
+    if not thumbnail:
+        return None
+    try:
+        value = video_fingerprint.image_hash(thumbnail)
+    except (RuntimeError, subprocess.TimeoutExpired):
+        return None
+    return index.find([value], min_ratio=1.0, max_distance=video_fingerprint.THUMBNAIL_DISTANCE,
+                      duration=info.get('duration'))
+
+
+def skip_known_download(url, index, skip_duplicates=False):
+    """True if the URL's thumbnail matches a video we already have and skip_duplicates is set"""
+    if index is None:
+        return False
+    match = find_downloaded_duplicate(url, index)
+    if not match:
+        return False
+    if not skip_duplicates:
+        print(f"   ⚠ Thumbnail looks like {Path(index.root) / match[0]}, downloading anyway "
+              f"(use --skip-duplicates to skip)")
+        return False
+    print(f"\n⚠ Skipping download: thumbnail matches {Path(index.root) / match[0]} (--skip-duplicates)")
+    return True
+
+
+def check_downloaded_file(output_file, index, remove=False, exclude=()):
+    """Fingerprint a new file and flag it if it duplicates an indexed video (delete it if remove)
+
+    Returns True if the file was kept.
+    """
+    try:
+        hashes = index.add(output_file)
+    except RuntimeError as e:
+        print(f"   (not fingerprinted: {e})")
+        return True
+    match = index.find(hashes, exclude=[output_file, *exclude], duration=index.duration(output_file))
+    if match and remove:
+        print(f"\n⚠ {output_file} duplicates {Path(index.root) / match[0]} "
+              f"({match[1]:.0%} of frames match), removing it (--skip-duplicates)")
+        index.remove(output_file)
+        Path(output_file).unlink()
+        index.save()
+        return False
+    if match:
+        print(f"   ⚠ Near-duplicate of {Path(index.root) / match[0]} ({match[1]:.0%} of frames match)")
+    index.save()
+    return True
+
+
+def search_source_videos(dedup=True, output_dir="videos"):
     """Search for multi-action source videos (RECOMMENDED approach)."""
     print("\n=== Searching for Multi-Action Source Videos ===")
     print("These videos contain multiple actions from the same person,")
@@ -289,6 +397,7 @@ def search_source_videos():
                                 'uploader': video_info.get('uploader', 'Unknown'),
                                 'view_count': video_info.get('view_count', 0),
                                 'description': video_info.get('description', '')[:200],
+                                'thumbnail': video_info.get('thumbnail'),
                             })
                     except json.JSONDecodeError:
                         continue
@@ -308,6 +417,10 @@ def search_source_videos():
     # Sort by view count
     unique_results.sort(key=lambda x: x['view_count'], reverse=True)
 
+    # Same reel uploaded under different URLs: keep the most viewed copy
+    if dedup:
+        unique_results = drop_duplicate_results(unique_results, output_dir)
+
     print(f"\n=== Found {len(unique_results)} potential source videos ===\n")
 
     for i, video in enumerate(unique_results[:15], 1):
@@ -319,6 +432,7 @@ def search_source_videos():
         print(f"   URL: {video['url']}")
         if video['description']:
             print(f"   Description: {video['description'][:100]}...")
+        print_local_match(video, output_dir)
         print()
 
     print("\n=== Next Steps ===")
@@ -329,7 +443,7 @@ def search_source_videos():
     return unique_results
 
 
-def download_source_video(url, video_set, output_dir="videos"):
+def download_source_video(url, video_set, output_dir="videos", skip_duplicates=False, dedup=True):
     """Download a multi-action source video."""
     output_path = Path(output_dir) / video_set
     output_path.mkdir(parents=True, exist_ok=True)
@@ -340,6 +454,10 @@ def download_source_video(url, video_set, output_dir="videos"):
     print(f"Video Set: {video_set}")
     print(f"Output: {output_file}")
 
+    index = open_fingerprint_index(output_dir) if dedup else None
+    if skip_known_download(url, index, skip_duplicates):
+        return False
+
     cmd = [
         "yt-dlp",
         "-f", VIDEO_PREFERENCES['format'],
@@ -350,14 +468,12 @@ def download_source_video(url, video_set, output_dir="videos"):
     try:
         subprocess.run(cmd, check=True)
         print(f"\n✓ Downloaded successfully: {output_file}")
+        if index is not None and not check_downloaded_file(output_file, index, skip_duplicates):
+            return False
 
         # Get video duration
-        probe_cmd = ["ffprobe", "-v", "quiet", "-print_format", "json",
-                     "-show_format", str(output_file)]
-        probe_result = subprocess.run(probe_cmd, capture_output=True, text=True)
-        if probe_result.returncode == 0:
-            info = json.loads(probe_result.stdout)
-            duration = float(info.get('format', {}).get('duration', 0))
+        duration = batch_download.probe_duration(output_file)
+        if duration is not None:
             print(f"   Duration: {int(duration)}s")
 
         print("\n=== Next Step ===")
@@ -371,11 +487,13 @@ def download_source_video(url, video_set, output_dir="videos"):
         return False
 
 
-def split_source_video(source_path, timestamps, output_dir=None):
+def split_source_video(source_path, timestamps, output_dir=None, index_dir="videos", dedup=True):
     """Split a source video into individual action clips.
 
     timestamps format: "start-end=action,start-end=action,..."
     Example: "0:00-0:05=idle,0:06-0:12=walk,0:13-0:18=jump"
+
+    Clips that look like a video already under index_dir are flagged.
     """
     source_path = Path(source_path)
     if not source_path.exists():
@@ -415,6 +533,8 @@ def split_source_video(source_path, timestamps, output_dir=None):
     for clip in clips:
         print(f"  • {clip['action']}: {clip['start']} - {clip['end']}")
 
+    index = open_fingerprint_index(index_dir) if dedup else None
+
     print("\nExtracting clips...")
     success_count = 0
 
@@ -436,6 +556,9 @@ def split_source_video(source_path, timestamps, output_dir=None):
             subprocess.run(cmd, capture_output=True, check=True)
             print(f"  ✓ {clip['action']}.mp4")
             success_count += 1
+            if index is not None:
+                # Flag only: the timestamps were chosen on purpose
+                check_downloaded_file(output_file, index, exclude=[source_path])
         except subprocess.CalledProcessError as e:
             print(f"  ✗ {clip['action']}.mp4 - Error: {e}")
 
@@ -449,7 +572,7 @@ def split_source_video(source_path, timestamps, output_dir=None):
     return success_count == len(clips)
 
 
-def search_videos(action, preview_only=False):
+def search_videos(action, preview_only=False, dedup=True, output_dir="videos"):
     """Search for videos matching the action."""
     if action not in ACTION_CATEGORIES:
         print(f"Error: Unknown action '{action}'")
@@ -494,6 +617,7 @@ def search_videos(action, preview_only=False):
                                 'duration': duration,
                                 'uploader': video_info.get('uploader', 'Unknown'),
                                 'view_count': video_info.get('view_count', 0),
+                                'thumbnail': video_info.get('thumbnail'),
                             })
                     except json.JSONDecodeError:
                         continue
@@ -505,6 +629,11 @@ def search_videos(action, preview_only=False):
     # Sort by view count
     results.sort(key=lambda x: x['view_count'], reverse=True)
 
+    if dedup:
+        seen_urls = set()
+        results = [r for r in results if not (r['url'] in seen_urls or seen_urls.add(r['url']))]
+        results = drop_duplicate_results(results[:20], output_dir)
+
     # Display results
     print(f"\n=== Found {len(results)} suitable videos ===\n")
 
@@ -512,12 +641,13 @@ def search_videos(action, preview_only=False):
         print(f"{i}. {video['title']}")
         print(f"   Duration: {video['duration']}s | Views: {video['view_count']:,}")
         print(f"   URL: {video['url']}")
+        print_local_match(video, output_dir)
         print()
 
     return results
 
 
-def download_video(url, action, output_dir="videos", video_set="default"):
+def download_video(url, action, output_dir="videos", video_set="default", skip_duplicates=False, dedup=True):
     """Download a video and prepare it for looping."""
     output_path = Path(output_dir) / video_set
     output_path.mkdir(parents=True, exist_ok=True)
@@ -529,6 +659,10 @@ def download_video(url, action, output_dir="videos", video_set="default"):
     print(f"Video Set: {video_set}")
     print(f"Output: {output_file}")
 
+    index = open_fingerprint_index(output_dir) if dedup else None
+    if skip_known_download(url, index, skip_duplicates):
+        return False
+
     cmd = [
         "yt-dlp",
         "-f", VIDEO_PREFERENCES['format'],
@@ -539,6 +673,8 @@ def download_video(url, action, output_dir="videos", video_set="default"):
     try:
         subprocess.run(cmd, check=True)
         print(f"\n✓ Downloaded successfully: {output_file}")
+        if index is not None and not check_downloaded_file(output_file, index, skip_duplicates):
+            return False
 
         # Suggest loop optimization
         print("\n=== Loop Optimization Tips ===")
@@ -554,6 +690,526 @@ def download_video(url, action, output_dir="videos", video_set="default"):
         print(f"\n✗ Download failed: {e}")
         return False
 
+def download_batch(batch_file, output_dir="videos", workers=4, fragments=batch_download.DEFAULT_FRAGMENTS,
+                   skip_duplicates=False, dedup=True, run=subprocess.run):
+    """Download every entry of a batch file concurrently (see batch_download.py)
+
+    Returns True if no download failed.
+    """
+    try:
+        jobs = batch_download.load_batch(batch_file)
+    except (OSError, ValueError) as e:
+        print(f"Error: invalid batch file {batch_file}: {e}")
+        return False
+    if not jobs:
+        print(f"Nothing to download in {batch_file}")
+        return True
+
+    pre_check = post_check = None
+    index = open_fingerprint_index(output_dir) if dedup else None
+    if index is not None:
+        pre_check = lambda job: not skip_known_download(job['url'], index, skip_duplicates)
+        post_check = lambda path: check_downloaded_file(path, index, skip_duplicates)
+
+    downloader = batch_download.BatchDownloader(
+        VIDEO_PREFERENCES['format'], output_dir, workers=workers, fragments=fragments, run=run,
+        pre_check=pre_check, post_check=post_check,
+        duration_range=(VIDEO_PREFERENCES['min_duration'], VIDEO_PREFERENCES['max_duration']))
+    results = downloader.run_batch(jobs)
+    return not any(result['status'] == 'failed' for result in results)
+
+# Build mode (--build): manifest -> download -> split -> transcode -> probe -> config
+#
+# Every intermediate artifact is stored in the build cache under the hash of
+# its inputs (source content hash + step parameters), so an existing artifact
+# is always up to date and editing one clip only rebuilds that clip's chain.
+BUILD_CACHE_DIR = "videos/.build"
+
+# Cut from the source at high quality; the delivery encode happens in transcode
+SPLIT_ARGS = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-c:a", "aac"]
+
+# Delivery encoding, overridable per manifest with "encode": {...}
+BUILD_ENCODE_DEFAULTS = {
+    "height": 720,      # max height, never upscales
+    "crf": 23,
+    "preset": "medium",
+    "audio": True,
+}
+
+
+def parse_timestamp(value):
+    """'1:02.5', '62.5' or 62.5 -> seconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    seconds = 0.0
+    for part in str(value).strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def cache_key(*parts):
+    """Stable hash of a step's inputs"""
+    key = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:20]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def run_ffmpeg(args):
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y"] + args
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()[-300:]}")
+
+
+def probe_video(path):
+    """Duration and frame size of a video (via ffprobe)"""
+    cmd = ["ffprobe", "-v", "quiet", "-print_format", "json",
+           "-show_format", "-show_streams", "-select_streams", "v:0", str(path)]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffprobe failed for {path}")
+    info = json.loads(result.stdout)
+    stream = (info.get('streams') or [{}])[0]
+    return {
+        'duration': float(info.get('format', {}).get('duration', 0)),
+        'width': stream.get('width'),
+        'height': stream.get('height'),
+        'size': Path(path).stat().st_size,
+    }
+
+
+class BuildCache:
+    """Content-addressed store for build artifacts
+
+    Artifacts are written atomically, so a file that exists is complete.
+    Content hashes of local source files are memoized by (size, mtime) in
+    hashes.json so unchanged sources are not re-read on every build.
+    """
+
+    def __init__(self, root=BUILD_CACHE_DIR):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._hashes_path = self.root / "hashes.json"
+        self._hashes = {}
+        self._dirty = False
+        if self._hashes_path.exists():
+            with open(self._hashes_path, encoding='utf-8') as f:
+                self._hashes = json.load(f)
+
+    def path(self, kind, key, extension):
+        return self.root / kind / f"{key}{extension}"
+
+    def produce(self, path, build):
+        """Create path with build(tmp_path) unless it exists, returns True if it was cached"""
+        if path.exists():
+            return True
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Keep the extension last: ffmpeg and yt-dlp pick the container from it
+        tmp_path = path.with_name(f"{path.stem}.tmp{path.suffix}")
+        build(tmp_path)
+        os.replace(tmp_path, path)
+        return False
+
+    def content_hash(self, path):
+        """sha256 of a file, memoized by (size, mtime)"""
+        path = Path(path).resolve()
+        stat = path.stat()
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        with self._lock:
+            entry = self._hashes.get(str(path))
+        if entry and entry['stamp'] == stamp:
+            return entry['sha256']
+
+        digest = file_sha256(path)
+        with self._lock:
+            self._hashes[str(path)] = {'stamp': stamp, 'sha256': digest}
+            self._dirty = True
+        return digest
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._hashes_path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._hashes, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self._hashes_path)
+            self._dirty = False
+
+
+def run_graph(steps, workers=4):
+    """Run {name: (dependencies, fn)} on a thread pool, each step as soon as its dependencies are done
+
+    fn receives {dependency: result}. Returns (results, errors); a step whose
+    dependency failed is not run and is reported in errors as skipped.
+    """
+    results, errors = {}, {}
+    pending = dict(steps)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while pending or running:
+            progressed = False
+            for name, (dependencies, fn) in list(pending.items()):
+                failed = [dep for dep in dependencies if dep in errors]
+                if failed:
+                    errors[name] = f"skipped ({failed[0]} failed)"
+                elif all(dep in results for dep in dependencies):
+                    inputs = {dep: results[dep] for dep in dependencies}
+                    running[executor.submit(fn, inputs)] = name
+                else:
+                    continue
+                del pending[name]
+                progressed = True
+
+            if not running:
+                if progressed:
+                    continue
+                for name in pending:
+                    errors[name] = "unknown dependency"
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    errors[name] = str(e)
+
+    return results, errors
+
+
+def load_build_manifest(manifest_path):
+    """Read and validate a build manifest (raises ValueError)
+
+    Local source paths are resolved relative to the manifest file.
+    """
+    manifest_path = Path(manifest_path)
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    if not manifest.get('set'):
+        raise ValueError("manifest needs a 'set' id (e.g. \"tiktok/set4\")")
+    sources = manifest.get('sources') or {}
+    if not sources:
+        raise ValueError("manifest needs at least one entry in 'sources'")
+    for name, source in sources.items():
+        if bool(source.get('url')) == bool(source.get('path')):
+            raise ValueError(f"source '{name}' needs exactly one of 'url' or 'path'")
+        if source.get('path'):
+            source['path'] = str((manifest_path.parent / source['path']).resolve())
+
+    clips = manifest.get('clips') or []
+    if not clips:
+        raise ValueError("manifest needs at least one clip")
+    actions = set()
+    for clip in clips:
+        action = clip.get('action')
+        if not action or action in actions:
+            raise ValueError(f"every clip needs a unique 'action' (got {action!r})")
+        actions.add(action)
+        if clip.get('source') is None and len(sources) == 1:
+            clip['source'] = next(iter(sources))
+        if clip.get('source') not in sources:
+            raise ValueError(f"clip '{action}' refers to unknown source {clip.get('source')!r}")
+        if parse_timestamp(clip['end']) <= parse_timestamp(clip['start']):
+            raise ValueError(f"clip '{action}' ends before it starts")
+
+    manifest['encode'] = {**BUILD_ENCODE_DEFAULTS, **(manifest.get('encode') or {})}
+    return manifest
+
+
+def clip_file_name(clip):
+    return clip.get('file') or f"{clip['action']}.mp4"
+
+
+def encode_args(encode):
+    args = []
+    if encode.get('height'):
+        args += ["-vf", f"scale=-2:'min({int(encode['height'])},ih)'"]
+    args += ["-c:v", "libx264", "-preset", encode['preset'], "-crf", str(encode['crf']),
+             "-pix_fmt", "yuv420p", "-movflags", "+faststart"]
+    args += ["-c:a", "aac", "-b:a", "96k"] if encode.get('audio') else ["-an"]
+    return args
+
+
+def fetch_source(cache, name, source):
+    """Download (cached by URL) or hash a local source, returns {'path', 'sha256', 'cached'}"""
+    if source.get('path'):
+        path = Path(source['path'])
+        if not path.exists():
+            raise FileNotFoundError(f"source '{name}' not found: {path}")
+        return {'path': path, 'sha256': cache.content_hash(path), 'cached': True}
+
+    output = cache.path("sources", cache_key('download', source['url'], VIDEO_PREFERENCES['format']), ".mp4")
+
+    def download(tmp_path):
+        cmd = ["yt-dlp", "-q", "-f", VIDEO_PREFERENCES['format'],
+               "--merge-output-format", "mp4", "-o", str(tmp_path), source['url']]
+        subprocess.run(cmd, check=True, capture_output=True)
+
+    cached = cache.produce(output, download)
+    return {'path': output, 'sha256': cache.content_hash(output), 'cached': cached}
+
+
+def split_clip(cache, clip, source):
+    start = parse_timestamp(clip['start'])
+    duration = parse_timestamp(clip['end']) - start
+    output = cache.path("split", cache_key('split', source['sha256'], start, duration, SPLIT_ARGS), ".mp4")
+
+    def cut(tmp_path):
+        # -ss before -i seeks the input directly instead of decoding up to the start
+        run_ffmpeg(["-ss", f"{start:.3f}", "-i", str(source['path']), "-t", f"{duration:.3f}"]
+                   + SPLIT_ARGS + [str(tmp_path)])
+
+    return {'path': output, 'cached': cache.produce(output, cut)}
+
+
+def transcode_clip(cache, split, encode):
+    args = encode_args(encode)
+    key = cache_key('transcode', split['path'].stem, args)
+    output = cache.path("clips", key, ".mp4")
+
+    def encode_clip(tmp_path):
+        run_ffmpeg(["-i", str(split['path'])] + args + [str(tmp_path)])
+
+    return {'path': output, 'key': key, 'cached': cache.produce(output, encode_clip)}
+
+
+def probe_clip(cache, clip_artifact):
+    output = cache.path("probe", clip_artifact['key'], ".json")
+    if output.exists():
+        with open(output, encoding='utf-8') as f:
+            return {**json.load(f), 'cached': True}
+
+    info = probe_video(clip_artifact['path'])
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    os.replace(tmp_path, output)
+    return {**info, 'cached': False}
+
+
+def publish_clip(clip_artifact, output_file, published):
+    """Copy the built clip into the set directory unless it is already there"""
+    output_file = Path(output_file)
+    if published.get(output_file.name) == clip_artifact['key'] and output_file.exists():
+        return {'cached': True}
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_file.with_name(output_file.name + '.tmp')
+    shutil.copyfile(clip_artifact['path'], tmp_path)
+    os.replace(tmp_path, output_file)
+    return {'cached': False}
+
+
+def build_set_entry(manifest, probes):
+    """videosets.json entry for the manifest's set (see config/README.md)"""
+    set_id = manifest['set']
+    videos, commands, buttons = [], {}, []
+    specific, phrases = {}, {}
+
+    for clip in manifest['clips']:
+        action = clip['action']
+        file_name = clip_file_name(clip)
+        is_idle = bool(clip.get('idle'))
+        keywords = clip.get('keywords', [])
+        primary = clip.get('primaryKeyword') or (keywords[0] if keywords else None)
+        description = clip.get('description') or (
+            "Idle/anchor video - loops continuously" if is_idle
+            else f"{action.capitalize()} action - plays once then returns to idle")
+
+        videos.append({
+            'id': file_name,
+            'path': f"/videos/{set_id}/{file_name}",
+            'name': clip.get('name', action),
+            'description': description,
+            'duration': round(probes[action]['duration'], 1),
+            'isIdle': is_idle,
+            'tags': clip.get('tags') or (["idle", "anchor", "loop", action] if is_idle else ["action", action]),
+        })
+
+        if keywords:
+            commands[action] = {
+                'video': file_name,
+                'keywords': keywords,
+                'description': clip.get('commandDescription', f"{action.capitalize()} action"),
+                'primaryKeyword': primary,
+            }
+        if primary and clip.get('button', True):
+            buttons.append({
+                'label': primary,
+                'video': file_name,
+                'class': clip.get('buttonClass', "stop-btn" if is_idle else "circle-btn"),
+                'tooltip': clip.get('name', action),
+            })
+        if primary and clip.get('ack'):
+            url = f"/audio/{set_id}/{action}_zh.mp3"
+            specific[primary] = url
+            # "ack": true speaks the primary keyword, a string overrides the text
+            if clip['ack'] is not True and clip['ack'] != primary:
+                phrases[url] = clip['ack']
+
+    idle = next((video for video in videos if video['isIdle']), videos[0])
+    entry = {
+        'id': set_id,
+        'name': manifest.get('name', set_id),
+        'description': manifest.get('description', ''),
+        'videos': videos,
+        'defaultVideo': idle['id'],
+        'idleVideo': idle['id'],
+        'commands': commands,
+        'buttons': buttons,
+    }
+
+    if manifest.get('audioAck') is not None or specific:
+        audio_ack = {'enabled': True, 'volume': 0.7, **(manifest.get('audioAck') or {})}
+        audio_ack['specific'] = {**audio_ack.get('specific', {}), **specific}
+        if phrases or audio_ack.get('phrases'):
+            audio_ack['phrases'] = {**audio_ack.get('phrases', {}), **phrases}
+        entry['audioAck'] = audio_ack
+
+    return entry
+
+
+def deep_merge(base, update):
+    """update over base, merging nested dicts key by key"""
+    merged = dict(base)
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            value = deep_merge(merged[key], value)
+        merged[key] = value
+    return merged
+
+
+def merge_set_entry(existing, entry):
+    """The built set entry over the existing one, keeping keys the build does not generate
+
+    Videos are merged by id (e.g. the poster/preview generate_previews.py
+    adds), in the build's order; videos no longer in the manifest are dropped.
+    audioAck is merged key by key, so hand-added phrases and clips stay.
+    """
+    merged = {**existing, **entry}
+    if 'videos' in entry:
+        previous = {video.get('id'): video for video in existing.get('videos') or []}
+        merged['videos'] = [{**previous.get(video['id'], {}), **video} for video in entry['videos']]
+    if isinstance(entry.get('audioAck'), dict) and isinstance(existing.get('audioAck'), dict):
+        merged['audioAck'] = deep_merge(existing['audioAck'], entry['audioAck'])
+    return merged
+
+
+def update_config(config_path, set_id, entry):
+    """Merge the set entry into videosets.json, returns True if the file changed
+
+    Keys the build does not generate (e.g. hand-added fields) are kept, see
+    merge_set_entry().
+    """
+    config_path = Path(config_path)
+    with open(config_path, encoding='utf-8') as f:
+        config = json.load(f)
+
+    existing = config.setdefault('sets', {}).get(set_id, {})
+    merged = merge_set_entry(existing, entry)
+    if merged == existing:
+        return False
+
+    config['sets'][set_id] = merged
+    tmp_path = config_path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+    os.replace(tmp_path, config_path)
+    return True
+
+
+def build_video_set(manifest_path, output_dir="videos", config_path="config/videosets.json",
+                    cache_dir=BUILD_CACHE_DIR, workers=4):
+    """Build a video set from a manifest, rebuilding only what changed
+
+    Graph per clip: source -> split -> transcode -> (probe, publish); the
+    config entry waits for every probe. Returns True if every step succeeded.
+    """
+    started = time.time()
+    manifest = load_build_manifest(manifest_path)
+    set_id = manifest['set']
+    set_dir = Path(output_dir) / set_id
+    cache = BuildCache(cache_dir)
+
+    # Which build artifact each published file came from
+    state_path = set_dir / ".build.json"
+    published = {}
+    if state_path.exists():
+        with open(state_path, encoding='utf-8') as f:
+            published = json.load(f)
+
+    print(f"\n=== Building Video Set: {set_id} ===")
+    print(f"Clips: {len(manifest['clips'])} | sources: {len(manifest['sources'])} | cache: {cache.root}")
+
+    steps = {}
+    for name, source in manifest['sources'].items():
+        steps[f"source:{name}"] = ([], lambda _, name=name, source=source: fetch_source(cache, name, source))
+
+    for clip in manifest['clips']:
+        action = clip['action']
+        source_step = f"source:{clip['source']}"
+        steps[f"split:{action}"] = (
+            [source_step], lambda r, clip=clip, dep=source_step: split_clip(cache, clip, r[dep]))
+        steps[f"transcode:{action}"] = (
+            [f"split:{action}"],
+            lambda r, dep=f"split:{action}": transcode_clip(cache, r[dep], manifest['encode']))
+        steps[f"probe:{action}"] = (
+            [f"transcode:{action}"], lambda r, dep=f"transcode:{action}": probe_clip(cache, r[dep]))
+        steps[f"publish:{action}"] = (
+            [f"transcode:{action}"],
+            lambda r, dep=f"transcode:{action}", out=set_dir / clip_file_name(clip):
+                publish_clip(r[dep], out, published))
+
+    probe_steps = [f"probe:{clip['action']}" for clip in manifest['clips']]
+    steps["config"] = (probe_steps, lambda r: update_config(
+        config_path, set_id,
+        build_set_entry(manifest, {step.split(':', 1)[1]: r[step] for step in probe_steps})))
+
+    results, errors = run_graph(steps, workers=workers)
+    cache.save()
+
+    for name in steps:
+        if name in errors:
+            print(f"  ✗ {name} - {errors[name]}")
+        elif name == "config":
+            print(f"  ✓ config {'updated' if results[name] else 'unchanged'} ({config_path})")
+        elif not results[name]['cached']:
+            print(f"  ✓ {name}")
+
+    built = sum(1 for name, result in results.items() if name != "config" and not result['cached'])
+    cached = len(results) - built - (1 if "config" in results else 0)
+
+    for clip in manifest['clips']:
+        transcode = results.get(f"transcode:{clip['action']}")
+        if f"publish:{clip['action']}" in results:
+            published[clip_file_name(clip)] = transcode['key']
+    if published:
+        set_dir.mkdir(parents=True, exist_ok=True)
+        with open(state_path, 'w', encoding='utf-8') as f:
+            json.dump(published, f, indent=2, sort_keys=True)
+
+    print(f"\n=== Build {'Complete' if not errors else 'Failed'} ===")
+    print(f"Steps built: {built} | cached: {cached} | failed: {len(errors)} | "
+          f"{time.time() - started:.1f}s")
+    if not errors and any(clip.get('ack') for clip in manifest['clips']):
+        print("\nGenerate the acknowledgement clips with:")
+        print(f"  python generate_audio.py --set {set_id}")
+
+    return not errors
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -579,6 +1235,12 @@ Examples:
   # Download individual video
   python search_videos.py --action walking --download --url "https://youtube.com/watch?v=..." --set myset
 
+  # Download many videos at once (4 in parallel, resumable)
+  python search_videos.py --batch downloads.txt --workers 4 --fragments 8
+
+  # Build a set from a manifest (only changed clips are re-cut/re-encoded)
+  python search_videos.py --build skills/build_manifest.example.json --workers 8
+
 IMPORTANT: Video Sets
   - Videos should be grouped into cohesive sets (same person, background, style)
   - The BEST way to get cohesive sets is to find a multi-action source video
@@ -612,16 +1274,58 @@ IMPORTANT: Video Sets
                        help="Output directory for downloaded videos (default: videos)")
     parser.add_argument("--set", type=str, default="default",
                        help="Video set name (subdirectory for cohesive video sets, default: default)")
+    parser.add_argument("--no-dedup", action="store_true",
+                       help="Don't fingerprint results/downloads to skip near-duplicates")
+    parser.add_argument("--skip-duplicates", action="store_true",
+                       help="Skip (or remove) downloads that look like a video we already have instead of flagging them")
+    parser.add_argument("--build", type=str, metavar="MANIFEST",
+                       help="Build a video set from a manifest (download, split, transcode, probe, config)")
+    parser.add_argument("--config", type=str, default="config/videosets.json",
+                       help="Video set configuration updated by --build (default: config/videosets.json)")
+    parser.add_argument("--cache-dir", type=str, default=BUILD_CACHE_DIR,
+                       help=f"Build artifact cache for --build (default: {BUILD_CACHE_DIR})")
+    parser.add_argument("--workers", type=int, default=4,
+                       help="Parallel build steps for --build / parallel downloads for --batch (default: 4)")
+    parser.add_argument("--batch", type=str, metavar="FILE",
+                       help="Download every 'URL SET [ACTION]' line (or JSON entry) of FILE")
+    parser.add_argument("--fragments", type=int, default=batch_download.DEFAULT_FRAGMENTS,
+                       help=f"Fragments fetched concurrently per download for --batch "
+                            f"(default: {batch_download.DEFAULT_FRAGMENTS})")
 
     args = parser.parse_args()
 
+    # Build a set from a manifest (only needs yt-dlp when a source is a URL)
+    if args.build:
+        try:
+            manifest = load_build_manifest(args.build)
+        except (OSError, ValueError) as e:
+            print(f"Error: invalid manifest {args.build}: {e}")
+            sys.exit(1)
+        tools = ["ffmpeg", "ffprobe"]
+        if any(source.get('url') for source in manifest['sources'].values()):
+            tools.append("yt-dlp")
+        missing = [tool for tool in tools if shutil.which(tool) is None]
+        if missing:
+            print(f"Error: --build needs {', '.join(missing)} (see --help for install hints)")
+            sys.exit(1)
+        if not build_video_set(args.build, args.output_dir, args.config, args.cache_dir, args.workers):
+            sys.exit(1)
+        return
+
     # Check dependencies
     if not check_dependencies():
         sys.exit(1)
 
+    # Batch download
+    if args.batch:
+        if not download_batch(args.batch, args.output_dir, args.workers, args.fragments,
+                              skip_duplicates=args.skip_duplicates, dedup=not args.no_dedup):
+            sys.exit(1)
+        return
+
     # Search for multi-action source videos (RECOMMENDED)
     if args.search_source:
-        search_source_videos()
+        search_source_videos(dedup=not args.no_dedup, output_dir=args.output_dir)
         return
 
     # Download source video
@@ -631,7 +1335,8 @@ IMPORTANT: Video Sets
             sys.exit(1)
         if args.set == "default":
             print("Warning: Consider using --set <name> to create a new video set")
-        download_source_video(args.url, args.set, args.output_dir)
+        download_source_video(args.url, args.set, args.output_dir,
+                              skip_duplicates=args.skip_duplicates, dedup=not args.no_dedup)
         return
 
     # Split source video
@@ -643,7 +1348,8 @@ IMPORTANT: Video Sets
             print("Error: --timestamps is required for --split")
             print("Format: '0:00-0:05=idle,0:06-0:12=walk,0:13-0:18=jump'")
             sys.exit(1)
-        split_source_video(args.source, args.timestamps)
+        split_source_video(args.source, args.timestamps, index_dir=args.output_dir,
+                           dedup=not args.no_dedup)
         return
 
     # List actions
@@ -660,7 +1366,8 @@ IMPORTANT: Video Sets
 
     # Search for videos
     if args.preview_only or not args.url:
-        results = search_videos(args.action, preview_only=args.preview_only)
+        results = search_videos(args.action, preview_only=args.preview_only,
+                                dedup=not args.no_dedup, output_dir=args.output_dir)
 
         if not results:
             print("No suitable videos found. Try:")
@@ -681,7 +1388,8 @@ IMPORTANT: Video Sets
             print("First search for videos, then download with --url")
             sys.exit(1)
 
-        download_video(args.url, args.action, args.output_dir, args.set)
+        download_video(args.url, args.action, args.output_dir, args.set,
+                       skip_duplicates=args.skip_duplicates, dedup=not args.no_dedup)
 
 
 if __name__ == "__main__":
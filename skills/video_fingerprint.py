@@ -0,0 +1,278 @@
+"""
+Perceptual fingerprints for near-duplicate video detection
+==========================================================
+
+Re-uploads, mirrors and re-encodes of the same reel differ byte for byte but
+look the same. Each image is reduced to a 64-bit difference hash (dHash): ffmpeg
+scales it to 9x8 grayscale and every bit records whether a pixel is brighter
+than its right neighbour. Similar images have hashes a few bits apart.
+
+- thumbnails (search results):  one hash, no video download needed
+- videos (downloads, clips):    FRAME_SAMPLES hashes from evenly spaced frames,
+                                decoded in a single ffmpeg pass
+
+Videos already on disk are kept in an index (<videos dir>/.fingerprints.json)
+that is refreshed incrementally by (size, mtime). Lookups are a linear scan
+comparing hashes by Hamming distance (XOR + popcount on Python ints), which is
+ample for a local library of a few hundred videos.
+
+Clips of one set show the same performer in the same room, so a single
+thumbnail hash easily lands near one of their frames: thumbnails are matched
+against the index with the tighter THUMBNAIL_DISTANCE, and only against
+videos of about the same duration when it is known.
+
+Requirements:
+- ffmpeg / ffprobe
+"""
+
+import json
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+INDEX_NAME = ".fingerprints.json"
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".webm", ".mkv")
+# Derived copies of the clips (generate_previews.py), not videos of their own
+DERIVED_DIRS = ("posters", "previews")
+
+HASH_WIDTH = 9
+HASH_HEIGHT = 8
+FRAME_BYTES = HASH_WIDTH * HASH_HEIGHT
+
+# Frames sampled per video
+FRAME_SAMPLES = 8
+# Max differing bits (of 64) for two frames/thumbnails to count as the same image
+FRAME_DISTANCE = 10
+# Max differing bits for a single thumbnail to match a frame of an indexed video
+THUMBNAIL_DISTANCE = 4
+# Fraction of a video's sampled frames that must match for a near-duplicate
+MATCH_RATIO = 0.75
+# Durations must agree within this many seconds (or this fraction of the longer one)
+DURATION_TOLERANCE = 1.0
+DURATION_TOLERANCE_RATIO = 0.05
+
+
+# int.bit_count is Python 3.10+
+_popcount = getattr(int, "bit_count", None) or (lambda value: bin(value).count("1"))
+
+
+def hamming(a, b):
+    return _popcount(a ^ b)
+
+
+def dhash_frames(raw):
+    """64-bit difference hashes of consecutive 9x8 grayscale frames"""
+    hashes = []
+    for offset in range(0, len(raw) - FRAME_BYTES + 1, FRAME_BYTES):
+        frame = raw[offset:offset + FRAME_BYTES]
+        value = 0
+        for row in range(HASH_HEIGHT):
+            pixels = frame[row * HASH_WIDTH:(row + 1) * HASH_WIDTH]
+            for left, right in zip(pixels, pixels[1:]):
+                value = (value << 1) | (left > right)
+        hashes.append(value)
+    return hashes
+
+
+def _decode_hash_frames(source, filters, max_frames):
+    scale = f"scale={HASH_WIDTH}:{HASH_HEIGHT}:flags=area,format=gray"
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-i", str(source),
+           "-vf", ",".join(filters + [scale]), "-frames:v", str(max_frames),
+           "-f", "rawvideo", "pipe:1"]
+    result = subprocess.run(cmd, capture_output=True, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg could not decode {source}: "
+                           f"{result.stderr.decode(errors='replace').strip()[-200:]}")
+    return dhash_frames(result.stdout)
+
+
+def image_hash(source):
+    """dHash of an image file or URL (e.g. a search result thumbnail)"""
+    hashes = _decode_hash_frames(source, [], 1)
+    if not hashes:
+        raise RuntimeError(f"no image in {source}")
+    return hashes[0]
+
+
+def video_duration(path):
+    """Duration in seconds (0.0 if ffprobe fails); RuntimeError if its output makes no sense"""
+    cmd = ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", str(path)]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        return 0.0
+    try:
+        return float(json.loads(result.stdout).get("format", {}).get("duration", 0) or 0)
+    except (ValueError, TypeError, AttributeError) as e:
+        raise RuntimeError(f"unreadable ffprobe output for {path}: {e}") from None
+
+
+def video_hashes(path, samples=FRAME_SAMPLES, duration=None):
+    """dHashes of `samples` evenly spaced frames of a video"""
+    if duration is None:
+        duration = video_duration(path)
+    filters = [f"fps={samples / duration:.6f}"] if duration > 0 else []
+    hashes = _decode_hash_frames(path, filters, samples)
+    if not hashes:
+        raise RuntimeError(f"no frames decoded from {path}")
+    return hashes
+
+
+def match_ratio(query, hashes, max_distance=FRAME_DISTANCE):
+    """Fraction of query hashes that have a hash within max_distance in hashes"""
+    if not query or not hashes:
+        return 0.0
+    matched = sum(1 for q in query if any(hamming(q, h) <= max_distance for h in hashes))
+    return matched / len(query)
+
+
+def durations_match(a, b):
+    """True if two durations are about the same (or either is unknown)"""
+    if not a or not b:
+        return True
+    return abs(a - b) <= max(DURATION_TOLERANCE, DURATION_TOLERANCE_RATIO * max(a, b))
+
+
+class FingerprintIndex:
+    """Frame hashes of every video under a directory, persisted as JSON
+
+    Entries are keyed by path relative to the root and refreshed by (size, mtime),
+    so only new or changed files are decoded again.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.path = self.root / INDEX_NAME
+        self._lock = threading.Lock()
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as f:
+                self.entries = json.load(f).get("videos", {})
+
+    def _relpath(self, path):
+        path = Path(path).resolve()
+        try:
+            return path.relative_to(self.root.resolve()).as_posix()
+        except ValueError:
+            return str(path)
+
+    def add(self, path, hashes=None):
+        """Fingerprint a video (unless hashes are given) and record it, returns the hashes"""
+        path = Path(path)
+        duration = video_duration(path)
+        if hashes is None:
+            hashes = video_hashes(path, duration=duration)
+        stat = path.stat()
+        with self._lock:
+            self.entries[self._relpath(path)] = {
+                "stamp": [stat.st_size, stat.st_mtime_ns],
+                "duration": round(duration, 2),
+                "hashes": [f"{value:016x}" for value in hashes],
+            }
+        return hashes
+
+    def duration(self, path):
+        """Recorded duration of an indexed video in seconds (None if unknown)"""
+        with self._lock:
+            return self.entries.get(self._relpath(path), {}).get("duration") or None
+
+    def remove(self, path):
+        with self._lock:
+            self.entries.pop(self._relpath(path), None)
+
+    def refresh(self, workers=4):
+        """Index new or changed videos under the root and drop deleted ones"""
+        current = {}
+        for path in self.root.rglob("*"):
+            if path.suffix.lower() in VIDEO_EXTENSIONS and not any(
+                    part.startswith(".") or part in DERIVED_DIRS
+                    for part in path.relative_to(self.root).parts):
+                current[self._relpath(path)] = path
+
+        with self._lock:
+            for relpath in set(self.entries) - set(current):
+                del self.entries[relpath]
+            # Entries from before durations were recorded are refreshed too
+            stale = [path for relpath, path in current.items()
+                     if self.entries.get(relpath, {}).get("stamp") !=
+                     [path.stat().st_size, path.stat().st_mtime_ns]
+                     or "duration" not in self.entries[relpath]]
+
+        if stale:
+            print(f"Fingerprinting {len(stale)} video(s) under {self.root}/ ...")
+
+            def add_quietly(path):
+                # One unreadable or vanished file must not abort the refresh
+                try:
+                    self.add(path)
+                except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+                    print(f"  ✗ {path}: {e}")
+
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+                list(executor.map(add_quietly, stale))
+        return len(stale)
+
+    def find(self, hashes, exclude=(), min_ratio=MATCH_RATIO, max_distance=FRAME_DISTANCE, duration=None):
+        """Best (relpath, ratio) whose frames match at least min_ratio of hashes, or None
+
+        With a duration, only videos of about the same duration are compared.
+        """
+        excluded = {self._relpath(path) for path in exclude}
+        best = None
+        with self._lock:
+            entries = [(relpath, [int(value, 16) for value in entry["hashes"]])
+                       for relpath, entry in self.entries.items()
+                       if relpath not in excluded and durations_match(duration, entry.get("duration"))]
+        for relpath, indexed in entries:
+            ratio = match_ratio(hashes, indexed, max_distance)
+            if ratio >= min_ratio and (best is None or ratio > best[1]):
+                best = (relpath, ratio)
+        return best
+
+    def save(self):
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"hash": "dhash64", "videos": self.entries}, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+
+def mark_duplicate_results(results, index=None, workers=8):
+    """Flag search results whose thumbnails are near-duplicates
+
+    Results must be sorted best-first; a result that looks like an earlier one
+    gets 'duplicate_of' (that result's URL), and one that looks like a video
+    already in the index gets 'local_match' (its relative path). Results
+    without a usable thumbnail are left as they are.
+    """
+    def thumbnail_hash(result):
+        if not result.get("thumbnail"):
+            return None
+        try:
+            return image_hash(result["thumbnail"])
+        except (RuntimeError, subprocess.TimeoutExpired):
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        hashes = list(executor.map(thumbnail_hash, results))
+
+    kept = []
+    for result, value in zip(results, hashes):
+        if value is None:
+            continue
+        for earlier, earlier_value in kept:
+            if hamming(value, earlier_value) <= FRAME_DISTANCE:
+                result["duplicate_of"] = earlier["url"]
+                break
+        else:
+            kept.append((result, value))
+            if index is not None:
+                # A thumbnail is usually one frame of the video: one close frame of a video
+                # of the same length is enough
+                match = index.find([value], min_ratio=1.0, max_distance=THUMBNAIL_DISTANCE,
+                                   duration=result.get("duration"))
+                if match:
+                    result["local_match"] = match[0]
+    return results
@@ -16,6 +16,7 @@ class VoiceVideoController {
         this.listeningStatus = document.querySelector('.listening-status');
 
         this.recognition = null;
+        this.stopServerRecognition = null; // Set while server-side ASR is streaming
         this.isListening = false;
         this.queuedVideo = null;
         this.isVideoPlaying = false;
@@ -28,6 +29,13 @@ class VoiceVideoController {
 
         // Preloaded video elements for smooth switching
         this.preloadedVideos = {};
+        // Poster frames / low-res previews of the current set's clips (video id -> {poster, preview})
+        this.videoPreviews = {};
+        this.fullLoads = {}; // In-flight full clip loads (video id -> promise)
+        // Server-learned likely next clips (clip id or '_start' -> [clip ids])
+        this.likelyNext = {};
+        // Save-data / slow network / low memory: preload only the clips likely to play
+        this.constrainedDevice = this.detectConstrainedDevice();
 
         // Configuration loader
         this.configLoader = new ConfigLoader();
@@ -84,8 +92,11 @@ class VoiceVideoController {
             // Convert to legacy format for backward compatibility
             this.videoSets = this.configLoader.convertToLegacyFormat();
 
-            // Get default video set
-            this.currentSet = this.configLoader.getDefaultSet();
+            // ?set=<id> picks the start set (the server preloads the same one), else the default
+            const requestedSet = new URLSearchParams(window.location.search).get('set');
+            this.currentSet = requestedSet && this.configLoader.getVideoSets()[requestedSet]
+                ? requestedSet
+                : this.configLoader.getDefaultSet();
 
             console.log('Configuration loaded, initializing with set:', this.currentSet);
 
@@ -148,6 +159,8 @@ class VoiceVideoController {
         this.commandMap = config.commands;
         this.currentVideo = config.defaultVideo;
         this.idleVideo = config.idleVideo; // Store the idle/anchor video
+        this.videoPreviews = config.previews || {};
+        this.likelyNext = config.likelyNext || {};
 
         // Load conversation config if available
         if (config.conversation) {
@@ -241,12 +254,22 @@ class VoiceVideoController {
                         // Ensure queued video is ready
                         if (!this.preloadedVideos[this.queuedVideo]) {
                             console.log('Emergency preload of queued video');
+                            // Paint its poster instead of a blank frame if it is not ready in time
+                            this.inactivePlayer.poster = this.posterUrl(this.queuedVideo);
+                            const previewUrl = this.previewUrl(this.queuedVideo);
                             const video = document.createElement('video');
                             video.preload = 'auto';
-                            video.src = `/videos/${this.currentSet}/${this.queuedVideo}`;
+                            video.src = previewUrl || this.videoUrl(this.queuedVideo);
                             video.muted = true;
                             video.load();
                             this.preloadedVideos[this.queuedVideo] = video;
+                            if (previewUrl) {
+                                // The few-KB preview plays now, the full clip next time
+                                video.isPreview = true;
+                                this.preloadFullVideo(this.queuedVideo).catch(err => {
+                                    console.error(`Error preloading ${this.queuedVideo}:`, err);
+                                });
+                            }
                         }
                     }
                 }
@@ -344,12 +367,15 @@ class VoiceVideoController {
 
         // Reset video players and preloaded videos
         this.preloadedVideos = {};
+        this.fullLoads = {};
         this.queuedVideo = null;
         this.queuedVideoEl.textContent = '-';
 
         // Reset audio
         this.preloadedAudio = {};
 
+        this.activePlayer.poster = this.posterUrl(this.currentVideo);
+        this.inactivePlayer.poster = this.posterUrl(this.currentVideo);
         this.activePlayer.src = `/videos/${this.currentSet}/${this.currentVideo}`;
         this.inactivePlayer.src = `/videos/${this.currentSet}/${this.currentVideo}`;
         this.activePlayer.load();
@@ -399,6 +425,7 @@ class VoiceVideoController {
                 const isSpecialCommand = videoConfig && videoConfig.returnToPrevious;
 
                 this.queueVideoSwitch(video, isSpecialCommand);
+                this.recordCommand(video);
             });
         });
     }
@@ -415,50 +442,171 @@ class VoiceVideoController {
         ).join('');
     }
 
+    videoUrl(videoFile) {
+        return `/videos/${this.currentSet}/${videoFile}`;
+    }
+
+    posterUrl(videoFile) {
+        const media = this.videoPreviews[videoFile];
+        return (media && media.poster) || '';
+    }
+
+    previewUrl(videoFile) {
+        const media = this.videoPreviews[videoFile];
+        return (media && media.preview) || null;
+    }
+
+    loadVideoElement(src) {
+        return new Promise((resolve, reject) => {
+            const video = document.createElement('video');
+            video.preload = 'auto';
+            video.muted = true;
+            video.src = src;
+
+            const onLoadedData = () => {
+                video.removeEventListener('loadeddata', onLoadedData);
+                video.removeEventListener('error', onError);
+                resolve(video);
+            };
+
+            const onError = (e) => {
+                video.removeEventListener('loadeddata', onLoadedData);
+                video.removeEventListener('error', onError);
+                reject(e);
+            };
+
+            video.addEventListener('loadeddata', onLoadedData);
+            video.addEventListener('error', onError);
+
+            // Start loading
+            video.load();
+        });
+    }
+
+    preloadFullVideo(videoFile) {
+        if (!this.fullLoads[videoFile]) {
+            const set = this.currentSet;
+            this.fullLoads[videoFile] = this.loadVideoElement(this.videoUrl(videoFile)).then(video => {
+                // Ignore clips of a set we switched away from while they were loading
+                if (set === this.currentSet) {
+                    this.preloadedVideos[videoFile] = video;
+                    console.log(`Preloaded: ${set}/${videoFile}`);
+                }
+                return video;
+            }, err => {
+                delete this.fullLoads[videoFile];
+                throw err;
+            });
+        }
+        return this.fullLoads[videoFile];
+    }
+
+    async preloadPreview(videoFile) {
+        const previewUrl = this.previewUrl(videoFile);
+        if (!previewUrl) {
+            return this.preloadFullVideo(videoFile);
+        }
+
+        const set = this.currentSet;
+        try {
+            const video = await this.loadVideoElement(previewUrl);
+            if (set === this.currentSet && !this.preloadedVideos[videoFile]) {
+                video.isPreview = true;
+                this.preloadedVideos[videoFile] = video;
+                console.log(`Preview preloaded: ${set}/${videoFile}`);
+            }
+            return video;
+        } catch (e) {
+            console.warn(`Preview of ${videoFile} not available, loading the full clip`);
+            return this.preloadFullVideo(videoFile);
+        }
+    }
+
     async preloadVideos() {
         // Ensure preloadedVideos is initialized
         if (!this.preloadedVideos) {
             this.preloadedVideos = {};
         }
 
-        const preloadPromises = this.videoFiles.map(videoFile => {
-            return new Promise((resolve, reject) => {
-                const video = document.createElement('video');
-                video.preload = 'auto';
-                video.src = `/videos/${this.currentSet}/${videoFile}`;
-
-                const onLoadedData = () => {
-                    video.removeEventListener('loadeddata', onLoadedData);
-                    video.removeEventListener('error', onError);
-                    this.preloadedVideos[videoFile] = video;
-                    console.log(`Preloaded: ${this.currentSet}/${videoFile}`);
-                    resolve();
-                };
-
-                const onError = (e) => {
-                    video.removeEventListener('loadeddata', onLoadedData);
-                    video.removeEventListener('error', onError);
-                    console.error(`Error preloading ${videoFile}:`, e);
-                    reject(e);
-                };
+        // Constrained devices start with the idle clip and the clips usually commanded first
+        const videoFiles = this.constrainedDevice ? this.initialClips() : this.videoFiles;
+        if (this.constrainedDevice) {
+            console.log('Constrained device, preloading only:', videoFiles);
+        }
 
-                video.addEventListener('loadeddata', onLoadedData);
-                video.addEventListener('error', onError);
-
-                // Start loading
-                video.load();
-            });
-        });
+        // Clips with a generated preview are ready to switch to after a few KB each
+        const preloadPromises = videoFiles.map(videoFile => this.preloadPreview(videoFile));
 
         try {
             await Promise.all(preloadPromises);
         } catch (err) {
             console.error('Error preloading videos:', err);
         }
+        if (this.constrainedDevice) {
+            // Full clips load when they are played
+            return;
+        }
+
+        // Then upgrade to the full clips in the background
+        this.videoFiles
+            .filter(videoFile => this.preloadedVideos[videoFile] && this.preloadedVideos[videoFile].isPreview)
+            .forEach(videoFile => {
+                this.preloadFullVideo(videoFile).catch(err => {
+                    console.error(`Error preloading ${videoFile}:`, err);
+                });
+            });
+    }
+
+    detectConstrainedDevice() {
+        const connection = navigator.connection || {};
+        return Boolean(connection.saveData)
+            || ['slow-2g', '2g', '3g'].includes(connection.effectiveType)
+            || (navigator.deviceMemory !== undefined && navigator.deviceMemory <= 2);
+    }
+
+    initialClips() {
+        const likely = this.likelyNext._start || this.likelyNext[this.idleVideo] || [];
+        return [this.idleVideo, ...likely]
+            .filter((videoFile, index, all) => this.videoFiles.includes(videoFile) && all.indexOf(videoFile) === index);
+    }
+
+    /**
+     * Prefetch the clips the server expects next ([{video, p}], most likely first)
+     */
+    prefetchLikely(next) {
+        if (!next || next.length === 0) {
+            return;
+        }
+        next.slice(0, this.constrainedDevice ? 2 : 3)
+            .map(entry => entry.video)
+            .filter(videoFile => this.videoFiles.includes(videoFile) && !this.preloadedVideos[videoFile])
+            .forEach(videoFile => {
+                console.log(`Prefetching likely next clip: ${videoFile}`);
+                this.preloadPreview(videoFile).then(() => {
+                    if (!this.constrainedDevice) {
+                        return this.preloadFullVideo(videoFile);
+                    }
+                }).catch(err => console.error(`Error prefetching ${videoFile}:`, err));
+            });
+    }
+
+    /**
+     * Tell the server a clip was commanded by voice or button (it learns the set's transitions)
+     */
+    recordCommand(videoFile) {
+        if (!this.dashscopeClient) {
+            return;
+        }
+        this.dashscopeClient.recordIntent(this.currentSet, videoFile)
+            .then(next => this.prefetchLikely(next));
     }
 
     getRecognitionMode() {
-        return 'browser'; // Always use browser recognition
+        // 'server' streams microphone audio to /ws for server-side ASR + VAD endpointing
+        if (this.recognitionSettings.engine === 'server' && this.dashscopeClient) {
+            return 'server';
+        }
+        return 'browser';
     }
 
     startListening() {
@@ -468,7 +616,11 @@ class VoiceVideoController {
         this.isRestarting = false;
         this.recognitionRetryCount = 0;
 
-        this.startBrowserRecognition();
+        if (this.getRecognitionMode() === 'server') {
+            this.startServerRecognition();
+        } else {
+            this.startBrowserRecognition();
+        }
         this.isListening = true;
         this.startBtn.style.display = 'none';
         this.stopBtn.style.display = 'inline-block';
@@ -493,6 +645,11 @@ class VoiceVideoController {
             this.recognition = null;
         }
 
+        if (this.stopServerRecognition) {
+            this.stopServerRecognition();
+            this.stopServerRecognition = null;
+        }
+
         // Clear any pending timeouts
         if (this.recognitionTimeout) {
             clearTimeout(this.recognitionTimeout);
@@ -510,6 +667,50 @@ class VoiceVideoController {
         this.updateListeningIndicator('idle', '待机');
     }
 
+    async startServerRecognition() {
+        try {
+            this.stopServerRecognition = await this.dashscopeClient.startSpeechInput({
+                commands: this.commandMap,
+                onPartial: (text) => {
+                    // Microphone stays open during TTS; ignore our own voice
+                    if (this.isTalking) return;
+                    this.recognizedEl.textContent = text + ' (...)';
+                    this.updateListeningIndicator('listening', '识别中...');
+                },
+                onIntent: (command, video, text) => {
+                    // Server matched a command keyword in a partial transcript
+                    if (this.isTalking) {
+                        this.interruptConversation();
+                    }
+                    const commandConfig = this.configLoader.getCommandByKeyword(this.currentSet, command);
+                    this.recognizedEl.textContent = `✓ ${text}`;
+                    this.updateButtonPressedState(text);
+                    this.updateIntentDisplay(commandConfig);
+                    this.queueVideoSwitch(video, commandConfig && commandConfig.returnToPrevious);
+                    this.recordCommand(video);
+                    this.playAcknowledgement(command, true);
+                    this.updateListeningIndicator('listening', '✓ 匹配成功');
+                },
+                onFinal: (text, command) => {
+                    if (command || this.isTalking) return;
+                    this.recognizedEl.textContent = `✗ ${text}`;
+                    this.updateButtonPressedState(text);
+                    if (this.conversationEnabled) {
+                        this.startConversation(text);
+                    } else {
+                        this.playAcknowledgement(text, false);
+                    }
+                },
+                onError: () => {
+                    this.updateListeningIndicator('error', '⚠️ 识别错误');
+                }
+            });
+        } catch (e) {
+            console.error('Server recognition unavailable, using browser recognition:', e);
+            this.startBrowserRecognition();
+        }
+    }
+
     startBrowserRecognition() {
         if (!('webkitSpeechRecognition' in window) && !('SpeechRecognition' in window)) {
             alert('浏览器不支持语音识别。请使用 Chrome 或 Edge 浏览器。');
@@ -888,6 +1089,7 @@ class VoiceVideoController {
             this.updateIntentDisplay(commandConfig);
 
             this.queueVideoSwitch(firstMatch.video, isSpecialCommand);
+            this.recordCommand(firstMatch.video);
             this.playAcknowledgement(firstMatch.command, true);
             return true;
         }
@@ -1015,16 +1217,29 @@ class VoiceVideoController {
 
         // Use preloaded video if available, otherwise load it
         const preloadedVideo = this.preloadedVideos[videoToPlay];
+        this.inactivePlayer.poster = this.posterUrl(videoToPlay);
 
         if (preloadedVideo) {
-            console.log('Using preloaded video');
+            console.log(preloadedVideo.isPreview ? 'Using preloaded preview' : 'Using preloaded video');
             // Clone the preloaded video source to the inactive player
             this.inactivePlayer.src = preloadedVideo.src;
             this.inactivePlayer.load();
+            if (preloadedVideo.isPreview) {
+                // Full clip for the next time it plays
+                this.preloadFullVideo(videoToPlay).catch(err => {
+                    console.error(`Error preloading ${videoToPlay}:`, err);
+                });
+            }
         } else {
-            console.log('Loading video on demand');
-            this.inactivePlayer.src = `/videos/${this.currentSet}/${videoToPlay}`;
+            const previewUrl = this.previewUrl(videoToPlay);
+            console.log(previewUrl ? 'Loading preview on demand' : 'Loading video on demand');
+            this.inactivePlayer.src = previewUrl || this.videoUrl(videoToPlay);
             this.inactivePlayer.load();
+            if (previewUrl) {
+                this.preloadFullVideo(videoToPlay).catch(err => {
+                    console.error(`Error preloading ${videoToPlay}:`, err);
+                });
+            }
         }
 
         // Wait for the new video to be ready
@@ -1093,6 +1308,11 @@ class VoiceVideoController {
             } else if (this.currentVideo === this.idleVideo) {
                 // Loop the idle video
                 console.log('Looping idle video:', this.idleVideo);
+                const fullVideo = this.preloadedVideos[this.idleVideo];
+                if (fullVideo && !fullVideo.isPreview && this.activePlayer.currentSrc !== fullVideo.src) {
+                    // The first loops played the preview; continue with the full clip
+                    this.activePlayer.src = fullVideo.src;
+                }
                 this.activePlayer.currentTime = 0;
                 this.activePlayer.play().catch(() => {
                     console.error('Error looping idle video');
@@ -1155,6 +1375,7 @@ class VoiceVideoController {
             continuous: true, // Always true for streaming mode
             interimResults: true,
             language: 'zh-CN',
+            engine: 'browser', // 'browser' (Web Speech API) or 'server' (streaming ASR over /ws)
             maxAlternatives: 10,
             confidenceThreshold: 0.3
         };
@@ -1285,9 +1506,12 @@ class VoiceVideoController {
 
         console.log('Audio files to preload:', audioFiles);
 
+        // Ask for the compact Opus copy where the browser can play it (server falls back to mp3)
+        const canPlayOpus = new Audio().canPlayType('audio/ogg; codecs=opus') !== '';
+
         const preloadPromises = audioFiles.map(audioFile => {
             return new Promise((resolve, reject) => {
-                const audio = new Audio(audioFile);
+                const audio = new Audio(canPlayOpus ? `${audioFile}?format=opus` : audioFile);
                 audio.preload = 'auto';
                 audio.volume = this.audioAckVolume;
 
@@ -1444,6 +1668,17 @@ class VoiceVideoController {
             <h3>⚙️ 语音识别设置</h3>
 
             <div class="settings-grid">
+                <div class="setting-item">
+                    <label>
+                        识别引擎:
+                        <select id="recognitionEngine">
+                            <option value="browser" selected>浏览器</option>
+                            <option value="server">服务器 (流式)</option>
+                        </select>
+                    </label>
+                    <span class="setting-hint">服务器识别延迟不依赖浏览器</span>
+                </div>
+
                 <div class="setting-item">
                     <label>
                         语言:
@@ -1514,6 +1749,7 @@ class VoiceVideoController {
         });
 
         // Add event listeners
+        const engineSelect = document.getElementById('recognitionEngine');
         const languageSelect = document.getElementById('recognitionLanguage');
         const continuousMode = document.getElementById('continuousMode');
         const interimResults = document.getElementById('interimResults');
@@ -1524,6 +1760,7 @@ class VoiceVideoController {
         const confidenceThresholdValue = document.getElementById('confidenceThresholdValue');
 
         // Set initial values from saved settings
+        engineSelect.value = this.recognitionSettings.engine;
         languageSelect.value = this.recognitionSettings.language;
         continuousMode.checked = true; // Always true for streaming mode
         interimResults.checked = this.recognitionSettings.interimResults;
@@ -1533,6 +1770,16 @@ class VoiceVideoController {
         confidenceThreshold.value = this.recognitionSettings.confidenceThreshold;
         confidenceThresholdValue.textContent = this.recognitionSettings.confidenceThreshold.toFixed(2);
 
+        engineSelect.addEventListener('change', (e) => {
+            this.recognitionSettings.engine = e.target.value;
+            this.saveRecognitionSettings();
+            console.log('Recognition engine changed to:', e.target.value);
+            if (this.isListening) {
+                this.stopListening();
+                setTimeout(() => this.startListening(), 300);
+            }
+        });
+
         languageSelect.addEventListener('change', (e) => {
             this.recognitionSettings.language = e.target.value;
             this.saveRecognitionSettings();
@@ -1774,8 +2021,9 @@ class VoiceVideoController {
                         }
                     },
                     // onComplete - called when streaming finishes
-                    onComplete: async (response) => {
+                    onComplete: async (response, done) => {
                         console.log('LLM complete, full response:', response);
+                        this.prefetchLikely(done && done.next);
 
                         // If video has pre-recorded audio, skip TTS synthesis
                         if (hasAudioVideo) {
@@ -1810,7 +2058,7 @@ class VoiceVideoController {
                                 this.updateListeningIndicator('processing', '🔊 合成语音...');
                                 console.log('Calling synthesizeSpeech with text:', response);
 
-                                const audioBlob = await this.dashscopeClient.synthesizeSpeech(response);
+                                const audioBlob = await this.dashscopeClient.synthesizeSpeech(response, this.currentSet);
                                 console.log('TTS synthesis complete, blob size:', audioBlob.size, 'type:', audioBlob.type);
 
                                 // Play TTS audio
@@ -1894,7 +2142,8 @@ class VoiceVideoController {
                         }, 2000);
                     },
                     // Pass available actions for function calling
-                    actions: this.conversationActions
+                    actions: this.conversationActions,
+                    setId: this.currentSet
                 }
             );
 
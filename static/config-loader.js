@@ -227,7 +227,13 @@ class ConfigLoader {
                     specific: {},
                     error: null
                 },
-                conversation: setConfig.conversation || null  // Include conversation config
+                conversation: setConfig.conversation || null,  // Include conversation config
+                // Poster frames / low-res previews from generate_previews.py (video id -> URLs)
+                previews: Object.fromEntries(setConfig.videos
+                    .filter(v => v.poster || v.preview)
+                    .map(v => [v.id, { poster: v.poster || null, preview: v.preview || null }])),
+                // Server-learned transitions: clip id (or '_start') -> likely next clip ids
+                likelyNext: setConfig.likelyNext || {}
             };
         }
 
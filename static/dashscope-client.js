@@ -2,12 +2,34 @@
  * DashScope Client for streaming LLM chat and TTS
  * Handles communication with Flask backend proxy
  */
+
+// Reconnects of a dropped /api/chat/stream reply (backoff grows per attempt)
+const CHAT_RESUME_ATTEMPTS = 3;
+const CHAT_RESUME_DELAY_MS = 500;
+
 class DashScopeClient {
     constructor() {
         this.baseUrl = window.location.origin;
         this.sessionId = this.generateSessionId();
         this.isStreaming = false;
         this.currentEventSource = null;
+        this.streamCounter = 0;
+        this.abortController = null; // Aborts the HTTP stream (server cancels the upstream call)
+        this.activeSocketTurn = null;
+
+        // WebSocket duplex channel (chat events + TTS audio on one connection)
+        this.socket = null;
+        this.socketReady = null;
+        this.socketUnavailable = !('WebSocket' in window);
+        this.turnCounter = 0;
+        this.turnHandlers = {};
+        this.audioChannels = {};
+        this.speechWaiters = {};
+        this.pendingSpeech = null;
+        this.audioAckEvery = 8; // Grant flow-control credit every N audio frames
+
+        // Compact Opus replies where the browser can play them, mp3 otherwise
+        this.audioFormat = new Audio().canPlayType('audio/ogg; codecs=opus') !== '' ? 'opus' : 'mp3';
     }
 
     generateSessionId() {
@@ -23,18 +45,28 @@ class DashScopeClient {
      * @param {function} options.onComplete - Callback when streaming completes
      * @param {function} options.onError - Callback for errors
      * @param {array} options.actions - Available actions for function calling
+     * @param {string} options.setId - Current video set (the server learns its clip transitions)
      */
     async streamChat(message, options) {
         const { onChunk, onFunctionCall, onComplete, onError, actions } = options;
         if (this.isStreaming) {
-            console.warn('Already streaming, ignoring new request');
-            return;
+            // A new message supersedes the reply in progress (the server drops it too)
+            console.log('New message while streaming, cancelling the current reply');
+            this.stopStreaming({ notifyServer: false });
         }
 
+        const streamId = ++this.streamCounter;
         this.isStreaming = true;
-        let fullResponse = '';
+        const state = { fullResponse: '' };
 
         try {
+            // Prefer the WebSocket channel: one connection, TTS audio pushed with the reply
+            const socket = await this.connectSocket();
+            if (socket) {
+                await this.streamChatOverSocket(socket, message, options, state);
+                return;
+            }
+
             // Use EventSource for Server-Sent Events
             const url = `${this.baseUrl}/api/chat/stream`;
 
@@ -48,102 +80,467 @@ class DashScopeClient {
             if (actions && actions.length > 0) {
                 requestBody.actions = actions;
             }
-
-            const response = await fetch(url, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify(requestBody)
-            });
-
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
+            if (options.setId) {
+                requestBody.set_id = options.setId;
             }
 
-            const reader = response.body.getReader();
-            const decoder = new TextDecoder();
-
+            // A dropped connection resumes the same reply after the last event seen
+            // (Last-Event-ID), so the server neither regenerates it nor duplicates history
+            const cursor = { lastEventId: null, finished: false };
+            let resumes = 0;
+            const abortController = new AbortController();
+            this.abortController = abortController;
             while (true) {
-                const { done, value } = await reader.read();
-
-                if (done) {
-                    break;
+                const headers = { 'Content-Type': 'application/json' };
+                if (cursor.lastEventId) {
+                    headers['Last-Event-ID'] = cursor.lastEventId;
                 }
+                try {
+                    const response = await fetch(url, {
+                        method: 'POST',
+                        headers,
+                        body: JSON.stringify(requestBody),
+                        signal: abortController.signal
+                    });
 
-                // Decode the chunk
-                const chunk = decoder.decode(value, { stream: true });
-
-                // Parse SSE format (data: {...}\n\n)
-                const lines = chunk.split('\n');
-
-                for (const line of lines) {
-                    if (line.startsWith('data: ')) {
-                        try {
-                            const data = JSON.parse(line.substring(6));
-
-                            if (data.type === 'text') {
-                                fullResponse += data.content;
-                                if (onChunk) {
-                                    onChunk(data.content, fullResponse);
-                                }
-                            } else if (data.type === 'function_call') {
-                                console.log('Function call received:', data.function);
-                                if (onFunctionCall) {
-                                    onFunctionCall(data.function);
-                                }
-                            } else if (data.type === 'done') {
-                                console.log('Stream completed, full response:', fullResponse);
-                                if (onComplete) {
-                                    onComplete(fullResponse);
-                                }
-                            } else if (data.type === 'error') {
-                                console.error('Stream error:', data.content);
-                                if (onError) {
-                                    onError(new Error(data.content));
-                                }
-                            }
-                        } catch (e) {
-                            console.error('Error parsing SSE data:', e, line);
+                    if (!response.ok) {
+                        if (cursor.lastEventId && response.status === 410) {
+                            console.warn('Chat stream expired, keeping the partial reply');
+                            break;
                         }
+                        throw new Error(`HTTP error! status: ${response.status}`);
                     }
+
+                    await this.readEventStream(response, options, state, cursor);
+                    if (cursor.finished || !cursor.lastEventId) {
+                        break;
+                    }
+                    throw new Error('Chat stream ended before the reply finished');
+                } catch (error) {
+                    if (abortController.signal.aborted || !cursor.lastEventId || resumes >= CHAT_RESUME_ATTEMPTS) {
+                        throw error;
+                    }
+                    resumes++;
+                    console.warn(`Chat stream dropped (${error.message}), resuming after ${cursor.lastEventId}`);
+                    await new Promise(resolve => setTimeout(resolve, CHAT_RESUME_DELAY_MS * resumes));
                 }
             }
 
         } catch (error) {
+            if (error.name === 'AbortError') {
+                console.log('Chat stream aborted');
+                return;
+            }
             console.error('Error in streamChat:', error);
             if (onError) {
                 onError(error);
             }
         } finally {
-            this.isStreaming = false;
+            if (this.streamCounter === streamId) {
+                this.isStreaming = false;
+                this.abortController = null;
+            }
+        }
+    }
+
+    /**
+     * Dispatch the events of one SSE response, recording in cursor the id of the
+     * last event handled and whether a done / error / cancelled event arrived
+     */
+    async readEventStream(response, options, state, cursor) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        // Holds a partial line when an event is split across reads
+        let pending = '';
+        let eventId = null;
+
+        while (true) {
+            const { done, value } = await reader.read();
+
+            if (done) {
+                return;
+            }
+
+            // Parse SSE format (id: ...\ndata: {...}\n\n)
+            const lines = (pending + decoder.decode(value, { stream: true })).split('\n');
+            pending = lines.pop();
+
+            for (const line of lines) {
+                if (line.startsWith('id: ')) {
+                    eventId = line.substring(4);
+                } else if (line.startsWith('data: ')) {
+                    try {
+                        const data = JSON.parse(line.substring(6));
+                        this.handleChatEvent(data, options, state);
+                        if (['done', 'error', 'cancelled'].includes(data.type)) {
+                            cursor.finished = true;
+                        }
+                    } catch (e) {
+                        console.error('Error parsing SSE data:', e, line);
+                    }
+                    // Only an event that was handled counts as received
+                    if (eventId) {
+                        cursor.lastEventId = eventId;
+                        eventId = null;
+                    }
+                }
+            }
+        }
+    }
+
+    /**
+     * Dispatch one chat event (text / function_call / done / error) to the callbacks
+     */
+    handleChatEvent(data, options, state) {
+        const { onChunk, onFunctionCall, onComplete, onError } = options;
+
+        if (data.type === 'text') {
+            state.fullResponse += data.content;
+            if (onChunk) {
+                onChunk(data.content, state.fullResponse);
+            }
+        } else if (data.type === 'function_call') {
+            console.log('Function call received:', data.function);
+            if (onFunctionCall) {
+                onFunctionCall(data.function);
+            }
+        } else if (data.type === 'done') {
+            console.log('Stream completed, full response:', state.fullResponse);
+            if (onComplete) {
+                // data.next: clips the server expects this session to play next
+                onComplete(state.fullResponse, data);
+            }
+        } else if (data.type === 'error') {
+            console.error('Stream error:', data.content);
+            if (onError) {
+                onError(new Error(data.content));
+            }
+        }
+    }
+
+    /**
+     * Open the WebSocket channel, resolves to null when it is not available
+     */
+    connectSocket() {
+        if (this.socketUnavailable) {
+            return Promise.resolve(null);
+        }
+        if (this.socketReady) {
+            return this.socketReady;
+        }
+
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const url = `${protocol}//${window.location.host}/ws?session_id=${encodeURIComponent(this.sessionId)}`;
+
+        this.socketReady = new Promise((resolve) => {
+            let opened = false;
+            const socket = new WebSocket(url);
+            socket.binaryType = 'arraybuffer';
+
+            socket.onopen = () => {
+                opened = true;
+                this.socket = socket;
+                console.log('WebSocket channel connected');
+                resolve(socket);
+            };
+            socket.onmessage = (event) => this.handleSocketMessage(event);
+            socket.onclose = () => {
+                if (!opened) {
+                    // Server has no /ws endpoint - stay on HTTP
+                    console.warn('WebSocket channel unavailable, using HTTP');
+                    this.socketUnavailable = true;
+                }
+                this.socket = null;
+                this.socketReady = null;
+                this.failPendingTurns(new Error('WebSocket closed'));
+                resolve(null);
+            };
+        });
+
+        return this.socketReady;
+    }
+
+    /**
+     * Send a chat turn over the socket, resolves when the turn is done
+     */
+    streamChatOverSocket(socket, message, options, state) {
+        const id = `turn_${++this.turnCounter}`;
+
+        // Forget the previous turn if its speech was never requested
+        if (this.pendingSpeech) {
+            delete this.turnHandlers[this.pendingSpeech.id];
+            delete this.speechWaiters[this.pendingSpeech.id];
+            this.pendingSpeech = null;
+        }
+
+        // Spoken reply arrives on the same socket; synthesizeSpeech() picks it up
+        const speech = { id, text: null };
+        speech.promise = new Promise((resolve, reject) => {
+            this.speechWaiters[id] = { resolve, reject };
+        });
+        speech.promise.catch(() => {});
+        this.pendingSpeech = speech;
+
+        return new Promise((resolve) => {
+            this.activeSocketTurn = id;
+            this.turnHandlers[id] = (data) => {
+                if (data.type === 'audio_start' || data.type === 'audio_end') {
+                    return;
+                }
+                if (data.type === 'cancelled') {
+                    // Superseded by a newer message or stopped by the user
+                    delete this.turnHandlers[id];
+                    this.rejectSpeech(id, new Error('Turn cancelled'));
+                    resolve();
+                    return;
+                }
+                if (data.type === 'error' && speech.text !== null) {
+                    // Chat finished, speech synthesis failed
+                    this.rejectSpeech(id, new Error(data.content));
+                    return;
+                }
+                if (data.type === 'done') {
+                    speech.text = state.fullResponse;
+                }
+                this.handleChatEvent(data, options, state);
+                if (data.type === 'done' || data.type === 'error') {
+                    if (this.activeSocketTurn === id) {
+                        this.activeSocketTurn = null;
+                    }
+                    resolve();
+                }
+            };
+
+            const request = {
+                type: 'chat',
+                id: id,
+                message: message,
+                session_id: this.sessionId,
+                tts: true,
+                format: this.audioFormat
+            };
+            if (options.actions && options.actions.length > 0) {
+                request.actions = options.actions;
+            }
+            if (options.setId) {
+                request.set_id = options.setId;
+            }
+            socket.send(JSON.stringify(request));
+        });
+    }
+
+    /**
+     * Route socket messages: JSON events by turn id, binary audio frames by channel
+     */
+    handleSocketMessage(event) {
+        if (event.data instanceof ArrayBuffer) {
+            const channel = new DataView(event.data).getUint32(0);
+            const audio = this.audioChannels[channel];
+            if (!audio) {
+                return;
+            }
+            audio.chunks.push(event.data.slice(4));
+            audio.frames += 1;
+            if (audio.frames % this.audioAckEvery === 0 && this.socket) {
+                this.socket.send(JSON.stringify({ type: 'ack', channel, frames: this.audioAckEvery }));
+            }
+            return;
+        }
+
+        let message;
+        try {
+            message = JSON.parse(event.data);
+        } catch (e) {
+            console.error('Error parsing socket message:', e, event.data);
+            return;
+        }
+
+        const { id, event: data } = message;
+
+        if (data.type === 'audio_start') {
+            this.audioChannels[data.channel] = { id, chunks: [], frames: 0, format: data.format };
+        } else if (data.type === 'audio_end') {
+            const audio = this.audioChannels[data.channel];
+            delete this.audioChannels[data.channel];
+            const waiter = this.speechWaiters[id];
+            if (audio && waiter) {
+                delete this.speechWaiters[id];
+                const type = audio.format === 'opus' ? 'audio/ogg; codecs=opus' : 'audio/mpeg';
+                waiter.resolve(new Blob(audio.chunks, { type }));
+            }
+        }
+
+        const handler = this.turnHandlers[id];
+        if (handler) {
+            handler(data);
         }
     }
 
+    /**
+     * Stream microphone audio to server-side recognition (16 kHz PCM over the socket)
+     * @param {object} options - Options object
+     * @param {object} options.commands - Keyword -> video map matched by the server
+     * @param {function} options.onPartial - Callback for interim transcripts
+     * @param {function} options.onIntent - Callback when a partial matched a command
+     * @param {function} options.onFinal - Callback at the end of each utterance
+     * @param {function} options.onError - Callback for errors
+     * @returns {Promise<function>} Resolves to a stop() function
+     */
+    async startSpeechInput(options) {
+        const { commands, onPartial, onIntent, onFinal, onError } = options;
+        const socket = await this.connectSocket();
+        if (!socket) {
+            throw new Error('Server-side recognition needs the WebSocket channel');
+        }
+
+        const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
+        const audioContext = new AudioContext();
+        const source = audioContext.createMediaStreamSource(stream);
+        const processor = audioContext.createScriptProcessor(4096, 1, 1);
+        const id = `asr_${++this.turnCounter}`;
+        let channel = null;
+        let targetRate = 16000;
+
+        this.turnHandlers[id] = (data) => {
+            if (data.type === 'asr_ready') {
+                channel = data.channel;
+                targetRate = data.sample_rate;
+            } else if (data.type === 'partial') {
+                if (onPartial) onPartial(data.text);
+            } else if (data.type === 'intent') {
+                if (onIntent) onIntent(data.command, data.video, data.text);
+            } else if (data.type === 'final') {
+                if (onFinal) onFinal(data.text, data.command);
+            } else if (data.type === 'error') {
+                console.error('Speech input error:', data.content);
+                if (onError) onError(new Error(data.content));
+            }
+        };
+
+        processor.onaudioprocess = (event) => {
+            if (channel === null || socket.readyState !== WebSocket.OPEN) {
+                return;
+            }
+            // Downsample to the server rate and convert to 16-bit PCM
+            const input = event.inputBuffer.getChannelData(0);
+            const ratio = audioContext.sampleRate / targetRate;
+            const length = Math.floor(input.length / ratio);
+            const frame = new ArrayBuffer(4 + length * 2);
+            const view = new DataView(frame);
+            view.setUint32(0, channel);
+            for (let i = 0; i < length; i++) {
+                const sample = Math.max(-1, Math.min(1, input[Math.floor(i * ratio)]));
+                view.setInt16(4 + i * 2, sample * 0x7fff, true);
+            }
+            socket.send(frame);
+        };
+
+        source.connect(processor);
+        processor.connect(audioContext.destination);
+        socket.send(JSON.stringify({ type: 'asr_start', id, format: 'pcm', commands, session_id: this.sessionId }));
+
+        return () => {
+            processor.disconnect();
+            source.disconnect();
+            stream.getTracks().forEach(track => track.stop());
+            audioContext.close();
+            if (channel !== null && socket.readyState === WebSocket.OPEN) {
+                socket.send(JSON.stringify({ type: 'asr_stop', channel }));
+            }
+            delete this.turnHandlers[id];
+        };
+    }
+
+    /**
+     * Report a clip played on a voice command or button, resolves to the likely next clips
+     */
+    async recordIntent(setId, video) {
+        try {
+            const response = await fetch(`${this.baseUrl}/api/intent`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ session_id: this.sessionId, set_id: setId, video }),
+                keepalive: true
+            });
+            if (!response.ok) {
+                return [];
+            }
+            return (await response.json()).next || [];
+        } catch (e) {
+            console.warn('Could not record intent:', e);
+            return [];
+        }
+    }
+
+    rejectSpeech(id, error) {
+        const waiter = this.speechWaiters[id];
+        if (waiter) {
+            delete this.speechWaiters[id];
+            waiter.reject(error);
+        }
+    }
+
+    failPendingTurns(error) {
+        for (const id of Object.keys(this.turnHandlers)) {
+            this.turnHandlers[id]({ type: 'error', content: error.message });
+        }
+        this.turnHandlers = {};
+        for (const id of Object.keys(this.speechWaiters)) {
+            this.rejectSpeech(id, error);
+        }
+        this.audioChannels = {};
+    }
+
     /**
      * Stop current streaming
+     * @param {object} options.notifyServer - Send "cancel" for the socket turn (default true);
+     *                                        not needed when a new message supersedes it
      */
-    stopStreaming() {
+    stopStreaming({ notifyServer = true } = {}) {
         if (this.currentEventSource) {
             this.currentEventSource.close();
             this.currentEventSource = null;
         }
+        if (this.abortController) {
+            this.abortController.abort();
+            this.abortController = null;
+        }
+        const id = this.activeSocketTurn;
+        if (id) {
+            this.activeSocketTurn = null;
+            if (notifyServer && this.socket) {
+                this.socket.send(JSON.stringify({ type: 'cancel', turn: id, session_id: this.sessionId }));
+            }
+            const handler = this.turnHandlers[id];
+            if (handler) {
+                handler({ type: 'cancelled', reason: 'client' });
+            }
+        }
         this.isStreaming = false;
     }
 
     /**
      * Synthesize speech from text
      * @param {string} text - Text to synthesize
+     * @param {string} [setId] - Current video set (picks its recorded clips while TTS is degraded)
      * @returns {Promise<Blob>} Audio blob
      */
-    async synthesizeSpeech(text) {
+    async synthesizeSpeech(text, setId) {
+        // Audio for the last socket turn is already on its way
+        const speech = this.pendingSpeech;
+        if (speech && speech.text === text) {
+            this.pendingSpeech = null;
+            delete this.turnHandlers[speech.id];
+            return speech.promise;
+        }
+
         try {
             const response = await fetch(`${this.baseUrl}/api/tts/synthesize`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ text })
+                body: JSON.stringify({ text, format: this.audioFormat, set_id: setId })
             });
 
             if (!response.ok) {
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Static Bundle Builder for Smootie
+=================================
+
+Minifies and bundles the frontend into content-hashed files under
+static/dist/ and writes gzip (and brotli, when the `brotli` package is
+installed) copies next to them, so the server never compresses per request:
+
+    static/dist/app.<hash>.js      config-loader.js + dashscope-client.js + app.js
+    static/dist/style.<hash>.css   style.css
+    static/dist/manifest.json      logical name -> fingerprinted file
+
+Fingerprinted files never change, so /static/dist/ is served with
+`Cache-Control: immutable` and the encoding picked from Accept-Encoding.
+config/videosets.json is precompressed too (served with revalidation, since
+its URL is not fingerprinted).
+
+Minification uses rjsmin / rcssmin when installed; otherwise JS is bundled
+as-is and CSS gets a conservative comment/whitespace strip.
+
+When static/dist/manifest.json is missing or older than a source file, the
+templates fall back to the individual files (nothing to do while developing).
+
+Usage:
+    python static_bundle.py
+    python static_bundle.py --check      # exit 1 if the bundle is stale
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip-only bundle
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:  # Optional JS minifier
+    rjsmin = None
+
+try:
+    import rcssmin
+except ImportError:  # Optional CSS minifier
+    rcssmin = None
+
+ROOT = Path(__file__).resolve().parent
+STATIC_DIR = ROOT / 'static'
+DIST_DIR = STATIC_DIR / 'dist'
+MANIFEST_NAME = 'manifest.json'
+
+# Logical bundle name -> source files under static/, in load order
+BUNDLES = {
+    'app.js': ['config-loader.js', 'dashscope-client.js', 'app.js'],
+    'style.css': ['style.css'],
+}
+
+# Not fingerprinted (fetched by URL), compressed in place
+PRECOMPRESSED_FILES = [ROOT / 'config' / 'videosets.json']
+
+# Accept-Encoding token -> file suffix, in server preference order
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+CSS_SPACE = re.compile(r'\s+')
+CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_js(source):
+    if rjsmin is not None:
+        return rjsmin.jsmin(source)
+    return source
+
+
+def minify_css(source):
+    if rcssmin is not None:
+        return rcssmin.cssmin(source)
+    source = CSS_COMMENT.sub('', source)
+    source = CSS_SPACE.sub(' ', source)
+    return CSS_PUNCTUATION.sub(r'\1', source).strip()
+
+
+def build_bundle(name, sources, static_dir=STATIC_DIR):
+    """Concatenate and minify sources, returns the bundle bytes"""
+    parts = [(static_dir / source).read_text(encoding='utf-8') for source in sources]
+    if name.endswith('.js'):
+        # Separate classic scripts so a missing trailing semicolon cannot merge statements
+        return ';\n'.join(minify_js(part) for part in parts).encode('utf-8')
+    return '\n'.join(minify_css(part) for part in parts).encode('utf-8')
+
+
+def fingerprint(name, content):
+    stem, extension = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:12]}{extension}"
+
+
+def write_atomic(path, content):
+    tmp_file = path.with_name(path.name + '.tmp')
+    tmp_file.write_bytes(content)
+    os.replace(tmp_file, path)
+
+
+def write_compressed(path, content):
+    """Write gzip/brotli siblings of path, returns {encoding: size}"""
+    sizes = {'identity': len(content)}
+    # mtime=0 keeps the .gz byte-identical between builds of the same content
+    write_atomic(path.with_name(path.name + '.gz'), gzip.compress(content, compresslevel=9, mtime=0))
+    sizes['gzip'] = path.with_name(path.name + '.gz').stat().st_size
+    if brotli is not None:
+        write_atomic(path.with_name(path.name + '.br'), brotli.compress(content, quality=11))
+        sizes['br'] = path.with_name(path.name + '.br').stat().st_size
+    return sizes
+
+
+def build(static_dir=STATIC_DIR, dist_dir=DIST_DIR, extra_files=PRECOMPRESSED_FILES):
+    """Build every bundle, remove stale fingerprinted files and write the manifest"""
+    dist_dir.mkdir(parents=True, exist_ok=True)
+    manifest = {'files': {}, 'sources': BUNDLES}
+    keep = {MANIFEST_NAME}
+
+    for name, sources in BUNDLES.items():
+        content = build_bundle(name, sources, static_dir)
+        filename = fingerprint(name, content)
+        path = dist_dir / filename
+        if not path.exists():
+            write_atomic(path, content)
+        sizes = write_compressed(path, content)
+        manifest['files'][name] = filename
+        keep.update({filename, filename + '.gz', filename + '.br'})
+
+        original = sum((static_dir / source).stat().st_size for source in sources)
+        print(f"  ✓ {name:10s} -> dist/{filename}  {original} -> " +
+              ', '.join(f"{encoding} {size}" for encoding, size in sizes.items()))
+
+    for path in dist_dir.iterdir():
+        if path.name not in keep:
+            path.unlink()
+
+    for path in extra_files:
+        if path.exists():
+            sizes = write_compressed(path, path.read_bytes())
+            print(f"  ✓ {path.relative_to(ROOT)}  " +
+                  ', '.join(f"{encoding} {size}" for encoding, size in sizes.items()))
+
+    write_atomic(dist_dir / MANIFEST_NAME, json.dumps(manifest, indent=2).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(static_dir=STATIC_DIR, dist_dir=DIST_DIR):
+    """Manifest of the built bundle, or None when missing or older than its sources"""
+    manifest_path = dist_dir / MANIFEST_NAME
+    if not manifest_path.exists():
+        return None
+
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    built_at = manifest_path.stat().st_mtime
+    for name, sources in BUNDLES.items():
+        filename = manifest.get('files', {}).get(name)
+        if manifest.get('sources', {}).get(name) != sources or not filename:
+            return None
+        if not (dist_dir / filename).exists():
+            return None
+        if any((static_dir / source).stat().st_mtime > built_at for source in sources):
+            print(f"Static bundle is stale ({name}), serving source files - "
+                  f"run python static_bundle.py", flush=True)
+            return None
+    return manifest
+
+
+def precompressed_variant(path, accept_encodings):
+    """(file to send, Content-Encoding or None) for the best encoding the client accepts
+
+    A compressed copy older than its source is ignored.
+    """
+    source_mtime = path.stat().st_mtime
+    for encoding, suffix in ENCODINGS:
+        if not accept_encodings[encoding]:
+            continue
+        candidate = path.with_name(path.name + suffix)
+        if candidate.exists() and candidate.stat().st_mtime >= source_mtime:
+            return candidate, encoding
+    return path, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the minified, fingerprinted static bundle")
+    parser.add_argument("--check", action="store_true",
+                       help="Only check that static/dist is up to date (exit 1 if not)")
+    args = parser.parse_args()
+
+    if args.check:
+        if load_manifest() is None:
+            print("Static bundle missing or stale - run python static_bundle.py")
+            sys.exit(1)
+        print("✓ Static bundle up to date")
+        return
+
+    print("=== Static bundle ===")
+    print(f"Minify: js={'rjsmin' if rjsmin else 'off'}, css={'rcssmin' if rcssmin else 'basic'}, "
+          f"brotli={'on' if brotli else 'off'}")
+    build()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Resumable chat streams: per-turn replay buffers for Last-Event-ID
+
+When a phone switches networks mid-reply, the /api/chat/stream response
+drops. Resending the message would start a new Generation.call and write the
+turn to history twice. Instead every SSE event carries an id
+`<stream>.<seq>` and is kept in the turn's ReplayStream; a request with a
+Last-Event-ID header gets the events after that id and then follows the
+still-running turn live.
+
+The turn's frame generator is pulled by whichever reader needs the next
+event (the original request, or a reconnect). While no reader is attached a
+drain thread keeps pulling it, so the upstream stream is not dropped; if
+nobody reattaches within STREAM_RESUME_GRACE seconds the turn is cancelled as
+a disconnect. on_delivered runs once a reader has been handed the last event
+of the finished turn, so a reply nobody came back for can be left out of
+history.
+
+Resuming keeps the upstream call running after a disconnect, so it is off
+unless STREAM_RESUME=true; without it a disconnect cancels the turn at once. Buffers are capped per turn (STREAM_BUFFER_BYTES, oldest events
+dropped first) and kept for STREAM_BUFFER_TTL seconds after the turn ends,
+finished ones being evicted oldest first beyond STREAM_BUFFERS_MAX_BYTES.
+"""
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+
+STREAM_RESUME = os.getenv('STREAM_RESUME', 'false').lower() == 'true'
+STREAM_RESUME_GRACE = float(os.getenv('STREAM_RESUME_GRACE', '10'))
+STREAM_BUFFER_TTL = float(os.getenv('STREAM_BUFFER_TTL', '60'))
+STREAM_BUFFER_BYTES = int(os.getenv('STREAM_BUFFER_BYTES', str(256 * 1024)))
+STREAM_BUFFERS_MAX_BYTES = int(os.getenv('STREAM_BUFFERS_MAX_BYTES', str(16 * 1024 * 1024)))
+
+
+def parse_event_id(value):
+    """(stream_id, seq) from a Last-Event-ID value, or None"""
+    stream_id, _, seq = (value or '').strip().rpartition('.')
+    if not stream_id or not seq.isdigit():
+        return None
+    return stream_id, int(seq)
+
+
+class ReplayStream:
+    """Frames of one turn, numbered and buffered for readers that reconnect"""
+
+    def __init__(self, stream_id, session_id, frames, on_orphaned=None, on_delivered=None,
+                 max_bytes=STREAM_BUFFER_BYTES, grace=STREAM_RESUME_GRACE):
+        self.stream_id = stream_id
+        self.session_id = session_id
+        self.frames = frames
+        # Called once when nobody read the unfinished turn for `grace` seconds
+        self.on_orphaned = on_orphaned
+        # Called once when a reader got every event of the finished turn
+        self.on_delivered = on_delivered
+        self.max_bytes = max_bytes
+        self.grace = grace
+
+        self._cond = threading.Condition()
+        self.events = deque()  # (seq, frame with its id line)
+        self.size = 0
+        self.last_seq = 0
+        self.finished = False
+        self.finished_at = None
+        self.readers = 0
+        self._pulling = False
+        self._drainer = None
+        self._orphan_timer = None
+        self.orphaned = False
+        self.delivered = False
+
+    def available(self, after):
+        """True if the events after seq `after` are still buffered"""
+        with self._cond:
+            first = self.events[0][0] if self.events else self.last_seq + 1
+            return 0 <= after <= self.last_seq and after >= first - 1
+
+    def _append(self, frame):
+        with self._cond:
+            self.last_seq += 1
+            framed = f"id: {self.stream_id}.{self.last_seq}\n{frame}"
+            self.events.append((self.last_seq, framed))
+            self.size += len(framed)
+            while self.size > self.max_bytes and len(self.events) > 1:
+                self.size -= len(self.events.popleft()[1])
+
+    def _pull(self):
+        """Take one frame from the turn (called by one thread at a time)"""
+        try:
+            frame = next(self.frames)
+        except StopIteration:
+            frame = None
+            done = True
+        except Exception as e:
+            print(f"Replay stream {self.stream_id} failed: {e}", flush=True)
+            frame = None
+            done = True
+        else:
+            done = False
+        if frame is not None:
+            self._append(frame)
+        with self._cond:
+            self._pulling = False
+            if done:
+                self.finished = True
+                self.finished_at = time.monotonic()
+                if self._orphan_timer is not None:
+                    self._orphan_timer.cancel()
+            self._cond.notify_all()
+
+    def read(self, after=0):
+        """Generator of the frames after seq `after`, following the turn live"""
+        with self._cond:
+            self.readers += 1
+            if self._orphan_timer is not None:
+                self._orphan_timer.cancel()
+                self._orphan_timer = None
+        try:
+            seq = after
+            while True:
+                pull = False
+                with self._cond:
+                    pending = self._after(seq)
+                    if not pending:
+                        if self.finished:
+                            break
+                        if self._pulling:
+                            self._cond.wait(1.0)
+                            continue
+                        self._pulling = pull = True
+                if pull:
+                    self._pull()
+                    continue
+                for seq, frame in pending:
+                    yield frame
+            self._deliver()
+        finally:
+            self._detach()
+
+    def _deliver(self):
+        with self._cond:
+            if self.delivered:
+                return
+            self.delivered = True
+        if self.on_delivered is not None:
+            self.on_delivered()
+
+    def _after(self, seq):
+        """Buffered events after seq (caller holds the lock)
+
+        Sequence numbers in the buffer are consecutive and end at last_seq, so
+        the new events are the last last_seq - seq ones: O(new events), not a
+        scan of the whole buffer on every read.
+        """
+        count = min(self.last_seq - seq, len(self.events))
+        if count <= 0:
+            return []
+        return list(islice(reversed(self.events), count))[::-1]
+
+    def _detach(self):
+        with self._cond:
+            self.readers -= 1
+            if self.readers or self.finished:
+                return
+            if self.on_orphaned is not None and not self.orphaned:
+                self._orphan_timer = threading.Timer(self.grace, self._orphan)
+                self._orphan_timer.daemon = True
+                self._orphan_timer.start()
+            if self._drainer is None:
+                self._drainer = threading.Thread(target=self._drain, daemon=True,
+                                                 name=f"replay-{self.stream_id}")
+                self._drainer.start()
+
+    def _orphan(self):
+        with self._cond:
+            if self.readers or self.finished or self.orphaned:
+                return
+            self.orphaned = True
+        print(f"Replay stream {self.stream_id}: no reader for {self.grace:g}s, cancelling the turn",
+              flush=True)
+        self.on_orphaned()
+
+    def _drain(self):
+        """Keep pulling the turn while no reader is attached"""
+        while True:
+            with self._cond:
+                if self.finished or self.readers:
+                    self._drainer = None
+                    return
+                if self._pulling:
+                    self._cond.wait(1.0)
+                    continue
+                self._pulling = True
+            self._pull()
+
+
+class ReplayStreams:
+    """Replay buffers of in-flight and recently finished turns (thread-safe)"""
+
+    def __init__(self, ttl=STREAM_BUFFER_TTL, max_bytes=STREAM_BUFFERS_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.streams = OrderedDict()
+        self.opened = 0
+        self.resumed = 0
+        self.expired = 0
+
+    def open(self, session_id, frames, on_orphaned=None, on_delivered=None):
+        stream = ReplayStream(secrets.token_hex(8), session_id, frames, on_orphaned, on_delivered)
+        with self._lock:
+            self._evict()
+            self.streams[stream.stream_id] = stream
+            self.opened += 1
+        return stream
+
+    def resume(self, last_event_id, session_id):
+        """Frames after Last-Event-ID, or None when that stream is gone (or not the session's)"""
+        parsed = parse_event_id(last_event_id)
+        with self._lock:
+            self._evict()
+            stream = self.streams.get(parsed[0]) if parsed else None
+            if stream is None or stream.session_id != session_id or not stream.available(parsed[1]):
+                self.expired += 1
+                return None
+            self.resumed += 1
+        print(f"Resuming stream {stream.stream_id} after event {parsed[1]} "
+              f"({'finished' if stream.finished else 'running'})", flush=True)
+        return stream.read(parsed[1])
+
+    def _evict(self):
+        """Drop finished buffers past their TTL, then the oldest finished ones over the size cap"""
+        now = time.monotonic()
+        for stream_id, stream in list(self.streams.items()):
+            if stream.finished and now - stream.finished_at > self.ttl:
+                del self.streams[stream_id]
+        total = sum(stream.size for stream in self.streams.values())
+        for stream_id, stream in list(self.streams.items()):
+            if total <= self.max_bytes:
+                break
+            if stream.finished:
+                total -= stream.size
+                del self.streams[stream_id]
+
+    def snapshot(self):
+        with self._lock:
+            self._evict()
+            streams = list(self.streams.values())
+            return {
+                'enabled': STREAM_RESUME,
+                'buffers': len(streams),
+                'running': sum(1 for stream in streams if not stream.finished),
+                'orphaned': sum(1 for stream in streams if stream.readers == 0 and not stream.finished),
+                'bytes': sum(stream.size for stream in streams),
+                'opened': self.opened,
+                'resumed': self.resumed,
+                'expired': self.expired,
+            }
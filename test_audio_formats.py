@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests for audio_formats.py: format / sample-rate negotiation and the reply LRU
+
+Run: python -m pytest test_audio_formats.py
+"""
+import pytest
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from audio_formats import AudioCache, choose_sample_rate, content_type, negotiate, parse_sample_rate
+
+
+def accept(value):
+    return parse_accept_header(value, MIMEAccept)
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, None), ('', None), ('16000', 16000), ('22050.0', 22050), (48000, 48000),
+])
+def test_parse_sample_rate(value, expected):
+    assert parse_sample_rate(value) == expected
+
+
+@pytest.mark.parametrize('value', ['fast', '-8000', '0', 'inf', 'nan', True, [16000]])
+def test_parse_sample_rate_rejects(value):
+    with pytest.raises(ValueError, match="invalid sample_rate"):
+        parse_sample_rate(value)
+
+
+def test_sample_rate_snaps_to_the_nearest_supported():
+    assert choose_sample_rate('opus') == 24000
+    assert choose_sample_rate('opus', '44100') == 48000
+    assert choose_sample_rate('mp3', 16500) == 16000
+
+
+def test_negotiate_from_accept_header():
+    assert negotiate(accept('audio/ogg')) == ('opus', 24000)
+    assert negotiate(accept('audio/opus;q=0.5, audio/L16'), requested_rate='8000') == ('pcm', 8000)
+    # Wildcards and ties go to the default format
+    assert negotiate(accept('*/*')) == ('mp3', 22050)
+    assert negotiate(accept('audio/wav, audio/mpeg'), default='wav') == ('wav', 16000)
+    assert negotiate(accept('video/mp4')) is None
+
+
+def test_negotiate_explicit_format_wins():
+    assert negotiate(accept('audio/mpeg'), requested_format='wav') == ('wav', 16000)
+    assert negotiate(requested_format='audio/opus') == ('opus', 24000)
+    assert negotiate(requested_format='flac') is None
+
+
+def test_negotiate_within_available_formats():
+    assert negotiate(accept('audio/ogg'), available=['mp3']) is None
+    assert negotiate(available=['wav']) == ('wav', 16000)
+    assert negotiate(requested_format='opus', available=['mp3', 'opus']) == ('opus', 24000)
+
+
+def test_negotiate_rejects_invalid_sample_rate():
+    assert negotiate(requested_format='mp3', requested_rate='fast') is None
+    assert negotiate(accept('audio/mpeg'), requested_rate='-1') is None
+
+
+def test_content_type():
+    assert content_type('pcm', 16000) == 'audio/L16; rate=16000; channels=1'
+    assert content_type('opus', 24000) == 'audio/ogg; codecs=opus'
+    assert content_type('mp3', 22050) == 'audio/mpeg'
+
+
+def test_audio_cache_evicts_least_recently_used():
+    cache = AudioCache(max_entries=2)
+    a, b, c = (AudioCache.key(text, 'mp3', 22050) for text in "abc")
+    assert len({a, b, c}) == 3
+    cache.put(a, b'a')
+    cache.put(b, b'b')
+    assert cache.get(a) == b'a'
+    cache.put(c, b'c')
+    assert cache.get(b) is None
+    assert (cache.get(a), cache.get(c)) == (b'a', b'c')
+
+    disabled = AudioCache(max_entries=0)
+    disabled.put(a, b'a')
+    assert disabled.get(a) is None
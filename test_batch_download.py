@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Offline tests for skills/batch_download.py
+
+BatchDownloader runs every yt-dlp / ffprobe command through its `run` hook;
+FakeRun stands in for both, so the download pipeline is exercised without
+network access or external tools.
+
+Run: python -m pytest test_batch_download.py
+"""
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / "skills"))
+
+import batch_download  # noqa: E402
+from batch_download import BatchDownloader  # noqa: E402
+
+
+class FakeRun:
+    """subprocess.run stand-in for yt-dlp (writes the -o file) and ffprobe (answers JSON)"""
+
+    def __init__(self, failing=(), duration=5.0):
+        self.failing = set(failing)
+        self.duration = duration
+        self.calls = []
+
+    def __call__(self, cmd, capture_output=True, text=True):
+        self.calls.append(cmd)
+        if cmd[0] == "ffprobe":
+            return SimpleNamespace(returncode=0, stdout=json.dumps({"format": {"duration": str(self.duration)}}),
+                                   stderr="")
+        url = cmd[-1]
+        if url in self.failing:
+            return SimpleNamespace(returncode=1, stdout="", stderr="ERROR: Video unavailable")
+        output = Path(cmd[cmd.index("-o") + 1])
+        output.write_bytes(b"video")
+        for part in batch_download.partial_files(output):
+            part.unlink()
+        return SimpleNamespace(returncode=0, stdout="", stderr="")
+
+
+def downloader(tmp_path, run, post_check=None, pre_check=None):
+    return BatchDownloader("best", output_dir=str(tmp_path), workers=2, run=run,
+                           pre_check=pre_check, post_check=post_check, duration_range=(2, 30))
+
+
+def by_action(results):
+    return {result["action"]: result for result in results}
+
+
+def test_statuses(tmp_path):
+    (tmp_path / "set1").mkdir()
+    (tmp_path / "set1" / "exists.mp4").write_bytes(b"already here")
+    (tmp_path / "set1" / "resumed.mp4.part").write_bytes(b"half")
+    jobs = [{"url": f"https://example.com/{action}", "set": "set1", "action": action}
+            for action in ("downloaded", "exists", "failed", "resumed", "duplicate")]
+    run = FakeRun(failing={"https://example.com/failed"})
+
+    def post_check(path):
+        if Path(path).stem == "duplicate":
+            Path(path).unlink()
+            return False
+        return True
+
+    results = by_action(downloader(tmp_path, run, post_check).run_batch(jobs))
+
+    assert results["downloaded"]["status"] == "downloaded"
+    assert results["downloaded"]["duration"] == 5.0
+    assert results["exists"]["status"] == "exists"
+    assert results["exists"]["size"] == len(b"already here")
+    assert results["failed"]["status"] == "failed"
+    assert results["failed"]["note"] == "ERROR: Video unavailable"
+    assert results["resumed"]["status"] == "downloaded"
+    assert results["resumed"]["resumed"] is True
+    assert not (tmp_path / "set1" / "resumed.mp4.part").exists()
+    assert results["duplicate"]["status"] == "duplicate"
+    assert not (tmp_path / "set1" / "duplicate.mp4").exists()
+    # The existing file is not downloaded again
+    downloads = [cmd[-1] for cmd in run.calls if cmd[0] == "yt-dlp"]
+    assert "https://example.com/exists" not in downloads
+    # Interrupted downloads resume from their .part files
+    assert all("--continue" in cmd for cmd in run.calls if cmd[0] == "yt-dlp")
+
+
+def test_results_keep_job_order(tmp_path):
+    jobs = [{"url": f"https://example.com/{i}", "set": "set1", "action": f"clip{i}"} for i in range(6)]
+    results = downloader(tmp_path, FakeRun()).run_batch(jobs)
+    assert [result["action"] for result in results] == [job["action"] for job in jobs]
+
+
+def test_duration_outside_range_is_noted(tmp_path):
+    jobs = [{"url": "https://example.com/long", "set": "set1", "action": "long"},
+            {"url": "https://example.com/src", "set": "set1", "action": batch_download.SOURCE_ACTION}]
+    results = by_action(downloader(tmp_path, FakeRun(duration=120.0)).run_batch(jobs))
+    assert "outside 2-30s" in results["long"]["note"]
+    # Source videos are long by design
+    assert results[batch_download.SOURCE_ACTION]["note"] == ""
+
+
+def test_post_check_error_stays_with_its_job(tmp_path):
+    jobs = [{"url": f"https://example.com/{action}", "set": "set1", "action": action}
+            for action in ("broken", "fine")]
+
+    def post_check(path):
+        if Path(path).stem == "broken":
+            raise RuntimeError("index unreadable")
+        return True
+
+    results = by_action(downloader(tmp_path, FakeRun(), post_check).run_batch(jobs))
+    assert results["broken"]["status"] == "downloaded"
+    assert "index unreadable" in results["broken"]["note"]
+    assert results["fine"]["status"] == "downloaded"
+
+
+def test_download_error_stays_with_its_job(tmp_path):
+    def run(cmd, capture_output=True, text=True):
+        if cmd[-1] == "https://example.com/boom":
+            raise ValueError("bad command")
+        return FakeRun()(cmd)
+
+    jobs = [{"url": "https://example.com/boom", "set": "set1", "action": "boom"},
+            {"url": "https://example.com/ok", "set": "set1", "action": "ok"}]
+    results = by_action(downloader(tmp_path, run).run_batch(jobs))
+    assert results["boom"]["status"] == "failed"
+    assert results["boom"]["note"] == "bad command"
+    assert results["ok"]["status"] == "downloaded"
+
+
+def test_pre_check_skips_download(tmp_path):
+    jobs = [{"url": f"https://example.com/{action}", "set": "set1", "action": action}
+            for action in ("known", "new")]
+    run = FakeRun()
+    results = by_action(downloader(tmp_path, run, pre_check=lambda job: job["action"] != "known")
+                        .run_batch(jobs))
+    assert results["known"]["status"] == "duplicate"
+    assert not (tmp_path / "set1" / "known.mp4").exists()
+    assert results["new"]["status"] == "downloaded"
+    downloads = [cmd[-1] for cmd in run.calls if cmd[0] == "yt-dlp"]
+    assert downloads == ["https://example.com/new"]
+
+
+def test_download_batch_without_ffmpeg(tmp_path, monkeypatch, capsys):
+    import search_videos
+    monkeypatch.setattr(search_videos.shutil, "which", lambda name: None)
+    batch = tmp_path / "downloads.txt"
+    batch.write_text("https://example.com/a set1 walk\n", encoding="utf-8")
+    assert search_videos.download_batch(batch, output_dir=str(tmp_path / "videos"), run=FakeRun())
+    assert (tmp_path / "videos" / "set1" / "walk.mp4").exists()
+    # No fingerprint index without ffmpeg, so no duplicate checks either
+    assert "post-processing failed" not in capsys.readouterr().out
+
+
+def test_load_batch_text(tmp_path):
+    batch = tmp_path / "downloads.txt"
+    batch.write_text("# comment\nhttps://example.com/a  myset\nhttps://example.com/b myset walk\n",
+                     encoding="utf-8")
+    jobs = batch_download.load_batch(batch)
+    assert jobs == [{"url": "https://example.com/a", "set": "myset", "action": batch_download.SOURCE_ACTION},
+                    {"url": "https://example.com/b", "set": "myset", "action": "walk"}]
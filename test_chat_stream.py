@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Tests for chat_stream.py: SSE framing, text coalescing, the stall-aware
+upstream iterator and reply budgets
+
+Coalescers get a manual clock; TimedChunks reads from a generator that
+blocks on an event to stand in for a stalled upstream.
+
+Run: python -m pytest test_chat_stream.py
+"""
+import threading
+
+import pytest
+
+import chat_stream
+from chat_stream import (TICK, ChatStreamProcessor, ReplyBudget, TextCoalescer, TimedChunks, sse_event, sse_payload,
+                         text_event)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def content(frame):
+    return sse_payload(frame)['content']
+
+
+def test_text_event_matches_sse_event():
+    for text in ["hello", "你好\n\"quoted\"", ""]:
+        assert text_event(text) == sse_event({'type': 'text', 'content': text})
+        assert sse_payload(text_event(text)) == {'type': 'text', 'content': text}
+
+
+def test_sse_payload_rejects_other_frames():
+    with pytest.raises(ValueError):
+        sse_payload(": keep-alive\n\n")
+    assert sse_payload("id: 3\n" + sse_event({'type': 'done'})) == {'type': 'done'}
+
+
+def test_disabled_coalescer_sends_every_chunk():
+    coalescer = TextCoalescer(0, 0)
+    assert [content(coalescer.add(text)) for text in "abc"] == ["a", "b", "c"]
+    assert coalescer.flush() is None
+
+
+def test_window_merges_chunks_and_sends_the_first_at_once():
+    clock = Clock()
+    coalescer = TextCoalescer(window_ms=100, max_bytes=0, clock=clock)
+    assert content(coalescer.add("a")) == "a"
+    assert coalescer.add("b") is None
+    clock.now = 0.05
+    assert coalescer.add("c") is None
+    assert not coalescer.due()
+    clock.now = 0.1
+    assert coalescer.due()
+    assert content(coalescer.add("d")) == "bcd"
+    assert coalescer.flush() is None
+
+
+def test_byte_limit_flushes():
+    coalescer = TextCoalescer(window_ms=0, max_bytes=6, clock=Clock())
+    coalescer.add("first")
+    assert coalescer.add("你") is None  # 3 bytes
+    assert content(coalescer.add("好")) == "你好"
+    assert not coalescer.due()  # No window: only size and flush() release text
+
+
+def test_tick_releases_text_held_past_the_window():
+    clock = Clock()
+    stream = ChatStreamProcessor(TextCoalescer(window_ms=100, max_bytes=0, clock=clock))
+    stream.process({'content': "a"})
+    assert stream.process({'content': "b"}) is None
+    assert stream.tick() is None
+    clock.now = 0.2
+    assert content(stream.tick()) == "b"
+    assert stream.tick() is None
+
+
+def test_timed_wraps_only_windowed_coalescers():
+    responses = iter([])
+    assert ChatStreamProcessor(TextCoalescer(0, 64)).timed(responses) is responses
+    timed = ChatStreamProcessor(TextCoalescer(100, 0)).timed(iter([]))
+    assert isinstance(timed, TimedChunks)
+    assert timed.interval == 0.05
+
+
+class StallingUpstream:
+    """Yields 'a', waits for resume, yields 'b'; records close()"""
+
+    def __init__(self):
+        self.resume = threading.Event()
+        self.closed = threading.Event()
+        self._chunks = self._generate()
+
+    def _generate(self):
+        yield 'a'
+        self.resume.wait(5)
+        yield 'b'
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._chunks)
+
+    def close(self):
+        self.closed.set()
+
+
+def test_timed_chunks_tick_while_upstream_stalls():
+    upstream = StallingUpstream()
+    chunks = TimedChunks(upstream, 0.02)
+    assert next(chunks) == 'a'
+    assert next(chunks) is TICK
+    upstream.resume.set()
+    received = [chunk for chunk in chunks if chunk is not TICK]
+    assert received == ['b']
+    assert upstream.closed.wait(1)
+
+
+def test_timed_chunks_close_stops_the_reader():
+    upstream = StallingUpstream()
+    chunks = TimedChunks(upstream, 0.02)
+    assert next(chunks) == 'a'
+    chunks.close()
+    upstream.resume.set()
+    assert upstream.closed.wait(1)
+
+
+def test_timed_chunks_reraise_upstream_errors():
+    def failing():
+        yield 'a'
+        raise ConnectionError("reset")
+
+    chunks = TimedChunks(failing(), 1)
+    assert next(chunks) == 'a'
+    with pytest.raises(ConnectionError):
+        next(chunks)
+
+
+
+def take_all(budget, chunks):
+    return ''.join(budget.take(chunk) for chunk in chunks)
+
+
+def test_budget_stops_after_max_sentences():
+    budget = ReplyBudget(max_sentences=2, max_chars=0)
+    assert take_all(budget, ["你好！", "我是小助手。", "今天", "天气不错。"]) == "你好！我是小助手。"
+    assert budget.exhausted
+    assert budget.take("more") == ''
+
+
+def test_closing_quotes_stay_with_their_sentence():
+    budget = ReplyBudget(max_sentences=1, max_chars=0)
+    assert take_all(budget, ["他说：“好的！”", "然后走了。"]) == "他说：“好的！”"
+
+
+def test_numbers_do_not_end_sentences():
+    budget = ReplyBudget(max_sentences=1, max_chars=0)
+    assert take_all(budget, ["1. Pi is 3.5 or so. ", "Next one."]) == "1. Pi is 3.5 or so. "
+    assert budget.sentences == 1
+
+
+def test_char_limit_cuts_at_the_last_pause():
+    budget = ReplyBudget(max_sentences=0, max_chars=10)
+    assert budget.take("一二三四，五六七八九十十一") == "一二三四，"
+    assert budget.exhausted
+
+    budget = ReplyBudget(max_sentences=0, max_chars=5)
+    assert budget.take("abcdefgh") == "abcde"
+
+
+def test_max_tokens_follows_the_char_limit():
+    budget = ReplyBudget(max_sentences=2, max_chars=100)
+    assert budget.max_tokens() == int(100 * chat_stream.REPLY_TOKENS_PER_CHAR)
+    assert budget.max_tokens(tools=True) == budget.max_tokens() + chat_stream.REPLY_TOOL_TOKENS
+    assert ReplyBudget(max_sentences=2, max_chars=0).max_tokens() is None
+
+
+def test_for_set_reads_the_reply_entry(monkeypatch):
+    monkeypatch.setattr(chat_stream, 'REPLY_BUDGET', True)
+    budget = ReplyBudget.for_set({'reply': {'maxSentences': 1, 'maxChars': 60}})
+    assert (budget.max_sentences, budget.max_chars) == (1, 60)
+    assert ReplyBudget.for_set({'reply': {'maxSentences': 0, 'maxChars': 0}}) is None
+    monkeypatch.setattr(chat_stream, 'REPLY_BUDGET', False)
+    assert ReplyBudget.for_set({}) is None
+
+
+def test_processor_keeps_tool_calls_past_the_budget():
+    stream = ChatStreamProcessor(TextCoalescer(0, 0), ReplyBudget(max_sentences=1, max_chars=0))
+    stream.process({'content': "好的。"})
+    stream.process({'content': "还有"})
+    assert stream.budget_exhausted
+    assert stream.full_response == "好的。"
+    assert not stream.tool_call_pending()
+
+    tool_call = {'index': 0, 'function': {'name': 'control_video', 'arguments': '{"action": '}}
+    stream.process({'tool_calls': [tool_call]})
+    assert stream.tool_call_pending()
+    stream.process({'tool_calls': [{'index': 0, 'function': {'arguments': '"wave"}'}}]})
+    assert not stream.tool_call_pending()
+    assert stream.function_calls() == [{'name': 'control_video', 'arguments': {'action': 'wave'}}]
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Tests for circuit_breaker.py: the closed / open / half-open state machine
+
+The breaker's clock is replaced with a manual one, so the open period and
+the rolling window pass without sleeping.
+
+Run: python -m pytest test_circuit_breaker.py
+"""
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, 'monotonic', clock)
+    return clock
+
+
+def breaker(**kwargs):
+    options = dict(enabled=True, window=30, min_calls=4, error_rate=0.5,
+                   open_seconds=20, close_probes=2)
+    options.update(kwargs)
+    return CircuitBreaker('test', latency_limit=1.0, **options)
+
+
+def trip(cb):
+    for _ in range(cb.min_calls):
+        cb.record_failure()
+    assert cb.state == 'open'
+
+
+def test_opens_on_error_rate_once_the_window_is_full(clock):
+    cb = breaker()
+    cb.record_success(0.1)
+    cb.record_failure()
+    cb.record_failure()
+    assert cb.state == 'closed'  # Only 3 calls in the window
+    cb.record_failure()
+    assert cb.state == 'open'
+    assert cb.reason == "3/4 calls failed"
+    assert not cb.allow()
+    assert cb.snapshot()['rejected'] == 1
+
+
+def test_opens_on_slow_p90(clock):
+    cb = breaker()
+    for _ in range(3):
+        cb.record_success(0.1)
+    assert cb.state == 'closed'
+    cb.record_success(1.5)
+    assert cb.state == 'open'
+    assert cb.reason.startswith("p90 latency")
+
+
+def test_old_calls_leave_the_window(clock):
+    cb = breaker()
+    for _ in range(3):
+        cb.record_failure()
+    clock.advance(31)
+    cb.record_failure()
+    assert cb.state == 'closed'
+    assert cb.snapshot()['window_calls'] == 1
+
+
+def test_half_open_probes_close_the_breaker(clock):
+    cb = breaker()
+    trip(cb)
+    clock.advance(21)
+    assert cb.allow()
+    assert cb.state == 'half_open'
+    # One probe at a time
+    assert not cb.allow()
+    cb.record_success(0.1)
+    assert cb.state == 'half_open'
+    assert cb.allow()
+    cb.record_success(0.1)
+    assert cb.state == 'closed'
+    assert cb.snapshot()['window_calls'] == 0
+
+
+@pytest.mark.parametrize('outcome', ['failure', 'slow'])
+def test_bad_probe_reopens(clock, outcome):
+    cb = breaker()
+    trip(cb)
+    clock.advance(21)
+    assert cb.allow()
+    if outcome == 'failure':
+        cb.record_failure()
+    else:
+        cb.record_success(2.0)
+    assert cb.state == 'open'
+    assert cb.trips == 2
+    assert not cb.allow()
+
+
+def test_released_or_lost_probe_frees_the_slot(clock):
+    cb = breaker()
+    trip(cb)
+    clock.advance(21)
+    assert cb.allow()
+    cb.release()
+    assert cb.allow()
+    # A probe that never reports back is given up after open_seconds
+    assert not cb.allow()
+    clock.advance(21)
+    assert cb.allow()
+
+
+def test_disabled_breaker_always_allows(clock):
+    cb = breaker(enabled=False)
+    for _ in range(10):
+        cb.record_failure()
+    assert cb.allow()
+    assert cb.snapshot()['state'] == 'closed'
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Tests for context_builder.py: token estimates, prompt messages for stored
+tool calls and budgeted history with the rolling summary
+
+Token counts use the built-in estimate (the Qwen tokenizer is switched off),
+so a short ASCII message costs 1 + MESSAGE_OVERHEAD_TOKENS = 5 tokens.
+
+Run: python -m pytest test_context_builder.py
+"""
+import pytest
+
+import context_builder
+from context_builder import ContextBuilder, count_tokens, extractive_summary, prompt_message
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    monkeypatch.setattr(context_builder, '_tokenizer', None)
+    monkeypatch.setattr(context_builder, '_tokenizer_loaded', True)
+
+
+def history(pairs):
+    messages = []
+    for i in range(1, pairs + 1):
+        messages.append({'role': 'user', 'content': f"u{i}"})
+        messages.append({'role': 'assistant', 'content': f"a{i}"})
+    return messages
+
+
+class RecordingSummarizer:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, previous, messages, max_tokens):
+        self.calls.append([m['content'] for m in messages])
+        return extractive_summary(previous, messages, max_tokens)
+
+
+def test_count_tokens_estimate():
+    assert count_tokens('') == 0
+    assert count_tokens('你好') == 2
+    assert count_tokens('hello world') == 3
+    assert count_tokens('你好 world') == 2 + 2
+
+
+def test_prompt_message_describes_tool_calls():
+    message = {'role': 'assistant', 'content': '', 'tool_calls': [
+        {'name': 'control_video', 'arguments': {'action': 'wave'}},
+        {'name': 'control_video', 'arguments': '{"action": "nod"'},  # Stored unparsed
+        {'name': '', 'arguments': None},
+    ]}
+    assert prompt_message(message) == {'role': 'assistant', 'content': "（动作：wave、control_video）"}
+    assert prompt_message({'role': 'user', 'content': 'hi', 'extra': 1}) == {'role': 'user', 'content': 'hi'}
+
+
+def test_history_fills_newest_pairs_within_budget():
+    builder = ContextBuilder(budget=30, summarize=False)
+    messages, stats = builder.build("sys", history(3), "hi")
+    assert [m['content'] for m in messages] == ["sys", "u2", "a2", "u3", "a3", "hi"]
+    assert stats['history_messages'] == 4
+    assert stats['dropped_messages'] == 2
+    assert stats['prompt_tokens'] <= 30
+
+
+def test_pairs_are_not_split():
+    builder = ContextBuilder(budget=25, summarize=False)
+    messages, stats = builder.build("sys", history(3), "hi")
+    # 15 tokens left: one pair (10) fits, the half of the next does not
+    assert [m['content'] for m in messages] == ["sys", "u3", "a3", "hi"]
+    assert stats['dropped_messages'] == 4
+
+
+def test_tools_count_against_the_budget():
+    builder = ContextBuilder(budget=30, summarize=False)
+    tools = [{'type': 'function', 'function': {'name': 'control_video', 'description': 'x' * 40}}]
+    _, stats = builder.build("sys", history(3), "hi", tools=tools)
+    assert stats['history_messages'] < 4
+
+
+def test_rolling_summary_is_extended_incrementally():
+    summarizer = RecordingSummarizer()
+    builder = ContextBuilder(budget=40, summarize=True, summary_max_tokens=10, summarizer=summarizer)
+    messages, stats = builder.build("sys", history(3), "hi", session_id='s')
+    assert summarizer.calls == [["u1", "a1"]]
+    assert "之前的对话摘要" in messages[0]['content']
+    assert messages[0]['content'].endswith("你：a1")
+    assert stats['summary_tokens'] > 0
+
+    builder.build("sys", history(4), "hi", session_id='s')
+    assert summarizer.calls[-1] == ["u2", "a2"]
+
+    builder.forget('s')
+    builder.build("sys", history(4), "hi", session_id='s')
+    assert summarizer.calls[-1] == ["u1", "a1", "u2", "a2"]
+
+
+def test_summarized_turns_are_not_repeated_in_the_window():
+    builder = ContextBuilder(budget=40, summarize=True, summary_max_tokens=10)
+    _, stats = builder.build("s" * 20, history(3), "hi", session_id='s')
+    assert stats['dropped_messages'] == 4
+    # A shorter system prompt leaves room for u2/a2 again, but they are already summarized
+    messages, stats = builder.build("", history(3), "hi", session_id='s')
+    assert [m['content'] for m in messages[1:]] == ["u3", "a3", "hi"]
+    assert stats['dropped_messages'] == 4
+
+
+def test_summary_keeps_the_newest_lines_within_its_budget():
+    messages = [{'role': 'user', 'content': 'x' * 40}, {'role': 'assistant', 'content': 'ok'}]
+    summary = extractive_summary('你：older', messages, max_tokens=5)
+    assert summary == "你：ok"
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Tests for hedging.py: hedge budget, delay policy and the first-chunk race
+
+Upstream attempts are stood in for by start() functions that block on
+events, so each test decides which attempt answers first.
+
+Run: python -m pytest test_hedging.py
+"""
+import itertools
+import threading
+import time
+
+import pytest
+
+import hedging
+from hedging import HedgeBudget, HedgePolicy, RaceTimeout, race
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class Attempts:
+    """start() for race(): attempt N waits for release(N), then returns ('first-N', 'handle-N')"""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.gates = [threading.Event() for _ in range(4)]
+        self.counter = itertools.count()
+        self.closed = []
+
+    def start(self):
+        index = next(self.counter)
+        self.gates[index].wait(5)
+        if index in self.fail:
+            raise RuntimeError(f"attempt {index} failed")
+        return f"first-{index}", f"handle-{index}"
+
+    def release(self, index):
+        self.gates[index].set()
+
+    def close(self, handle):
+        self.closed.append(handle)
+
+
+def policy(delay='0.1', ratio=0.05, burst=2):
+    return HedgePolicy(enabled=True, delay=delay, budget=HedgeBudget(ratio, burst))
+
+
+def test_budget_caps_hedges_to_a_fraction_of_requests():
+    budget = HedgeBudget(ratio=0.5, burst=2)
+    assert budget.try_acquire()
+    assert not budget.try_acquire()
+    budget.record_request()
+    assert not budget.try_acquire()
+    budget.record_request()
+    assert budget.try_acquire()
+    # Tokens never exceed the burst
+    for _ in range(10):
+        budget.record_request()
+    assert budget.tokens == 2
+
+
+def test_percentile_delay_needs_samples():
+    hedge = HedgePolicy(enabled=True, delay='p90')
+    assert hedge.delay() == hedging.HEDGE_INITIAL_DELAY
+    for i in range(1, 101):
+        hedge.record_latency(i / 100)
+    assert hedge.delay() == pytest.approx(0.91)
+    assert HedgePolicy(enabled=True, delay='0.01').delay() == hedging.HEDGE_MIN_DELAY
+
+
+def test_fast_first_attempt_is_not_hedged():
+    attempts = Attempts()
+    attempts.release(0)
+    hedge = policy()
+    assert race(attempts.start, attempts.close, hedge) == ("first-0", "handle-0")
+    assert hedge.snapshot()['hedged'] == 0
+    assert attempts.closed == []
+
+
+def test_slow_first_attempt_is_hedged_and_the_loser_closed():
+    attempts = Attempts()
+    hedge = policy()
+    threading.Timer(0.3, attempts.release, args=(1,)).start()
+    assert race(attempts.start, attempts.close, hedge) == ("first-1", "handle-1")
+    snapshot = hedge.snapshot()
+    assert snapshot['hedged'] == 1
+    assert snapshot['hedge_wins'] == 1
+    # The original request is closed as soon as it answers
+    attempts.release(0)
+    wait_for(lambda: attempts.closed == ["handle-0"])
+
+
+def test_hedge_denied_without_budget():
+    attempts = Attempts()
+    hedge = policy()
+    assert hedge.budget.try_acquire()  # Spend the initial token
+    threading.Timer(0.3, attempts.release, args=(0,)).start()
+    assert race(attempts.start, attempts.close, hedge) == ("first-0", "handle-0")
+    snapshot = hedge.snapshot()
+    assert snapshot['hedged'] == 0
+    assert snapshot['budget_denied'] == 1
+
+
+def test_timeout_closes_the_late_attempt():
+    attempts = Attempts()
+    with pytest.raises(RaceTimeout):
+        race(attempts.start, attempts.close, timeout=0.1)
+    attempts.release(0)
+    wait_for(lambda: attempts.closed == ["handle-0"])
+
+
+def test_cancelled_race_returns_nothing():
+    attempts = Attempts()
+    cancelled = threading.Event()
+    threading.Timer(0.1, cancelled.set).start()
+    assert race(attempts.start, attempts.close, cancelled=cancelled) == (None, None)
+    attempts.release(0)
+    wait_for(lambda: attempts.closed == ["handle-0"])
+
+
+def test_failed_attempt_raises_when_nothing_else_runs():
+    attempts = Attempts(fail={0})
+    attempts.release(0)
+    with pytest.raises(RuntimeError, match="attempt 0 failed"):
+        race(attempts.start, attempts.close, policy())
+
+
+def test_hedge_wins_when_the_original_fails():
+    attempts = Attempts(fail={0})
+    hedge = policy()
+    threading.Timer(0.2, attempts.release, args=(1,)).start()
+    threading.Timer(0.3, attempts.release, args=(0,)).start()
+    assert race(attempts.start, attempts.close, hedge) == ("first-1", "handle-1")
+    assert attempts.closed == []
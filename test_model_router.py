@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Tests for model_router.py: turn classification, fallback order, profile
+overrides and ModelRouter.open() against a fake streaming call
+
+Run: python -m pytest test_model_router.py
+"""
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import model_router
+from circuit_breaker import CircuitBreaker, CircuitOpen
+from hedging import HedgePolicy
+from model_router import ModelRouter, classify, fallback_chain, load_profiles
+
+ACTIONS = [{'name': 'wave', 'keywords': ['挥手', 'wave']}]
+
+
+def response(status=200, code=None):
+    return SimpleNamespace(status_code=status, code=code)
+
+
+class FakeCall:
+    """Generation.call stand-in: answers per model from `replies`, records the params"""
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.calls = []
+
+    def __call__(self, **params):
+        self.calls.append(params)
+        reply = self.replies[params['model']]
+        if isinstance(reply, Exception):
+            raise reply
+        return iter([reply])
+
+
+def router(profiles=None, **kwargs):
+    r = ModelRouter(profiles or load_profiles(''), **kwargs)
+    r.hedges = {tier: HedgePolicy(enabled=False) for tier in model_router.TIERS}
+    r.breaker = CircuitBreaker('llm', 1.0, enabled=True, min_calls=2, error_rate=0.5)
+    return r
+
+
+def split_profiles():
+    profiles = load_profiles('')
+    for tier in model_router.TIERS:
+        profiles[tier]['model'] = f"model-{tier}"
+    return profiles
+
+
+def test_classify_routes_by_length_keyword_and_history(monkeypatch):
+    monkeypatch.setattr(model_router, 'MODEL_ROUTING', True)
+    assert classify("wave!", ACTIONS) == ('command', 'keyword wave')
+    assert classify("hello", ACTIONS) == ('chat', 'default')
+    after_action = [{'role': 'assistant', 'tool_calls': [{}]}]
+    assert classify("again", ACTIONS, after_action) == ('command', 'follows an action')
+    assert classify("x" * 40, ACTIONS)[0] == 'open'
+    monkeypatch.setattr(model_router, 'MODEL_ROUTING', False)
+    assert classify("wave!", ACTIONS) == ('chat', 'routing off')
+
+
+def test_fallback_chain_prefers_the_nearest_tier():
+    assert fallback_chain('command', 3) == ['command', 'chat', 'open']
+    assert fallback_chain('open', 3) == ['open', 'chat', 'command']
+    assert fallback_chain('chat', 2) == ['chat', 'open']
+    assert fallback_chain('chat', 0) == ['chat']
+
+
+def test_load_profiles_merges_overrides(tmp_path):
+    path = tmp_path / 'profiles.json'
+    path.write_text(json.dumps({'open': {'model': 'qwen-plus', 'max_tokens': 300}}))
+    profiles = load_profiles(str(path))
+    assert profiles['open']['model'] == 'qwen-plus'
+    assert profiles['open']['temperature'] == model_router.DEFAULT_PROFILES['open']['temperature']
+    assert profiles['chat'] == model_router.DEFAULT_PROFILES['chat']
+
+    path.write_text(json.dumps({'huge': {}}))
+    with pytest.raises(ValueError, match="Unknown model tier"):
+        load_profiles(str(path))
+
+
+def test_call_params_keep_the_lower_max_tokens():
+    r = router()
+    params = r.call_params('command', {'messages': [], 'max_tokens': 50})
+    assert params['max_tokens'] == 50
+    assert params['model'] == 'qwen-turbo'
+    assert 'first_chunk_timeout' not in params
+    assert r.call_params('chat', {'max_tokens': 500})['max_tokens'] == 200
+
+
+def test_open_serves_from_the_routed_tier():
+    r = router(split_profiles())
+    call = FakeCall({'model-command': response()})
+    tier, first, _ = r.open(call, 'command', {'messages': []})
+    assert (tier, first.status_code) == ('command', 200)
+    assert r.metrics.snapshot()['tiers']['command']['served'] == 1
+
+
+def test_open_falls_back_on_error_and_exception():
+    r = router(split_profiles())
+    call = FakeCall({'model-chat': response(500, 'InternalError'), 'model-open': response()})
+    tier, first, _ = r.open(call, 'chat', {'messages': []})
+    assert (tier, first.status_code) == ('open', 200)
+    snapshot = r.metrics.snapshot()
+    assert snapshot['tiers']['chat']['errors'] == 1
+    assert snapshot['classes']['chat']['fallbacks'] == 1
+
+    call = FakeCall({'model-chat': ConnectionError("reset"), 'model-open': response()})
+    assert r.open(call, 'chat', {'messages': []})[0] == 'open'
+    assert [c['model'] for c in call.calls] == ['model-chat', 'model-open']
+
+
+def test_last_tier_error_is_returned_and_trips_the_breaker():
+    r = router(split_profiles(), max_attempts=1)
+    call = FakeCall({'model-chat': response(503, 'Throttling')})
+    for _ in range(2):
+        tier, first, _ = r.open(call, 'chat', {'messages': []})
+        assert (tier, first.status_code) == ('chat', 503)
+    assert r.breaker.state == 'open'
+    with pytest.raises(CircuitOpen):
+        r.open(call, 'chat', {'messages': []})
+    assert len(call.calls) == 2
+
+
+def test_last_tier_exception_is_raised():
+    r = router(split_profiles(), max_attempts=1)
+    call = FakeCall({'model-chat': ConnectionError("reset")})
+    with pytest.raises(ConnectionError):
+        r.open(call, 'chat', {'messages': []})
+    assert r.metrics.snapshot()['tiers']['chat']['errors'] == 1
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Tests for session_turns.py: per-session turn serialization, supersession,
+cancellation and turn counters
+
+Run: python -m pytest test_session_turns.py
+"""
+import threading
+import time
+
+import pytest
+
+from session_turns import SessionTurns, TurnCancelled, TurnMetrics
+
+
+class Turn:
+    def __init__(self, turn_id=None):
+        self.turn_id = turn_id
+        self.cancel_reason = None
+
+    @property
+    def is_cancelled(self):
+        return self.cancel_reason is not None
+
+    def cancel(self, reason):
+        self.cancel_reason = reason
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_entry_exists_only_while_a_turn_runs():
+    turns = SessionTurns(lock_timeout=1)
+    turn = Turn()
+    turns.acquire('s', turn)
+    assert 's' in turns._sessions
+    turns.release('s', turn)
+    assert turns._sessions == {}
+
+
+def test_new_turn_supersedes_and_waits_for_the_previous():
+    turns = SessionTurns(lock_timeout=2)
+    first, second = Turn(), Turn()
+    turns.acquire('s', first)
+    acquired = threading.Event()
+
+    def run_second():
+        turns.acquire('s', second)
+        acquired.set()
+
+    threading.Thread(target=run_second, daemon=True).start()
+    wait_for(lambda: first.cancel_reason == 'superseded')
+    assert not acquired.wait(0.05)  # Waits until the first turn releases the session
+    turns.release('s', first)
+    assert acquired.wait(1)
+    assert not second.is_cancelled
+    turns.release('s', second)
+    assert turns._sessions == {}
+
+
+def test_superseded_waiting_turn_is_cancelled():
+    turns = SessionTurns(lock_timeout=2)
+    first, second, third = Turn(), Turn(), Turn()
+    turns.acquire('s', first)
+    errors = []
+
+    def run_second():
+        try:
+            turns.acquire('s', second)
+        except TurnCancelled as e:
+            errors.append(e.reason)
+
+    waiter = threading.Thread(target=run_second, daemon=True)
+    waiter.start()
+    wait_for(lambda: first.is_cancelled)
+    third_acquired = threading.Event()
+
+    def run_third():
+        turns.acquire('s', third)
+        third_acquired.set()
+
+    threading.Thread(target=run_third, daemon=True).start()
+    wait_for(lambda: second.is_cancelled)
+    turns.release('s', first)
+    waiter.join(1)
+    assert errors == ['superseded']
+    assert third_acquired.wait(1)
+    turns.release('s', third)
+    assert turns._sessions == {}
+
+
+def test_busy_session_times_out_and_leaves_no_entry():
+    turns = SessionTurns(lock_timeout=0.05)
+    holder, waiter = Turn(), Turn()
+    turns.acquire('s', holder)
+    with pytest.raises(TimeoutError):
+        turns.acquire('s', waiter)
+    turns.release('s', holder)
+    assert turns._sessions == {}
+
+
+def test_cancel_by_turn_id():
+    turns = SessionTurns(lock_timeout=1)
+    turn = Turn('t1')
+    assert not turns.cancel('s')
+    turns.acquire('s', turn)
+    assert not turns.cancel('s', turn_id='t0')
+    assert not turn.is_cancelled
+    assert turns.cancel('s', turn_id='t1')
+    assert turn.cancel_reason == 'client'
+    turns.release('s', turn)
+    assert not turns.cancel('s')
+
+
+def test_metrics_count_outcomes_and_wasted_time():
+    metrics = TurnMetrics()
+    for _ in range(5):
+        metrics.record_start()
+    metrics.record('completed', 1.0)
+    metrics.record('degraded', 0.5)
+    metrics.record('failed', 0.25)
+    metrics.record('cancelled', 2.0, 'superseded')
+    metrics.record_budget_stop()
+    snapshot = metrics.snapshot()
+    assert snapshot['in_flight'] == 1
+    assert snapshot['cancelled']['superseded'] == 1
+    assert snapshot['budget_stops'] == 1
+    assert snapshot['worker_seconds'] == 3.75
+    assert snapshot['wasted_worker_seconds'] == 2.0
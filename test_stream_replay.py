@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Tests for stream_replay.py: resumable chat streams
+
+A turn is stood in for by a generator of SSE frames; the tests read it
+through ReplayStream / ReplayStreams the way /api/chat/stream does, drop
+the reader, and resume with Last-Event-ID values.
+
+Run: python -m pytest test_stream_replay.py
+"""
+import threading
+import time
+
+from stream_replay import ReplayStream, ReplayStreams, parse_event_id
+
+
+def frames(count, gate=None, closed=None):
+    """Frames 'data: N', waiting on gate (a Semaphore) before each one when given"""
+    try:
+        for i in range(1, count + 1):
+            if gate is not None:
+                gate.acquire()
+            yield f"data: {i}\n\n"
+    finally:
+        if closed is not None:
+            closed.set()
+
+
+def payloads(events):
+    """'data: N' payloads of framed events, checking their id lines"""
+    result = []
+    for event in events:
+        id_line, data = event.split('\n', 1)
+        assert id_line.startswith('id: ')
+        result.append(data.strip())
+    return result
+
+
+def event_id(event):
+    return event.split('\n', 1)[0][len('id: '):]
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_parse_event_id():
+    assert parse_event_id('abc.12') == ('abc', 12)
+    assert parse_event_id(' abc.def.3 ') == ('abc.def', 3)
+    assert parse_event_id('abc') is None
+    assert parse_event_id('abc.x') is None
+    assert parse_event_id(None) is None
+
+
+def test_single_reader_gets_every_frame_once():
+    stream = ReplayStream('s1', 'session', frames(50))
+    events = list(stream.read())
+    assert payloads(events) == [f"data: {i}" for i in range(1, 51)]
+    assert [event_id(event) for event in events] == [f"s1.{i}" for i in range(1, 51)]
+    assert stream.finished
+
+
+def test_resume_mid_turn_follows_the_live_turn():
+    streams = ReplayStreams()
+    gate = threading.Semaphore(0)
+    stream = streams.open('session', frames(6, gate))
+
+    reader = stream.read()
+    for _ in range(3):
+        gate.release()
+    first = [next(reader) for _ in range(3)]
+    reader.close()  # Connection dropped after the 3rd event
+
+    resumed = streams.resume(event_id(first[1]), 'session')  # The client only saw event 2
+    assert resumed is not None
+    for _ in range(3):
+        gate.release()
+    rest = list(resumed)
+    assert payloads(rest) == ["data: 3", "data: 4", "data: 5", "data: 6"]
+    assert streams.snapshot()['resumed'] == 1
+
+
+def test_resume_after_finish_replays_the_tail():
+    streams = ReplayStreams()
+    stream = streams.open('session', frames(5))
+    events = list(stream.read())
+    resumed = streams.resume(event_id(events[2]), 'session')
+    assert payloads(resumed) == ["data: 4", "data: 5"]
+    # Resuming after the last event returns nothing more
+    assert list(streams.resume(event_id(events[-1]), 'session')) == []
+
+
+def test_resume_is_refused_for_another_session_or_unknown_stream():
+    streams = ReplayStreams()
+    stream = streams.open('session', frames(2))
+    events = list(stream.read())
+    assert streams.resume(event_id(events[0]), 'other-session') is None
+    assert streams.resume('unknown.1', 'session') is None
+    assert streams.resume('garbage', 'session') is None
+    assert streams.snapshot()['expired'] == 3
+
+
+def test_turn_keeps_running_without_a_reader():
+    gate = threading.Semaphore(0)
+    closed = threading.Event()
+    stream = ReplayStream('s1', 'session', frames(4, gate, closed), grace=5.0)
+    reader = stream.read()
+    gate.release()
+    next(reader)
+    reader.close()
+    # The drain thread pulls the rest of the turn while nobody reads
+    for _ in range(3):
+        gate.release()
+    wait_for(lambda: stream.finished)
+    assert stream.last_seq == 4
+    assert payloads(stream.read(1)) == ["data: 2", "data: 3", "data: 4"]
+
+
+def test_orphaned_turn_is_cancelled_after_grace():
+    cancelled = threading.Event()
+    gate = threading.Semaphore(0)
+    stream = ReplayStream('s1', 'session', frames(10, gate), on_orphaned=cancelled.set, grace=0.1)
+    reader = stream.read()
+    gate.release()
+    next(reader)
+    reader.close()
+    assert cancelled.wait(2.0)
+    assert stream.orphaned
+    for _ in range(10):
+        gate.release()  # Let the drain thread finish
+
+
+def test_reattaching_within_grace_keeps_the_turn():
+    cancelled = threading.Event()
+    gate = threading.Semaphore(0)
+    stream = ReplayStream('s1', 'session', frames(3, gate), on_orphaned=cancelled.set, grace=0.3)
+    reader = stream.read()
+    gate.release()
+    next(reader)
+    reader.close()
+    resumed = stream.read(1)
+    gate.release()
+    gate.release()
+    assert payloads(resumed) == ["data: 2", "data: 3"]
+    time.sleep(0.4)
+    assert not cancelled.is_set()
+
+
+def test_finished_turn_is_not_orphaned():
+    cancelled = threading.Event()
+    stream = ReplayStream('s1', 'session', frames(2), on_orphaned=cancelled.set, grace=0.05)
+    list(stream.read())
+    time.sleep(0.15)
+    assert not cancelled.is_set()
+
+
+def test_delivery_is_reported_once_a_reader_got_the_last_event():
+    delivered = []
+    stream = ReplayStream('s1', 'session', frames(3), on_delivered=lambda: delivered.append(1))
+    reader = stream.read()
+    next(reader)
+    next(reader)
+    next(reader)
+    assert delivered == []  # The last frame was handed out, but the reader has not come back for more
+    assert list(reader) == []
+    assert delivered == [1]
+    # Replaying the tail again does not report a second delivery
+    list(stream.read(1))
+    assert delivered == [1]
+
+
+def test_turn_drained_without_a_reader_is_not_delivered():
+    delivered = threading.Event()
+    gate = threading.Semaphore(0)
+    stream = ReplayStream('s1', 'session', frames(3, gate), on_delivered=delivered.set, grace=5.0)
+    reader = stream.read()
+    gate.release()
+    next(reader)
+    reader.close()
+    gate.release()
+    gate.release()
+    wait_for(lambda: stream.finished)
+    assert not delivered.is_set()
+    # A reconnect that reads the rest completes the delivery
+    assert payloads(stream.read(1)) == ["data: 2", "data: 3"]
+    assert delivered.is_set()
+
+
+def test_per_stream_buffer_drops_oldest_events():
+    stream = ReplayStream('s1', 'session', frames(100), max_bytes=200)
+    list(stream.read())
+    assert stream.size <= 200
+    assert not stream.available(0)
+    first = stream.events[0][0]
+    assert stream.available(first - 1)
+    assert payloads(stream.read(98)) == ["data: 99", "data: 100"]
+
+
+def test_finished_streams_expire_after_ttl():
+    streams = ReplayStreams(ttl=0.05)
+    stream = streams.open('session', frames(3))
+    events = list(stream.read())
+    time.sleep(0.1)
+    assert streams.resume(event_id(events[0]), 'session') is None
+    assert streams.snapshot()['buffers'] == 0
+
+
+def test_size_cap_evicts_oldest_finished_streams_only():
+    streams = ReplayStreams(max_bytes=400)
+    finished = []
+    for _ in range(3):
+        stream = streams.open('session', frames(10))
+        list(stream.read())
+        finished.append(stream)
+    gate = threading.Semaphore(0)
+    running = streams.open('session', frames(50, gate))
+    reader = running.read()
+    for _ in range(40):
+        gate.release()
+    for _ in range(40):
+        next(reader)
+
+    snapshot = streams.snapshot()
+    assert running.stream_id in streams.streams  # A running turn is never evicted
+    assert finished[0].stream_id not in streams.streams
+    assert snapshot['running'] == 1
+    for _ in range(10):
+        gate.release()
+    list(reader)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Tests for transition_model.py: learning clip transitions, ranked hints,
+count halving and saving / loading the model
+
+Run: python -m pytest test_transition_model.py
+"""
+import json
+import threading
+
+import pytest
+
+import transition_model
+from transition_model import START, TransitionModel
+
+CONFIG = {'sets': {
+    'dance': {'videos': [{'id': 'idle'}, {'id': 'twist'}, {'id': 'shake'}, {'id': 'stop'}]},
+}}
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(transition_model, 'TRANSITIONS', True)
+    monkeypatch.setattr(transition_model, 'TRANSITIONS_MIN_COUNT', 3)
+    monkeypatch.setattr(transition_model, 'TRANSITIONS_MAX_COUNT', 1000)
+
+
+def model(path=None):
+    return TransitionModel(config=lambda: CONFIG, path=path)
+
+
+def play(m, session_id, *videos):
+    for video in videos:
+        assert m.observe(session_id, 'dance', video)
+
+
+def test_hints_need_enough_observations():
+    m = model()
+    play(m, 'a', 'twist', 'shake')
+    play(m, 'b', 'twist', 'shake')
+    assert m.likely_next('dance', current='twist') == []
+    assert not m.has_hints()
+    play(m, 'c', 'twist', 'stop')
+    assert m.likely_next('dance', current='twist') == [{'video': 'shake', 'p': 0.667}, {'video': 'stop', 'p': 0.333}]
+    assert m.likely_next('dance', current=START) == [{'video': 'twist', 'p': 1.0}]
+    assert m.has_hints()
+
+
+def test_likely_next_follows_the_session():
+    m = model()
+    for session in 'abc':
+        play(m, session, 'twist', 'shake')
+    assert m.likely_next('dance', session_id='new')[0]['video'] == 'twist'
+    play(m, 'd', 'twist')
+    assert m.likely_next('dance', session_id='d')[0]['video'] == 'shake'
+    m.forget_session('d')
+    assert m.likely_next('dance', session_id='d')[0]['video'] == 'twist'
+
+
+def test_unknown_sets_and_clips_are_not_learned():
+    m = model()
+    assert not m.observe('a', 'dance', 'moonwalk')
+    assert not m.observe('a', 'karaoke', 'idle')
+    assert not m.observe('a', 'dance', '')
+    assert m.snapshot()['observations'] == 0
+
+
+def test_counts_halve_past_the_maximum(monkeypatch):
+    monkeypatch.setattr(transition_model, 'TRANSITIONS_MAX_COUNT', 4)
+    m = model()
+    for session in 'abcd':
+        play(m, session, 'twist')
+    play(m, 'e', 'shake')
+    # 4 x twist + 1 x shake = 5 > 4: twist halves to 2, shake (0) is dropped
+    assert m.counts['dance'][START] == {'twist': 2}
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = str(tmp_path / 'transitions.json')
+    m = model(path)
+    assert not m.save()  # Nothing changed yet
+    for session in 'abc':
+        play(m, session, 'twist', 'shake')
+    assert m.snapshot()['unsaved']
+    assert m.save()
+    assert not m.snapshot()['unsaved']
+    assert not m.save()
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f)['sets']['dance']['twist'] == {'shake': 3}
+
+    restored = model(path)
+    assert restored.likely_next('dance', current='twist') == [{'video': 'shake', 'p': 1.0}]
+
+
+def test_unreadable_file_starts_empty(tmp_path):
+    path = tmp_path / 'transitions.json'
+    path.write_text('{not json')
+    assert model(str(path)).counts == {}
+
+
+def test_concurrent_saves_write_the_latest_counts(tmp_path):
+    path = str(tmp_path / 'transitions.json')
+    m = model(path)
+
+    def observe_and_save(session):
+        for _ in range(20):
+            play(m, session, 'twist', 'idle')
+            m.save()
+
+    threads = [threading.Thread(target=observe_and_save, args=(f"s{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    m.save()
+    with open(path, encoding='utf-8') as f:
+        assert json.load(f)['sets'] == m.counts
+    assert not (tmp_path / 'transitions.json.tmp').exists()
+
+
+def test_annotate_adds_likely_next_to_trusted_sets():
+    m = model()
+    for session in 'abc':
+        play(m, session, 'twist', 'shake')
+    config = {'sets': {**CONFIG['sets'], 'other': {'videos': []}}}
+    annotated = m.annotate(config)
+    assert annotated['sets']['dance']['likelyNext'] == {START: ['twist'], 'twist': ['shake']}
+    assert 'likelyNext' not in annotated['sets']['other']
+    assert 'likelyNext' not in config['sets']['dance']
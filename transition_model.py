@@ -0,0 +1,192 @@
+"""
+Per-set action transition model for predictive prefetch hints
+
+Sessions of a set tend to follow the same paths (idle -> 扭 -> 抖 -> 停). Every
+clip a session plays on command - from a chat turn's function_call or from
+/api/intent (voice keyword or button) - is counted as a transition from the
+clip the session commanded before (or from START). The counts give ranked
+"likely next clips", sent with chat `done` events, /api/intent responses and
+config/videosets.json (`likelyNext` per set), so clients that cannot preload a
+whole set fetch only what they will probably play.
+
+The model is small: {set: {from clip: {to clip: count}}}, only for sets and
+clips that exist in videosets.json, with each state's counts halved once they
+pass TRANSITIONS_MAX_COUNT (recent behaviour weighs more, numbers stay small).
+It is saved to TRANSITIONS_FILE every TRANSITIONS_SAVE_SECONDS when changed,
+and on exit.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+TRANSITIONS = os.getenv('TRANSITIONS', 'true').lower() == 'true'
+TRANSITIONS_FILE = os.getenv('TRANSITIONS_FILE', '.transitions.json')
+TRANSITIONS_SAVE_SECONDS = float(os.getenv('TRANSITIONS_SAVE_SECONDS', '60'))
+# Hints returned per state, and observations a state needs before it is trusted
+TRANSITIONS_TOP = int(os.getenv('TRANSITIONS_TOP', '3'))
+TRANSITIONS_MIN_COUNT = int(os.getenv('TRANSITIONS_MIN_COUNT', '3'))
+TRANSITIONS_MAX_COUNT = int(os.getenv('TRANSITIONS_MAX_COUNT', '1000'))
+
+# State of a session that has not commanded a clip yet
+START = '_start'
+# Sessions whose last clip is remembered (least recently active dropped first)
+MAX_SESSIONS = 10000
+
+
+class TransitionModel:
+    """Transition counts per set, learned from the clips sessions command"""
+
+    def __init__(self, config=None, path=TRANSITIONS_FILE):
+        # config() -> parsed videosets.json (or None); only its sets and clips are learned
+        self.config = config
+        self.path = path
+        self._lock = threading.Lock()
+        # Serializes save() (saver thread and atexit) so writers never share the .tmp file
+        self._save_lock = threading.Lock()
+        self.counts = {}
+        self.sessions = OrderedDict()
+        self.observations = 0
+        self.version = 0
+        self._saved_version = 0
+        self._saver = None
+        self.last_saved = None
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.counts = json.load(f).get('sets', {})
+        except (OSError, ValueError) as e:
+            print(f"Transitions: cannot read {self.path}: {e}", flush=True)
+
+    def save(self):
+        """Write the counts if they changed; observations continue while the file is written"""
+        with self._save_lock:
+            with self._lock:
+                if self.version == self._saved_version or not self.path:
+                    return False
+                data = json.dumps({'sets': self.counts}, ensure_ascii=False, sort_keys=True)
+                version = self.version
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+            with self._lock:
+                self._saved_version = version
+                self.last_saved = time.time()
+        return True
+
+    def _start_saver(self):
+        """Background thread saving changes every TRANSITIONS_SAVE_SECONDS (started on first use)"""
+        if self._saver is not None or not self.path:
+            return
+
+        def run():
+            while True:
+                time.sleep(TRANSITIONS_SAVE_SECONDS)
+                try:
+                    self.save()
+                except OSError as e:
+                    print(f"Transitions: cannot save {self.path}: {e}", flush=True)
+
+        self._saver = threading.Thread(target=run, daemon=True, name='transitions-saver')
+        self._saver.start()
+        atexit.register(self.save)
+
+    def _known(self, set_id, video=None):
+        config = self.config() if self.config else None
+        if config is None:
+            return True
+        video_set = config.get('sets', {}).get(set_id)
+        if video_set is None:
+            return False
+        return video is None or any(v.get('id') == video for v in video_set.get('videos', []))
+
+    def observe(self, session_id, set_id, video):
+        """Count the session's move to video; returns False for unknown sets/clips"""
+        if not TRANSITIONS or not set_id or not video or not self._known(set_id, video):
+            return False
+        with self._lock:
+            key = (session_id, set_id)
+            previous = self.sessions.pop(key, START)
+            self.sessions[key] = video
+            if len(self.sessions) > MAX_SESSIONS:
+                self.sessions.popitem(last=False)
+
+            state = self.counts.setdefault(set_id, {}).setdefault(previous, {})
+            state[video] = state.get(video, 0) + 1
+            if sum(state.values()) > TRANSITIONS_MAX_COUNT:
+                for target in list(state):
+                    state[target] //= 2
+                    if not state[target]:
+                        del state[target]
+            self.observations += 1
+            self.version += 1
+        self._start_saver()
+        return True
+
+    def forget_session(self, session_id):
+        with self._lock:
+            for key in [key for key in self.sessions if key[0] == session_id]:
+                del self.sessions[key]
+
+    def _ranked(self, state, top):
+        total = sum(state.values())
+        if total < TRANSITIONS_MIN_COUNT:
+            return []
+        ranked = sorted(state.items(), key=lambda item: (-item[1], item[0]))[:top]
+        return [{'video': video, 'p': round(count / total, 3)} for video, count in ranked]
+
+    def likely_next(self, set_id, session_id=None, current=None, top=TRANSITIONS_TOP):
+        """[{'video', 'p'}] most likely after current (default: the session's last clip)"""
+        if not TRANSITIONS or not set_id:
+            return []
+        with self._lock:
+            if current is None:
+                current = self.sessions.get((session_id, set_id), START)
+            state = self.counts.get(set_id, {}).get(current)
+            if not state:
+                return []
+            return self._ranked(state, top)
+
+    def has_hints(self):
+        with self._lock:
+            return any(sum(state.values()) >= TRANSITIONS_MIN_COUNT
+                       for states in self.counts.values() for state in states.values())
+
+    def set_hints(self, set_id, top=TRANSITIONS_TOP):
+        """{from clip: [likely next clip ids]} for every trusted state of a set"""
+        with self._lock:
+            hints = {}
+            for current, state in self.counts.get(set_id, {}).items():
+                ranked = self._ranked(state, top)
+                if ranked:
+                    hints[current] = [entry['video'] for entry in ranked]
+            return hints
+
+    def annotate(self, config):
+        """Copy of a videosets.json config with `likelyNext` on the sets that have hints"""
+        if not TRANSITIONS:
+            return config
+        sets = {}
+        for set_id, video_set in config.get('sets', {}).items():
+            hints = self.set_hints(set_id)
+            sets[set_id] = {**video_set, 'likelyNext': hints} if hints else video_set
+        return {**config, 'sets': sets}
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'enabled': TRANSITIONS,
+                'observations': self.observations,
+                'sets': {set_id: {'states': len(states), 'transitions': sum(sum(s.values()) for s in states.values())}
+                         for set_id, states in self.counts.items()},
+                'sessions': len(self.sessions),
+                'unsaved': self.version != self._saved_version,
+                'last_saved': self.last_saved,
+            }
@@ -0,0 +1,244 @@
+"""
+DashScope text-to-speech helpers shared by the Flask app and offline tools
+"""
+import io
+import queue
+import re
+import threading
+import time
+
+from audio_formats import UPSTREAM_FORMATS, AudioCache, transcode
+from circuit_breaker import TTS_BREAKER_LATENCY, CircuitBreaker, CircuitOpen
+from hedging import TTS_HEDGING, HedgePolicy, race
+
+# Sweet female voice with emotion (sambert works correctly with streaming callbacks)
+DEFAULT_VOICE = 'sambert-zhimiao-emo-v1'
+DEFAULT_FORMAT = 'mp3'
+DEFAULT_SAMPLE_RATE = 22050
+
+# Frame size used when a whole (transcoded or cached) clip is sent over the socket
+STREAM_CHUNK_BYTES = 4096
+
+# Anything outside CJK, CJK punctuation, ASCII letters/digits and common
+# Chinese punctuation is stripped before synthesis (emojis break the API)
+UNSUPPORTED_CHARS = re.compile(r'[^\u4e00-\u9fff\u3000-\u303fa-zA-Z0-9\s，。！？、；：""''（）《》【】…—～]')
+
+
+# Replies like "好的" repeat, and a reply may be requested in more than one format
+speech_cache = AudioCache()
+
+# A slow first audio frame starts a second SpeechSynthesizer.call (see hedging.py)
+speech_hedge = HedgePolicy(TTS_HEDGING)
+
+# Rolling first-frame latency / error rate of SpeechSynthesizer.call (see circuit_breaker.py)
+speech_breaker = CircuitBreaker('tts', TTS_BREAKER_LATENCY)
+
+
+def clean_text(text):
+    """Remove emojis and special characters that might cause issues"""
+    return UNSUPPORTED_CHARS.sub('', text)
+
+
+def synthesize_speech(text, voice=DEFAULT_VOICE, audio_format=DEFAULT_FORMAT,
+                      sample_rate=DEFAULT_SAMPLE_RATE):
+    """Synthesize text with DashScope and return the audio bytes (None on failure)"""
+    # Use DashScope CosyVoice for TTS - with callback to collect audio
+    from dashscope.audio.tts import SpeechSynthesizer, ResultCallback
+
+    audio_buffer = io.BytesIO()
+    error_occurred = False
+
+    class AudioCallback(ResultCallback):
+        def on_open(self):
+            print("TTS: Stream opened", flush=True)
+
+        def on_complete(self):
+            print("TTS: Stream completed", flush=True)
+
+        def on_error(self, message: str):
+            nonlocal error_occurred
+            error_occurred = True
+            print(f"TTS error: {message}", flush=True)
+
+        def on_close(self):
+            print("TTS: Stream closed", flush=True)
+
+        def on_event(self, result):
+            if result.get_audio_frame():
+                audio_data = result.get_audio_frame()
+                audio_buffer.write(audio_data)
+                print(f"TTS: Received audio chunk of {len(audio_data)} bytes, total: {audio_buffer.tell()}", flush=True)
+
+    callback = AudioCallback()
+
+    print("TTS: Calling SpeechSynthesizer.call() with streaming callback...", flush=True)
+
+    try:
+        SpeechSynthesizer.call(
+            model=voice,
+            text=text,
+            format=audio_format,
+            sample_rate=sample_rate,
+            callback=callback
+        )
+        print(f"TTS: Call completed successfully", flush=True)
+    except KeyError as e:
+        # Expected bug in dashscope library - audio is already in buffer
+        print(f"TTS: Caught expected KeyError: {e} (audio already collected)", flush=True)
+    except Exception as e:
+        print(f"TTS: Unexpected error: {e}", flush=True)
+        import traceback
+        traceback.print_exc()
+
+    # Get the complete audio from buffer
+    full_audio = audio_buffer.getvalue()
+    print(f"TTS synthesis complete: {len(full_audio)} bytes total", flush=True)
+
+    if len(full_audio) > 0 and not error_occurred:
+        return full_audio
+    return None
+
+
+def stream_speech(text, voice=DEFAULT_VOICE, audio_format=DEFAULT_FORMAT,
+                  sample_rate=DEFAULT_SAMPLE_RATE):
+    """Yield audio frames as soon as DashScope produces them (raises RuntimeError on failure)"""
+    from dashscope.audio.tts import SpeechSynthesizer, ResultCallback
+
+    frames = queue.Queue()
+    finished = object()
+
+    class StreamCallback(ResultCallback):
+        def on_error(self, message):
+            frames.put(RuntimeError(f"TTS error: {message}"))
+
+        def on_event(self, result):
+            audio_data = result.get_audio_frame()
+            if audio_data:
+                frames.put(audio_data)
+
+    def run():
+        try:
+            SpeechSynthesizer.call(
+                model=voice,
+                text=text,
+                format=audio_format,
+                sample_rate=sample_rate,
+                callback=StreamCallback()
+            )
+        except KeyError:
+            # Expected bug in dashscope library - audio was already delivered
+            pass
+        except Exception as e:
+            frames.put(e)
+        finally:
+            frames.put(finished)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    while True:
+        item = frames.get()
+        if item is finished:
+            return
+        if isinstance(item, Exception):
+            raise RuntimeError(str(item))
+        yield item
+
+
+def hedged_stream_speech(text, voice=DEFAULT_VOICE, audio_format=DEFAULT_FORMAT,
+                         sample_rate=DEFAULT_SAMPLE_RATE):
+    """stream_speech, hedged on first-frame latency when TTS_HEDGING is on
+
+    The losing call cannot be aborted through the SDK; its frames are dropped.
+    """
+    if not speech_hedge.enabled:
+        yield from stream_speech(text, voice, audio_format, sample_rate)
+        return
+
+    def start():
+        frames = stream_speech(text, voice, audio_format, sample_rate)
+        return next(frames, None), frames
+
+    first, frames = race(start, lambda frames: frames.close(), speech_hedge, name='tts')
+    if first is None:
+        return
+    yield first
+    yield from frames
+
+
+def upstream_speech(text, voice=DEFAULT_VOICE, audio_format=DEFAULT_FORMAT,
+                    sample_rate=DEFAULT_SAMPLE_RATE):
+    """Frames from DashScope, guarded by the TTS circuit breaker
+
+    Raises CircuitOpen (on the first next()) without calling upstream while
+    the breaker is open; the first-frame latency and failures feed it.
+    """
+    if not speech_breaker.allow():
+        raise CircuitOpen('tts')
+    started = time.monotonic()
+    frames = hedged_stream_speech(text, voice, audio_format, sample_rate)
+    try:
+        first = next(frames, None)
+    except Exception:
+        speech_breaker.record_failure()
+        raise
+    if first is None:
+        speech_breaker.record_failure()
+        raise RuntimeError("TTS synthesis failed - no audio data")
+    speech_breaker.record_success(time.monotonic() - started)
+    yield first
+    yield from frames
+
+
+def _synthesize(text, voice, audio_format, sample_rate):
+    """Whole clip from upstream_speech (None on failure, CircuitOpen propagates)"""
+    try:
+        return b''.join(upstream_speech(text, voice, audio_format, sample_rate))
+    except RuntimeError as e:
+        print(f"TTS: {e}", flush=True)
+        return None
+
+
+def synthesize_as(text, audio_format=DEFAULT_FORMAT, sample_rate=DEFAULT_SAMPLE_RATE, voice=DEFAULT_VOICE):
+    """Audio bytes in any negotiable format (Opus is transcoded from pcm), cached per encoding
+
+    Raises CircuitOpen when the TTS breaker is open and the text is not cached.
+    """
+    key = speech_cache.key(text, voice, audio_format, sample_rate)
+    audio = speech_cache.get(key)
+    if audio is not None:
+        return audio
+
+    if audio_format in UPSTREAM_FORMATS:
+        audio = _synthesize(text, voice, audio_format, sample_rate)
+    else:
+        pcm = _synthesize(text, voice, 'pcm', sample_rate)
+        audio = transcode(pcm, 'pcm', audio_format, sample_rate) if pcm else None
+
+    if audio:
+        speech_cache.put(key, audio)
+    return audio
+
+
+def stream_as(text, audio_format=DEFAULT_FORMAT, sample_rate=DEFAULT_SAMPLE_RATE, voice=DEFAULT_VOICE):
+    """Frames for the socket: upstream formats stream as produced, transcoded ones arrive whole
+
+    Raises CircuitOpen on the first next() like synthesize_as.
+    """
+    key = speech_cache.key(text, voice, audio_format, sample_rate)
+    audio = speech_cache.get(key)
+
+    if audio is None and audio_format in UPSTREAM_FORMATS:
+        frames = []
+        for frame in upstream_speech(text, voice, audio_format, sample_rate):
+            frames.append(frame)
+            yield frame
+        speech_cache.put(key, b''.join(frames))
+        return
+
+    if audio is None:
+        audio = synthesize_as(text, audio_format, sample_rate, voice)
+        if not audio:
+            raise RuntimeError("TTS synthesis failed - no audio data")
+
+    for start in range(0, len(audio), STREAM_CHUNK_BYTES):
+        yield audio[start:start + STREAM_CHUNK_BYTES]